@@ -1,5 +1,19 @@
+import json
+import threading
 import time
 import pika
+from opentelemetry.trace import SpanKind
+
+from events import encode, is_event
+from tracing import inject_headers, start_span
+
+
+def encode_message(message):
+    """Encode an event envelope per EVENT_ENCODING, or a bare dict as JSON."""
+    if is_event(message):
+        return encode(message)
+    return json.dumps(message), "application/json"
+
 
 class RabbitMQClient:
     def __init__(self, hostname, port, exchange_name, exchange_type, max_retries=12, retry_interval=5):
@@ -11,6 +25,7 @@ class RabbitMQClient:
         self.retry_interval = retry_interval
         self.connection = None
         self.channel = None
+        self._publish_lock = threading.Lock()  # pika channels are not thread-safe
         self.connect()
 
     def connect(self):
@@ -66,8 +81,78 @@ class RabbitMQClient:
         except pika.exceptions.AMQPError:
             return False
 
+    def publish(self, routing_key, message, delivery_mode=2):
+        """
+        Publishes a message to the exchange.
+
+        Event envelopes (see events.py) are encoded with the configured encoding and
+        tagged with its content_type; bare dicts are sent as JSON. The current W3C
+        trace-context is added to the AMQP headers so the consumer can continue the
+        publisher's trace.
+
+        Args:
+            routing_key (str): Routing key on the exchange.
+            message (dict): An event envelope, or a JSON-serialisable message body.
+            delivery_mode (int): 2 for persistent messages, 1 for transient.
+        """
+        with start_span(f"publish {routing_key}", kind=SpanKind.PRODUCER,
+                        attributes={"messaging.destination": self.exchange_name,
+                                    "messaging.rabbitmq.routing_key": routing_key}):
+            body, content_type = encode_message(message)
+            properties = pika.BasicProperties(
+                delivery_mode=delivery_mode,
+                content_type=content_type,
+                headers=inject_headers(),
+            )
+            with self._publish_lock:
+                self.channel.basic_publish(
+                    exchange=self.exchange_name,
+                    routing_key=routing_key,
+                    body=body,
+                    properties=properties,
+                )
+
+    def publish_batch(self, messages, delivery_mode=2):
+        """
+        Publishes a batch of change events back-to-back while holding the channel once.
+
+        Used by cache_invalidation.ChangePublisher, whose background thread drains queued
+        ``<entity>.changed`` events in batches. The events come from many requests and are
+        published outside them, so they all carry the trace-context of the batch span.
+        (Purchase events go through makepayment's outbox instead.)
+
+        Args:
+            messages (list[tuple[str, dict]]): (routing_key, message) pairs, published in order;
+                each message is encoded as in publish().
+            delivery_mode (int): 2 for persistent messages, 1 for transient.
+        """
+        with start_span(f"publish batch ({len(messages)})", kind=SpanKind.PRODUCER,
+                        attributes={"messaging.destination": self.exchange_name,
+                                    "messaging.batch.message_count": len(messages)}):
+            headers = inject_headers()
+            encoded = [(routing_key, *encode_message(message)) for routing_key, message in messages]
+            with self._publish_lock:
+                for routing_key, body, content_type in encoded:
+                    self.channel.basic_publish(
+                        exchange=self.exchange_name,
+                        routing_key=routing_key,
+                        body=body,
+                        properties=pika.BasicProperties(
+                            delivery_mode=delivery_mode,
+                            content_type=content_type,
+                            headers=headers,
+                        ),
+                    )
+
     def start_consuming(self, queue_name, callback):
         """Starts consuming messages from a queue."""
+        def traced_callback(channel, method, properties, body):
+            with start_span(f"consume {method.routing_key}", kind=SpanKind.CONSUMER,
+                            parent_headers=properties.headers or {},
+                            attributes={"messaging.source": queue_name,
+                                        "messaging.rabbitmq.routing_key": method.routing_key}):
+                callback(channel, method, properties, body)
+
         while True:
             try:
                 if not self.is_connection_open():
@@ -76,7 +161,7 @@ class RabbitMQClient:
                 print(f"📥 Listening on queue: {queue_name}")
                 self.channel.basic_consume(
                     queue=queue_name,
-                    on_message_callback=callback,
+                    on_message_callback=traced_callback,
                     auto_ack=True
                 )
                 self.channel.start_consuming()
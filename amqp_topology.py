@@ -0,0 +1,207 @@
+"""
+Declarative RabbitMQ topology for ESD Lockdown Parker.
+
+Every exchange and queue the services rely on is described once here, and declared by
+both ``rabbitmq_setup/amqp_setup.py`` and the consumers at startup. Declaring is
+idempotent: re-running it against a broker that already has the topology is a no-op.
+
+Each queue can be bounded so that broker memory stays flat when consumers fall behind:
+    type         - "classic", "lazy" (classic queue paged to disk) or "quorum" (replicated, on disk)
+    max_length   - maximum number of ready messages (x-max-length)
+    overflow     - what happens at max_length: "drop-head", "reject-publish" or
+                   "reject-publish-dlx" (the overflowing message goes to the parking queue;
+                   classic/lazy queues only)
+    message_ttl  - milliseconds a message may wait before it is dead-lettered (x-message-ttl)
+    retry        - False to declare the queue without retry tiers
+
+Defaults are set per queue below and can be overridden from the environment:
+    AMQP_QUEUE_TYPE                - queue type for every queue (default: lazy)
+    AMQP_<QUEUE>_TYPE              - queue type for one queue, e.g. AMQP_NOTIFICATION_TYPE=quorum
+    AMQP_<QUEUE>_MAX_LENGTH        - e.g. AMQP_ACCESS_MAX_LENGTH=200000 (0 = unbounded)
+    AMQP_<QUEUE>_OVERFLOW
+    AMQP_<QUEUE>_MESSAGE_TTL       - (0 = no TTL)
+
+RabbitMQ does not allow the arguments of an existing queue to change. After changing any
+of these settings, delete the affected queue (or reset the broker with ``docker compose down -v``)
+before declaring again.
+"""
+
+import os
+
+import pika
+
+EXCHANGE_NAME = "park_topic"
+EXCHANGE_TYPE = "topic"
+
+DEAD_LETTER_EXCHANGE = "park_dlx"
+PARKING_QUEUE = "Parking"
+
+# Retry tiers: 5s, 20s, 80s, 320s
+RETRY_BASE_DELAY_MS = 5000
+RETRY_BACKOFF = 4
+RETRY_TIERS = 4
+RETRY_DELAYS_MS = [RETRY_BASE_DELAY_MS * RETRY_BACKOFF ** tier for tier in range(RETRY_TIERS)]
+
+QUEUE_TYPES = ("classic", "lazy", "quorum")
+OVERFLOW_POLICIES = ("drop-head", "reject-publish", "reject-publish-dlx")
+DEFAULT_QUEUE_TYPE = os.getenv("AMQP_QUEUE_TYPE", "lazy")
+
+# Queues bound to park_topic. A full queue sends the overflow to Parking where the
+# queue type allows it, so a backlog never silently loses OTP notifications.
+QUEUES = [
+    {"name": "Error", "routing_key": "*.error", "max_length": 100000, "overflow": "drop-head"},
+    {"name": "Access", "routing_key": "*.access", "max_length": 100000, "overflow": "reject-publish-dlx"},
+    {"name": "AccessAlert", "routing_key": "*.access", "max_length": 10000, "overflow": "reject-publish-dlx"},
+    {"name": "Occupancy", "routing_key": "*.access", "max_length": 100000, "overflow": "reject-publish-dlx"},
+    {"name": "Notification", "routing_key": "payment.notification", "max_length": 50000,
+     "overflow": "reject-publish-dlx"},
+]
+
+# Door commands are only useful for a few seconds; an expired one is parked, never executed late
+DOOR_COMMAND_TTL_MS = int(os.getenv("DOOR_COMMAND_TTL_MS", "10000"))
+
+# Parking keeps dead letters for a week for inspection and manual replay
+PARKING = {"name": PARKING_QUEUE, "routing_key": "#", "max_length": 100000, "overflow": "drop-head",
+           "message_ttl": 7 * 24 * 60 * 60 * 1000}
+
+
+def queues_named(*names):
+    """Return the definitions of the named queues from QUEUES, in the given order."""
+    by_name = {queue["name"]: queue for queue in QUEUES}
+    return [by_name[name] for name in names]
+
+
+def door_queue(door_id):
+    """Definition of the command queue of one door (``door.<door_id>.command``)."""
+    return {"name": f"Door.{door_id}", "routing_key": f"door.{door_id}.command", "max_length": 100,
+            "overflow": "drop-head", "message_ttl": DOOR_COMMAND_TTL_MS, "retry": False}
+
+
+def retry_queue_name(queue_name, tier):
+    """Name of the delay queue for the given (1-based) retry tier of a queue."""
+    return f"{queue_name}.retry.{tier}"
+
+
+def queue_settings(queue):
+    """
+    Resolve the effective settings of a queue definition, applying environment overrides.
+
+    Args:
+        queue (dict): A queue definition from QUEUES (or PARKING).
+
+    Returns:
+        dict: The definition with ``type``, ``max_length``, ``overflow`` and ``message_ttl`` resolved.
+
+    Raises:
+        ValueError: If a setting is invalid or not supported by the queue type.
+    """
+    prefix = f"AMQP_{queue['name'].upper()}_"
+    settings = dict(queue)
+    settings["type"] = os.getenv(f"{prefix}TYPE", queue.get("type", DEFAULT_QUEUE_TYPE))
+    for key in ("max_length", "message_ttl"):
+        value = int(os.getenv(f"{prefix}{key.upper()}", queue.get(key) or 0))
+        settings[key] = value or None
+    settings["overflow"] = os.getenv(f"{prefix}OVERFLOW", queue.get("overflow"))
+
+    if settings["type"] not in QUEUE_TYPES:
+        raise ValueError(f"Queue '{queue['name']}': unknown type '{settings['type']}'")
+    if settings["overflow"] is not None and settings["overflow"] not in OVERFLOW_POLICIES:
+        raise ValueError(f"Queue '{queue['name']}': unknown overflow policy '{settings['overflow']}'")
+    if settings["type"] == "quorum" and settings["overflow"] == "reject-publish-dlx":
+        # Quorum queues cannot dead-letter on overflow; refuse new messages instead
+        settings["overflow"] = "reject-publish"
+    return settings
+
+
+def queue_arguments(settings, dead_letter_exchange=DEAD_LETTER_EXCHANGE, dead_letter_routing_key=None):
+    """
+    Build the ``x-`` arguments for a resolved queue definition.
+
+    Args:
+        settings (dict): Output of queue_settings().
+        dead_letter_exchange (str, optional): Where rejected/expired/overflowing messages go.
+        dead_letter_routing_key (str, optional): Routing key to dead-letter with.
+
+    Returns:
+        dict: Arguments for ``queue_declare``.
+    """
+    arguments = {}
+    if settings["type"] == "quorum":
+        arguments["x-queue-type"] = "quorum"
+    elif settings["type"] == "lazy":
+        arguments["x-queue-mode"] = "lazy"
+    if settings.get("max_length"):
+        arguments["x-max-length"] = settings["max_length"]
+        if settings.get("overflow"):
+            arguments["x-overflow"] = settings["overflow"]
+    if settings.get("message_ttl"):
+        arguments["x-message-ttl"] = settings["message_ttl"]
+    if dead_letter_exchange is not None:
+        arguments["x-dead-letter-exchange"] = dead_letter_exchange
+    if dead_letter_routing_key is not None:
+        arguments["x-dead-letter-routing-key"] = dead_letter_routing_key
+    return arguments
+
+
+def _declare_queue(channel, name, arguments):
+    try:
+        channel.queue_declare(queue=name, durable=True, arguments=arguments)
+    except pika.exceptions.ChannelClosedByBroker as e:
+        if e.reply_code == 406:
+            raise Exception(
+                f"❌ Queue '{name}' already exists with different arguments ({e.reply_text}). "
+                f"Delete it (or reset the broker) and declare again."
+            ) from e
+        raise
+
+
+def declare_queue(channel, queue):
+    """
+    Declare one queue bound to park_topic, together with its retry tiers.
+
+    Each retry tier holds a message for its TTL and then dead-letters it, through the
+    default exchange, back onto the queue. Retry tiers share the queue's type but are
+    never length-limited, so a scheduled retry is not dropped.
+
+    Args:
+        channel (pika.adapters.blocking_connection.BlockingChannel): The channel connected to RabbitMQ.
+        queue (dict): A queue definition from QUEUES.
+    """
+    settings = queue_settings(queue)
+    print(f"📬 Declaring {settings['type']} queue: {queue['name']}")
+    _declare_queue(channel, queue["name"], queue_arguments(settings))
+    channel.queue_bind(exchange=EXCHANGE_NAME, queue=queue["name"], routing_key=queue["routing_key"])
+    if queue.get("retry") is False:
+        return
+
+    retry_settings = {"type": settings["type"]}
+    for tier, delay_ms in enumerate(RETRY_DELAYS_MS, start=1):
+        _declare_queue(channel, retry_queue_name(queue["name"], tier), queue_arguments(
+            dict(retry_settings, message_ttl=delay_ms),
+            dead_letter_exchange="",
+            dead_letter_routing_key=queue["name"],
+        ))
+
+
+def declare_topology(channel, queues=None):
+    """
+    Declare the exchanges, the parking queue and the given queues.
+
+    Args:
+        channel (pika.adapters.blocking_connection.BlockingChannel): The channel connected to RabbitMQ.
+        queues (list[dict], optional): Queue definitions to declare (default: all of QUEUES).
+
+    Raises:
+        Exception: If a queue already exists with different arguments.
+        ValueError: If a queue definition is invalid.
+    """
+    print(f"📦 Declaring exchange: {EXCHANGE_NAME}")
+    channel.exchange_declare(exchange=EXCHANGE_NAME, exchange_type=EXCHANGE_TYPE, durable=True)
+
+    print(f"🪦 Declaring dead-letter exchange: {DEAD_LETTER_EXCHANGE}")
+    channel.exchange_declare(exchange=DEAD_LETTER_EXCHANGE, exchange_type="topic", durable=True)
+    _declare_queue(channel, PARKING_QUEUE, queue_arguments(queue_settings(PARKING), dead_letter_exchange=None))
+    channel.queue_bind(exchange=DEAD_LETTER_EXCHANGE, queue=PARKING_QUEUE, routing_key=PARKING["routing_key"])
+
+    for queue in QUEUES if queues is None else queues:
+        declare_queue(channel, queue)
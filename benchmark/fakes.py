@@ -0,0 +1,425 @@
+#!/usr/bin/env python3
+"""
+Local stand-ins for the hosted dependencies of ESD Lockdown Parker.
+
+A single Flask app that impersonates, well enough for load testing:
+    /rest/v1/<table>            - PostgREST subset used by supabase-py (select/insert/update/upsert/delete)
+    /rest/v1/rpc/<function>     - the database functions of guest/wallet_ledger.sql
+    /v1/charges                 - Stripe Charges API
+    /bot<token>/sendMessage     - Telegram Bot API
+    /email                      - emailservice / Gmail send
+    /otp                        - OTP generator (Outsystems)
+    /bench/seed, /bench/stats   - seed data for the load driver and per-fake call counters
+
+Artificial latency (in milliseconds) can be added per fake to model the real services:
+    FAKE_LATENCY_SUPABASE, FAKE_LATENCY_STRIPE, FAKE_LATENCY_TELEGRAM, FAKE_LATENCY_EMAIL, FAKE_LATENCY_OTP
+
+Like PostgREST, a select returns at most FAKE_MAX_ROWS rows (default: 1000), however many
+were asked for.
+
+Usage:
+    python benchmark/fakes.py            # listens on 0.0.0.0:8099
+"""
+
+import itertools
+import os
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+
+from flask import Blueprint, Flask, jsonify, request
+
+# ------------------------------
+# Configuration
+# ------------------------------
+
+PORT = int(os.getenv("FAKES_PORT", "8099"))
+SEED_GUESTS = int(os.getenv("FAKE_SEED_GUESTS", "2000"))
+SEED_STAFF = int(os.getenv("FAKE_SEED_STAFF", "50"))
+SEED_LOCKED_STAFF = int(os.getenv("FAKE_SEED_LOCKED_STAFF", "5"))
+MAX_ROWS = int(os.getenv("FAKE_MAX_ROWS", "1000"))
+
+LATENCY_MS = {
+    name: float(os.getenv(f"FAKE_LATENCY_{name.upper()}", default))
+    for name, default in {
+        "supabase": "5", "stripe": "300", "telegram": "80", "email": "150", "otp": "20",
+    }.items()
+}
+
+# Primary key column per table; anything not listed uses "id"
+PRIMARY_KEYS = {"guest": "guest_id", "staff": "staff_id", "wallet_ledger": "entry_id"}
+
+app = Flask(__name__)
+fakes_blueprint = Blueprint("fakes", __name__)
+
+_lock = threading.Lock()
+_tables = {}
+_sequences = {}
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def simulate_latency(name):
+    """Sleep for the configured latency of a fake and count the call."""
+    with _stats_lock:
+        _stats[name] += 1
+    delay = LATENCY_MS.get(name, 0)
+    if delay:
+        time.sleep(delay / 1000.0)
+
+
+# ------------------------------
+# Seed Data
+# ------------------------------
+
+def seed():
+    """Populate the guest and staff tables with deterministic benchmark data."""
+    rng = random.Random(42)
+    otps = rng.sample(range(100000, 1000000), SEED_GUESTS)
+    _tables["guest"] = [
+        {
+            "guest_id": i,
+            "guest_name": f"Guest {i}",
+            "guest_email": f"guest{i}@bench.local",
+            "guest_tele": f"+6590{i:06d}",
+            "password": "guest",
+            "wallet": 1000,
+            "loyalty_points": 500,
+            "otp": otps[i - 1],
+            "otp_valid_datetime": None,
+            "chat_id": 100000 + i,
+        }
+        for i in range(1, SEED_GUESTS + 1)
+    ]
+    _tables["staff"] = [
+        {
+            "staff_id": i,
+            "staff_name": f"staff{i}",
+            "password": f"pw{i}",
+            "staff_tele": f"staff{i}",
+            "failed_attempts": 3 if i <= SEED_LOCKED_STAFF else 0,
+            "chat_id": 900000 + i,
+        }
+        for i in range(1, SEED_STAFF + 1)
+    ]
+    _tables["wallet_ledger"] = [
+        {"entry_id": g["guest_id"], "guest_id": g["guest_id"], "wallet_delta": g["wallet"],
+         "points_delta": g["loyalty_points"], "reason": "opening balance", "ref": f"opening:{g['guest_id']}"}
+        for g in _tables["guest"]
+    ]
+    _tables["logs"] = []
+    _tables["errorlogs"] = []
+    for table, rows in _tables.items():
+        pk = PRIMARY_KEYS.get(table, "id")
+        _sequences[table] = itertools.count(max((r[pk] for r in rows), default=0) + 1)
+
+
+# ------------------------------
+# PostgREST Filtering
+# ------------------------------
+
+def _coerce(value, reference):
+    """Coerce a query-string value to the type of the stored column value."""
+    if value == "null":
+        return None
+    if isinstance(reference, bool):
+        return value.lower() == "true"
+    if isinstance(reference, int):
+        try:
+            return int(value)
+        except ValueError:
+            return float(value)
+    if isinstance(reference, float):
+        return float(value)
+    return value
+
+
+def _matches(row, column, expression):
+    """Evaluate a single PostgREST filter expression (e.g. ``eq.5``) against a row."""
+    negate = expression.startswith("not.")
+    if negate:
+        expression = expression[4:]
+    op, _, raw = expression.partition(".")
+    raw = raw.strip('"')
+    current = row.get(column)
+
+    if op == "is":
+        result = current is None if raw == "null" else current == (raw == "true")
+    elif op == "in":
+        values = [v.strip('"') for v in raw.strip("()").split(",") if v]
+        result = current in [_coerce(v, current) for v in values]
+    else:
+        target = _coerce(raw, current)
+        if current is None or target is None:
+            result = op == "eq" and current is target
+        elif op == "eq":
+            result = current == target
+        elif op == "neq":
+            result = current != target
+        elif op == "gt":
+            result = current > target
+        elif op == "gte":
+            result = current >= target
+        elif op == "lt":
+            result = current < target
+        elif op == "lte":
+            result = current <= target
+        else:
+            result = False
+    return not result if negate else result
+
+
+RESERVED_PARAMS = {"select", "order", "limit", "offset", "on_conflict", "columns"}
+
+
+def _filtered(table):
+    """Return the rows of ``table`` matching the request's filter parameters."""
+    filters = [(k, v) for k, v in request.args.items(multi=True) if k not in RESERVED_PARAMS and k != "or"]
+    # or=(column.op.value,...): at least one of the terms matches
+    alternatives = [[term.split(".", 1) for term in v.strip("()").split(",")] for v in request.args.getlist("or")]
+    return [row for row in _tables.get(table, [])
+            if all(_matches(row, k, v) for k, v in filters)
+            and all(any(_matches(row, k, v) for k, v in terms) for terms in alternatives)]
+
+
+def _project(rows):
+    """Apply ``select=`` column projection, ordering and paging."""
+    order = request.args.get("order")
+    if order:
+        for clause in reversed(order.split(",")):
+            column, _, direction = clause.partition(".")
+            rows = sorted(rows, key=lambda r: (r.get(column) is None, r.get(column)),
+                          reverse=direction.startswith("desc"))
+
+    offset = int(request.args.get("offset", 0))
+    limit = request.args.get("limit")
+    range_header = request.headers.get("Range")
+    if range_header and "-" in range_header:
+        start, _, end = range_header.partition("-")
+        offset, limit = int(start), int(end) - int(start) + 1
+    limit = min(int(limit), MAX_ROWS) if limit is not None else MAX_ROWS
+    rows = rows[offset:offset + limit]
+
+    select = request.args.get("select", "*")
+    if select in ("*", ""):
+        return [dict(r) for r in rows]
+    columns = [c.strip() for c in select.split(",")]
+    return [{c: r.get(c) for c in columns} for r in rows]
+
+
+@fakes_blueprint.route("/rest/v1/<table>", methods=["GET", "HEAD"])
+def postgrest_select(table):
+    simulate_latency("supabase")
+    with _lock:
+        rows = _filtered(table)
+        response = jsonify(_project(rows))
+    if "count=exact" in request.headers.get("Prefer", ""):
+        response.headers["Content-Range"] = f"*/{len(rows)}"
+    return response, 200
+
+
+@fakes_blueprint.route("/rest/v1/<table>", methods=["POST"])
+def postgrest_insert(table):
+    simulate_latency("supabase")
+    payload = request.get_json()
+    rows = payload if isinstance(payload, list) else [payload]
+    pk = PRIMARY_KEYS.get(table, "id")
+    on_conflict = request.args.get("on_conflict")
+    merge = "merge-duplicates" in request.headers.get("Prefer", "")
+
+    with _lock:
+        stored = _tables.setdefault(table, [])
+        sequence = _sequences.setdefault(table, itertools.count(1))
+        result = []
+        for row in rows:
+            row = dict(row)
+            if merge:
+                keys = on_conflict.split(",") if on_conflict else [pk]
+                existing = next((r for r in stored if all(r.get(k) == row.get(k) for k in keys)), None)
+                if existing is not None:
+                    existing.update(row)
+                    result.append(dict(existing))
+                    continue
+            row.setdefault(pk, next(sequence))
+            stored.append(row)
+            result.append(dict(row))
+    return jsonify(result), 201
+
+
+@fakes_blueprint.route("/rest/v1/<table>", methods=["PATCH"])
+def postgrest_update(table):
+    simulate_latency("supabase")
+    changes = request.get_json() or {}
+    with _lock:
+        rows = _filtered(table)
+        for row in rows:
+            row.update(changes)
+        return jsonify([dict(r) for r in rows]), 200
+
+
+@fakes_blueprint.route("/rest/v1/<table>", methods=["DELETE"])
+def postgrest_delete(table):
+    simulate_latency("supabase")
+    with _lock:
+        rows = _filtered(table)
+        doomed = {id(r) for r in rows}
+        _tables[table] = [r for r in _tables.get(table, []) if id(r) not in doomed]
+        return jsonify(rows), 200
+
+
+def _postgrest_error(code, message, hint=None, status=400):
+    return jsonify({"code": code, "message": message, "hint": hint, "details": None}), status
+
+
+def _staff_login_rpc(function, params):
+    """staff_login_failed / staff_login_succeeded from staff/staff_lockout.sql."""
+    with _lock:
+        staff = next((s for s in _tables["staff"] if s["staff_id"] == params["p_staff_id"]), None)
+        if staff is None:
+            return jsonify([]), 200
+        failed = staff.get("failed_attempts") or 0
+        if function == "staff_login_succeeded":
+            if failed >= params["p_max_attempts"]:
+                return jsonify([]), 200
+            staff.update(failed_attempts=0, failed_window_start=None)
+        elif failed < params["p_max_attempts"]:
+            now = time.time()
+            if not failed or staff.get("failed_window_start") is None \
+                    or staff["failed_window_start"] < now - params["p_window_seconds"]:
+                staff.update(failed_attempts=1, failed_window_start=now)
+            else:
+                staff["failed_attempts"] = failed + 1
+        return jsonify([dict(staff)]), 200
+
+
+@fakes_blueprint.route("/rest/v1/rpc/<function>", methods=["POST"])
+def postgrest_rpc(function):
+    simulate_latency("supabase")
+    params = request.get_json(silent=True) or {}
+    if function == "wallet_snapshot":
+        return jsonify(0), 200
+    if function in ("staff_login_failed", "staff_login_succeeded"):
+        return _staff_login_rpc(function, params)
+    if function == "wallet_post":
+        with _lock:
+            return _wallet_post(params.get("entries", []))
+    if function == "wallet_issue_ticket":
+        with _lock:
+            posted = _wallet_post(params.get("entries", []))
+            if posted[1] != 200:
+                return posted
+            guest = next((g for g in _tables["guest"] if g["guest_id"] == params["p_guest_id"]), None)
+            if guest is None:
+                return jsonify([]), 200
+            guest.update(otp=params["p_otp"], otp_valid_datetime=None)
+            return jsonify([dict(guest)]), 200
+    return _postgrest_error("PGRST202", f"Could not find the function public.{function}", status=404)
+
+
+def _wallet_post(entries):
+    """wallet_post from guest/wallet_ledger.sql; the caller holds _lock."""
+    guests = {g["guest_id"]: g for g in _tables["guest"]}
+    ledger = _tables["wallet_ledger"]
+    refs = {e["ref"] for e in ledger if e.get("ref")}
+    entries = [e for e in entries if not e.get("ref") or e["ref"] not in refs]
+    if any(e["guest_id"] not in guests for e in entries):
+        return _postgrest_error("23503", "violates foreign key constraint", status=409)
+
+    balances = {}
+    for e in entries:
+        wallet, points = balances.get(e["guest_id"], (guests[e["guest_id"]].get("wallet") or 0,
+                                                      guests[e["guest_id"]].get("loyalty_points") or 0))
+        balances[e["guest_id"]] = (wallet + (e.get("wallet_delta") or 0), points + (e.get("points_delta") or 0))
+    if any(e.get("require_funds") and min(balances[e["guest_id"]]) < 0 for e in entries):
+        return _postgrest_error("P0001", "insufficient funds", hint="insufficient_funds")
+
+    sequence = _sequences["wallet_ledger"]
+    for e in entries:
+        ledger.append({"entry_id": next(sequence), "guest_id": e["guest_id"],
+                       "wallet_delta": e.get("wallet_delta") or 0, "points_delta": e.get("points_delta") or 0,
+                       "reason": e.get("reason"), "ref": e.get("ref")})
+    for guest_id, (wallet, points) in balances.items():
+        guests[guest_id].update(wallet=wallet, loyalty_points=points)
+    return jsonify([dict(guests[guest_id]) for guest_id in balances]), 200
+
+
+# ------------------------------
+# Stripe, Telegram, Email, OTP
+# ------------------------------
+
+@fakes_blueprint.route("/v1/charges", methods=["POST"])
+def stripe_charge():
+    simulate_latency("stripe")
+    form = request.form
+    return jsonify({
+        "id": f"ch_{uuid.uuid4().hex[:24]}",
+        "object": "charge",
+        "amount": int(form.get("amount", 0)),
+        "currency": form.get("currency", "sgd"),
+        "description": form.get("description"),
+        "paid": True,
+        "status": "succeeded",
+        "created": int(time.time()),
+    }), 200
+
+
+@fakes_blueprint.route("/bot<token>/sendMessage", methods=["POST"])
+def telegram_send_message(token):
+    simulate_latency("telegram")
+    data = request.get_json(silent=True) or request.form
+    return jsonify({
+        "ok": True,
+        "result": {"message_id": _stats["telegram"], "chat": {"id": data.get("chat_id")}, "text": data.get("text")},
+    }), 200
+
+
+@fakes_blueprint.route("/email", methods=["POST"])
+def send_email():
+    simulate_latency("email")
+    return jsonify({"message_id": uuid.uuid4().hex, "status": "Email sent successfully"}), 200
+
+
+@fakes_blueprint.route("/otp", methods=["GET"])
+def generate_otp():
+    simulate_latency("otp")
+    return jsonify(random.randint(100000, 999999)), 200
+
+
+# ------------------------------
+# Benchmark Control
+# ------------------------------
+
+@fakes_blueprint.route("/bench/seed", methods=["GET"])
+def bench_seed():
+    """Expose the seeded identities so the load driver can build realistic requests."""
+    with _lock:
+        return jsonify({
+            "guests": [{"guest_id": g["guest_id"], "otp": g["otp"]} for g in _tables["guest"]],
+            "staff": [
+                {"staff_id": s["staff_id"], "staff_name": s["staff_name"], "password": s["password"],
+                 "locked": s["failed_attempts"] >= 3}
+                for s in _tables["staff"]
+            ],
+        }), 200
+
+
+@fakes_blueprint.route("/bench/stats", methods=["GET"])
+def bench_stats():
+    return jsonify(dict(_stats)), 200
+
+
+@fakes_blueprint.route("/bench/reset", methods=["POST"])
+def bench_reset():
+    with _lock:
+        seed()
+        _stats.clear()
+    return jsonify({"message": "Fakes reset"}), 200
+
+
+seed()
+app.register_blueprint(fakes_blueprint)
+
+if __name__ == "__main__":
+    app.run(host="0.0.0.0", port=PORT, threaded=True)
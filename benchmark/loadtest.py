@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""
+End-to-end load test for ESD Lockdown Parker.
+
+Drives the running services (normally started with the benchmark compose override, so every
+hosted dependency is replaced by ``benchmark/fakes.py``) through a set of scenarios and reports
+p50/p95/p99 latency and throughput per endpoint.
+
+Scenarios:
+    entry_burst      - park opening: many guests and staff hitting the gates at once
+    payment_peak     - concurrent ticket purchases (card, wallet, loyalty) and wallet top-ups
+    broadcast_storm  - repeated entry attempts by locked staff, each fanned out to every staff chat
+
+Usage:
+    docker compose -f docker-compose.yml -f docker-compose.bench.yml up --build -d
+    python benchmark/loadtest.py --scenario all --duration 30 --concurrency 50
+    python benchmark/loadtest.py --baseline benchmark/baseline.json   # fail on regressions
+
+Results are written as JSON (``--out``) so they can be committed as the baseline for a release
+and compared against on the next one.
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+# ------------------------------
+# Configuration
+# ------------------------------
+
+DEFAULT_URLS = {
+    "fakes": os.getenv("BENCH_FAKES_URL", "http://localhost:8099"),
+    "enterpark": os.getenv("BENCH_ENTERPARK_URL", "http://localhost:8085/enterpark"),
+    "makepayment": os.getenv("BENCH_MAKEPAYMENT_URL", "http://localhost:8087/makepayment"),
+    "guest": os.getenv("BENCH_GUEST_URL", "http://localhost:8082/guest"),
+    "log": os.getenv("BENCH_LOG_URL", "http://localhost:8084/log"),
+}
+
+CHARGE = {"amount": 10, "currency": "sgd", "source": "tok_visa", "description": "Benchmark ticket"}
+
+
+# ------------------------------
+# Measurement
+# ------------------------------
+
+class Recorder:
+    """Thread-safe collection of per-endpoint latencies and error counts."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.started = time.perf_counter()
+        self.finished = None
+
+    def record(self, endpoint, seconds, ok):
+        with self._lock:
+            self.latencies[endpoint].append(seconds)
+            if not ok:
+                self.errors[endpoint] += 1
+
+    def stop(self):
+        self.finished = time.perf_counter()
+
+    def summary(self):
+        elapsed = (self.finished or time.perf_counter()) - self.started
+        result = {}
+        for endpoint, samples in sorted(self.latencies.items()):
+            ordered = sorted(samples)
+            result[endpoint] = {
+                "requests": len(ordered),
+                "errors": self.errors[endpoint],
+                "p50_ms": percentile(ordered, 50) * 1000,
+                "p95_ms": percentile(ordered, 95) * 1000,
+                "p99_ms": percentile(ordered, 99) * 1000,
+                "max_ms": ordered[-1] * 1000,
+                "throughput_rps": len(ordered) / elapsed if elapsed else 0.0,
+            }
+        return result
+
+
+def percentile(ordered, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not ordered:
+        return 0.0
+    rank = max(1, int(round(pct / 100.0 * len(ordered))))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def timed(recorder, session, endpoint, method, url, ok_statuses=(200,), **kwargs):
+    """Issue one request and record its latency under ``endpoint``."""
+    start = time.perf_counter()
+    try:
+        response = session.request(method, url, timeout=30, **kwargs)
+        ok = response.status_code in ok_statuses
+    except requests.exceptions.RequestException:
+        ok = False
+    recorder.record(endpoint, time.perf_counter() - start, ok)
+
+
+# ------------------------------
+# Scenarios
+# ------------------------------
+
+def entry_burst(session, recorder, urls, seed_data, rng):
+    """A guest (or, occasionally, a staff member) arrives at the gate."""
+    roll = rng.random()
+    if roll < 0.80:
+        otp = rng.choice(seed_data["guests"])["otp"]
+        timed(recorder, session, "GET /enterpark/guest/<otp>", "GET",
+              f"{urls['enterpark']}/guest/{otp}")
+    elif roll < 0.90:
+        # Mistyped OTP at the keypad
+        timed(recorder, session, "GET /enterpark/guest/<otp> (invalid)", "GET",
+              f"{urls['enterpark']}/guest/{rng.randint(1, 99999)}", ok_statuses=(404,))
+    else:
+        staff = rng.choice([s for s in seed_data["staff"] if not s["locked"]])
+        timed(recorder, session, "POST /enterpark/staff", "POST", f"{urls['enterpark']}/staff",
+              json={"staff_name": staff["staff_name"], "password": staff["password"]})
+
+
+def payment_peak(session, recorder, urls, seed_data, rng):
+    """A guest buys a ticket or tops up their wallet."""
+    guest_id = rng.choice(seed_data["guests"])["guest_id"]
+    route = rng.choice(["buyticket", "buyticket", "buyticketbywallet", "buyticketbyloyalty", "topupwallet"])
+    timed(recorder, session, f"POST /makepayment/{route}", "POST", f"{urls['makepayment']}/{route}",
+          json={"charge": CHARGE, "guest_id": guest_id})
+
+
+def broadcast_storm(session, recorder, urls, seed_data, rng):
+    """A locked staff member keeps trying the door; every attempt alerts all staff on Telegram."""
+    staff = rng.choice([s for s in seed_data["staff"] if s["locked"]])
+    timed(recorder, session, "POST /enterpark/staff (locked)", "POST", f"{urls['enterpark']}/staff",
+          ok_statuses=(403,), json={"staff_name": staff["staff_name"], "password": staff["password"]})
+
+
+SCENARIOS = {
+    "entry_burst": entry_burst,
+    "payment_peak": payment_peak,
+    "broadcast_storm": broadcast_storm,
+}
+
+
+def run_scenario(name, urls, seed_data, duration, concurrency):
+    """Run one scenario closed-loop with ``concurrency`` workers for ``duration`` seconds."""
+    recorder = Recorder()
+    step = SCENARIOS[name]
+    deadline = time.perf_counter() + duration
+    start_gate = threading.Barrier(concurrency)
+
+    def worker(index):
+        rng = random.Random(index)
+        with requests.Session() as session:
+            start_gate.wait()  # release every worker at once, like the gates opening
+            while time.perf_counter() < deadline:
+                step(session, recorder, urls, seed_data, rng)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, range(concurrency)))
+    recorder.stop()
+    return recorder.summary()
+
+
+# ------------------------------
+# Reporting
+# ------------------------------
+
+def print_report(results):
+    header = f"{'endpoint':<42} {'reqs':>7} {'err':>5} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'rps':>8}"
+    for scenario, endpoints in results["scenarios"].items():
+        print(f"\n📊 {scenario}")
+        print(header)
+        print("-" * len(header))
+        for endpoint, s in endpoints.items():
+            print(f"{endpoint:<42} {s['requests']:>7} {s['errors']:>5} {s['p50_ms']:>9.1f} "
+                  f"{s['p95_ms']:>9.1f} {s['p99_ms']:>9.1f} {s['throughput_rps']:>8.1f}")
+    if results.get("fakes"):
+        print(f"\n📨 Downstream calls seen by fakes: {results['fakes']}")
+
+
+def compare_to_baseline(results, baseline, tolerance):
+    """
+    Compare results with a previous run.
+
+    Returns:
+        list[str]: Human-readable descriptions of every regression beyond ``tolerance``.
+    """
+    regressions = []
+    for scenario, endpoints in results["scenarios"].items():
+        for endpoint, current in endpoints.items():
+            previous = baseline.get("scenarios", {}).get(scenario, {}).get(endpoint)
+            if not previous:
+                continue
+            for metric in ("p95_ms", "p99_ms"):
+                if previous[metric] and current[metric] > previous[metric] * (1 + tolerance):
+                    regressions.append(f"{scenario} {endpoint} {metric}: "
+                                       f"{previous[metric]:.1f} -> {current[metric]:.1f}")
+            if previous["throughput_rps"] and \
+                    current["throughput_rps"] < previous["throughput_rps"] * (1 - tolerance):
+                regressions.append(f"{scenario} {endpoint} throughput_rps: "
+                                   f"{previous['throughput_rps']:.1f} -> {current['throughput_rps']:.1f}")
+    return regressions
+
+
+# ------------------------------
+# Entry Point
+# ------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="ESD Lockdown Parker load test")
+    parser.add_argument("--scenario", default="all", choices=["all", *SCENARIOS])
+    parser.add_argument("--duration", type=float, default=30, help="seconds per scenario")
+    parser.add_argument("--concurrency", type=int, default=50, help="concurrent clients per scenario")
+    parser.add_argument("--out", default="benchmark/results.json", help="where to write the JSON results")
+    parser.add_argument("--baseline", help="previous results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.20, help="allowed relative regression")
+    parser.add_argument("--release", default=os.getenv("BENCH_RELEASE", "dev"), help="label stored with the results")
+    for name, url in DEFAULT_URLS.items():
+        parser.add_argument(f"--{name}-url", default=url)
+    args = parser.parse_args()
+
+    urls = {name: getattr(args, f"{name}_url") for name in DEFAULT_URLS}
+    requests.post(f"{urls['fakes']}/bench/reset", timeout=30).raise_for_status()
+    seed_data = requests.get(f"{urls['fakes']}/bench/seed", timeout=30).json()
+
+    scenarios = list(SCENARIOS) if args.scenario == "all" else [args.scenario]
+    results = {"release": args.release, "duration_s": args.duration,
+               "concurrency": args.concurrency, "scenarios": {}}
+    for name in scenarios:
+        print(f"🚀 Running {name} for {args.duration:.0f}s with {args.concurrency} clients...")
+        results["scenarios"][name] = run_scenario(name, urls, seed_data, args.duration, args.concurrency)
+    results["fakes"] = requests.get(f"{urls['fakes']}/bench/stats", timeout=30).json()
+
+    print_report(results)
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\n💾 Results written to {args.out}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare_to_baseline(results, json.load(f), args.tolerance)
+        if regressions:
+            print("\n❌ Performance regressions against baseline:")
+            for line in regressions:
+                print(f"   {line}")
+            sys.exit(1)
+        print("\n✅ No regressions against baseline.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+"""
+Change-data events for guest and staff rows, and the client-side helper that turns them into
+cache invalidations.
+
+After every successful insert, update or delete, the guest and staff services publish a
+``<entity>.changed`` event on park_topic (``guest.changed``, ``staff.changed``):
+
+    {"guest_id": 42, "op": "update", "fields": ["wallet"], "version": 1740000000123456}
+
+    op       - "insert", "update" or "delete"
+    fields   - names of the columns written (values are not included; fetch the row if needed)
+    version  - microseconds since the epoch at the write, strictly increasing per publisher;
+               for one id, a higher version is a later change
+    otp      - guest.changed only: the new OTP when ``otp`` is among the fields
+
+``ChangePublisher`` queues events and publishes them from a background thread, so a slow or
+unreachable broker never delays the response to the write. While the broker is unreachable up
+to CHANGE_QUEUE_SIZE events wait; later ones are dropped and logged. Change events are hints:
+a cache fed by them must still expire its entries.
+
+``CacheInvalidator`` subscribes to the change events through a private, auto-deleted queue
+and calls back per entity:
+
+    invalidator = CacheInvalidator()
+    invalidator.watch("staff", on_change=lambda change: cache.pop(change["staff_id"], None),
+                      on_reset=cache.clear)
+    invalidator.start()
+
+Events that are not newer than the last one seen for the same id are skipped. ``on_reset``
+is called on every (re)connect, because changes may have been missed while disconnected.
+
+Environment:
+    CHANGE_EVENTS_ENABLED   - "false" to neither publish nor subscribe (default: true)
+    CHANGE_QUEUE_SIZE       - change events waiting for the broker at most (default: 10000)
+    AMQP_HOST               - (default: rabbitmq)
+    AMQP_PORT               - (default: 5672)
+"""
+
+import logging
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+import pika
+
+from amqp_topology import EXCHANGE_NAME, EXCHANGE_TYPE
+from events import decode, make_event
+
+CHANGE_EVENTS_ENABLED = os.getenv("CHANGE_EVENTS_ENABLED", "true").lower() == "true"
+QUEUE_SIZE = int(os.getenv("CHANGE_QUEUE_SIZE", "10000"))
+AMQP_HOST = os.getenv("AMQP_HOST", "rabbitmq")
+AMQP_PORT = int(os.getenv("AMQP_PORT", "5672"))
+OPS = ("insert", "update", "delete")
+MAX_TRACKED_VERSIONS = 100000
+RETRY_INTERVAL = 5
+
+
+class ChangePublisher:
+    """
+    Publishes ``<entity>.changed`` events without blocking the caller.
+
+    Args:
+        source (str): Name of the publishing service.
+        enabled (bool): False to discard every change (default: CHANGE_EVENTS_ENABLED).
+    """
+
+    def __init__(self, source, enabled=CHANGE_EVENTS_ENABLED):
+        self.source = source
+        self.enabled = enabled
+        self._pending = queue.Queue(maxsize=QUEUE_SIZE)
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._version_lock = threading.Lock()
+        self._last_version = 0
+
+    def _next_version(self):
+        with self._version_lock:
+            self._last_version = max(self._last_version + 1, time.time_ns() // 1000)
+            return self._last_version
+
+    def publish(self, entity, entity_id, op, fields=(), **extra):
+        """
+        Queue a change event for one row.
+
+        Args:
+            entity (str): "guest" or "staff".
+            entity_id (int): The row's id.
+            op (str): "insert", "update" or "delete".
+            fields (Iterable[str]): Columns written.
+            **extra: Further payload fields allowed by the event schema (e.g. ``otp``).
+        """
+        if not self.enabled or entity_id is None:
+            return
+        if op not in OPS:
+            raise ValueError(f"Unknown change operation '{op}'")
+        data = {f"{entity}_id": entity_id, "op": op, "version": self._next_version(), "fields": sorted(fields)}
+        data.update((key, value) for key, value in extra.items() if value is not None)
+        event = make_event(f"{entity}.changed", data, self.source)
+
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="change-publisher", daemon=True)
+                self._thread.start()
+        try:
+            self._pending.put_nowait((f"{entity}.changed", event))
+        except queue.Full:
+            logging.warning("Change event queue full; dropping %s.changed for %s", entity, entity_id)
+
+    def _run(self):
+        from RabbitMQClient import RabbitMQClient
+
+        client = None
+        batch = []
+        while True:
+            if not batch:
+                batch.append(self._pending.get())
+            # Whatever else is already waiting goes out with it
+            while len(batch) < 100:
+                try:
+                    batch.append(self._pending.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                if client is None:
+                    client = RabbitMQClient(AMQP_HOST, AMQP_PORT, EXCHANGE_NAME, EXCHANGE_TYPE, max_retries=1)
+                client.publish_batch(batch, delivery_mode=1)
+                batch = []
+            except Exception as e:
+                logging.warning("Publishing change events failed (%s); retrying in %s seconds", e, RETRY_INTERVAL)
+                client = None
+                time.sleep(RETRY_INTERVAL)
+
+
+class CacheInvalidator:
+    """
+    Calls back on ``<entity>.changed`` events, in a daemon thread.
+
+    Args:
+        enabled (bool): False to never subscribe (default: CHANGE_EVENTS_ENABLED).
+    """
+
+    def __init__(self, enabled=CHANGE_EVENTS_ENABLED):
+        self.enabled = enabled
+        self.connected = False
+        self._watchers = {}              # entity -> [(on_change, on_reset)]
+        self._versions = OrderedDict()   # (entity, id) -> last version seen
+        self._thread = None
+
+    def watch(self, entity, on_change, on_reset=None):
+        """
+        Register callbacks for one entity.
+
+        Args:
+            entity (str): "guest" or "staff".
+            on_change (Callable[[dict], None]): Called with the payload of each newer change.
+            on_reset (Callable[[], None], optional): Called on every (re)connect; should drop
+                everything cached for the entity.
+        """
+        self._watchers.setdefault(entity, []).append((on_change, on_reset))
+
+    def start(self):
+        """Start consuming in a daemon thread (no-op if disabled or already started)."""
+        if self.enabled and self._thread is None:
+            self._thread = threading.Thread(target=self._run_forever, name="cache-invalidator", daemon=True)
+            self._thread.start()
+
+    def _is_newer(self, entity, data):
+        key = (entity, data[f"{entity}_id"])
+        if self._versions.get(key, -1) >= data["version"]:
+            return False
+        self._versions[key] = data["version"]
+        self._versions.move_to_end(key)
+        while len(self._versions) > MAX_TRACKED_VERSIONS:
+            self._versions.popitem(last=False)
+        return True
+
+    def dispatch(self, event):
+        """Apply one decoded change event."""
+        entity = event["type"].rsplit(".", 1)[0]
+        if entity not in self._watchers or not self._is_newer(entity, event["data"]):
+            return
+        for on_change, _ in self._watchers[entity]:
+            try:
+                on_change(event["data"])
+            except Exception:
+                logging.exception("Cache invalidation for %s failed", event["type"])
+
+    def _reset(self):
+        self._versions.clear()
+        for watchers in self._watchers.values():
+            for _, on_reset in watchers:
+                if on_reset is not None:
+                    on_reset()
+
+    def _run_forever(self):
+        while True:
+            try:
+                self._consume()
+            except Exception:
+                logging.exception("Change event feed disconnected; retrying in %s seconds", RETRY_INTERVAL)
+            time.sleep(RETRY_INTERVAL)
+
+    def _consume(self):
+        connection = pika.BlockingConnection(pika.ConnectionParameters(host=AMQP_HOST, port=AMQP_PORT))
+        try:
+            channel = connection.channel()
+            queue_name = channel.queue_declare(queue="", exclusive=True, auto_delete=True).method.queue
+            for entity in self._watchers:
+                channel.queue_bind(exchange=EXCHANGE_NAME, queue=queue_name, routing_key=f"{entity}.changed")
+            self._reset()
+            self.connected = True
+
+            for method, properties, body in channel.consume(queue_name, auto_ack=True):
+                try:
+                    event = decode(body, properties.content_type, method.routing_key)
+                except ValueError as e:
+                    logging.warning("Skipping undecodable change event: %s", e)
+                    continue
+                self.dispatch(event)
+        finally:
+            self.connected = False
+            try:
+                connection.close()
+            except Exception:
+                pass
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+Streaming columnar export of the logs and errorlogs tables.
+
+Rows matching a time range (and optional column filters) are read from Supabase in
+keyset-paginated chunks and written as compressed Parquet row groups or Arrow IPC record
+batches as they arrive, so an export never holds more than one chunk in memory.
+
+Used by the ``/log/export`` and ``/error/export`` endpoints, and as a CLI for scheduled jobs:
+
+    python columnar_export.py logs --from 2024-04-01 --to 2024-04-08 --format parquet --out logs.parquet
+    python columnar_export.py errorlogs --from 2024-04-01 --format arrow --out errors.arrow
+
+Environment:
+    SUPABASE_URL, SUPABASE_KEY  - used by the CLI
+    EXPORT_CHUNK_SIZE           - rows asked for per request and written at most per row group/batch
+                                  (default: 5000; PostgREST's max-rows may return fewer)
+"""
+
+import argparse
+import os
+import sys
+from datetime import datetime
+
+import pyarrow as pa
+import pyarrow.ipc as ipc
+import pyarrow.parquet as pq
+
+CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "5000"))
+COMPRESSION = "zstd"
+
+SCHEMAS = {
+    "logs": pa.schema([
+        ("id", pa.int64()),
+        ("user_id", pa.int64()),
+        ("user_type", pa.string()),
+        ("action", pa.string()),
+        ("type", pa.string()),
+        ("message", pa.string()),
+        ("date_time", pa.timestamp("us")),
+    ]),
+    "errorlogs": pa.schema([
+        ("id", pa.int64()),
+        ("service", pa.string()),
+        ("endpoint", pa.string()),
+        ("error", pa.string()),
+        ("date_time", pa.timestamp("us")),
+    ]),
+}
+
+# Columns that may be used as equality filters, per table
+FILTERS = {
+    "logs": ("user_id", "user_type", "action", "type"),
+    "errorlogs": ("service", "endpoint"),
+}
+
+FORMATS = {
+    "parquet": {"mimetype": "application/vnd.apache.parquet", "extension": "parquet"},
+    "arrow": {"mimetype": "application/vnd.apache.arrow.stream", "extension": "arrow"},
+}
+
+
+class _ChunkSink:
+    """Write-only file object that hands written bytes back to a generator."""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def writable(self):
+        return True
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _coerce(value, field_type):
+    if value is None:
+        return None
+    if pa.types.is_timestamp(field_type):
+        return datetime.fromisoformat(value) if isinstance(value, str) else value
+    if pa.types.is_integer(field_type):
+        return int(value)
+    return str(value)
+
+
+def fetch_chunks(supabase, table, start=None, end=None, filters=None, chunk_size=CHUNK_SIZE):
+    """
+    Yield matching rows as pyarrow RecordBatches, one Supabase request per batch.
+
+    Rows are paged by id (keyset pagination), so each request is an index range scan
+    regardless of how deep into the export it is. PostgREST may return fewer rows than asked
+    for (max-rows, 1000 by default), so paging stops only at an empty page.
+
+    Args:
+        supabase (supabase.Client): Supabase client.
+        table (str): "logs" or "errorlogs".
+        start (str, optional): Inclusive lower bound on date_time (ISO-8601).
+        end (str, optional): Exclusive upper bound on date_time (ISO-8601).
+        filters (dict, optional): Equality filters on the columns listed in FILTERS.
+        chunk_size (int): Rows asked for per request.
+
+    Yields:
+        pyarrow.RecordBatch: Up to ``chunk_size`` rows, in id order.
+    """
+    schema = SCHEMAS[table]
+    columns = ",".join(schema.names)
+    last_id = None
+    while True:
+        query = supabase.table(table).select(columns)
+        if start:
+            query = query.gte("date_time", start)
+        if end:
+            query = query.lt("date_time", end)
+        for column, value in (filters or {}).items():
+            query = query.eq(column, value)
+        if last_id is not None:
+            query = query.gt("id", last_id)
+        rows = query.order("id").limit(chunk_size).execute().data
+
+        if not rows:
+            return
+        yield pa.RecordBatch.from_pydict(
+            {field.name: [_coerce(row.get(field.name), field.type) for row in rows] for field in schema},
+            schema=schema,
+        )
+        last_id = rows[-1]["id"]
+
+
+def _writer(fmt, sink, schema):
+    if fmt == "parquet":
+        return pq.ParquetWriter(sink, schema, compression=COMPRESSION)
+    return ipc.new_stream(sink, schema, options=ipc.IpcWriteOptions(compression=COMPRESSION))
+
+
+def stream_export(batches, table, fmt):
+    """
+    Encode RecordBatches incrementally.
+
+    Args:
+        batches (Iterable[pyarrow.RecordBatch]): Output of fetch_chunks().
+        table (str): "logs" or "errorlogs" (selects the schema).
+        fmt (str): "parquet" (one row group per batch) or "arrow" (IPC stream).
+
+    Yields:
+        bytes: Encoded output, one piece per batch.
+    """
+    sink = _ChunkSink()
+    writer = _writer(fmt, sink, SCHEMAS[table])
+    for batch in batches:
+        if fmt == "parquet":
+            writer.write_table(pa.Table.from_batches([batch]))
+        else:
+            writer.write_batch(batch)
+        data = sink.drain()
+        if data:
+            yield data
+    writer.close()
+    yield sink.drain()
+
+
+def export_response(supabase, table, args):
+    """
+    Build a streaming Flask response for an export request.
+
+    Query parameters: ``from``, ``to`` (ISO-8601 date_time bounds), ``format`` (parquet or arrow)
+    and equality filters on the columns listed in FILTERS. The first chunk is fetched before
+    the response starts, so an unreachable store still produces a JSON error.
+
+    Returns:
+        flask.Response | tuple: The streaming response, or a JSON error and status code.
+    """
+    from flask import Response, jsonify
+
+    fmt = args.get("format", "parquet")
+    if fmt not in FORMATS:
+        return jsonify({"error": f"Unsupported format '{fmt}', use one of {', '.join(FORMATS)}"}), 400
+    start, end = args.get("from"), args.get("to")
+    try:
+        for bound in (start, end):
+            if bound:
+                datetime.fromisoformat(bound)
+    except ValueError:
+        return jsonify({"error": "'from' and 'to' must be ISO-8601 dates or date-times"}), 400
+    filters = {column: args[column] for column in FILTERS[table] if column in args}
+
+    batches = fetch_chunks(supabase, table, start, end, filters)
+    try:
+        first = next(batches, None)
+    except Exception as e:
+        return jsonify({"error": f"Server error: {str(e)}"}), 500
+
+    def all_batches():
+        if first is not None:
+            yield first
+            yield from batches
+
+    filename = f"{table}_{start or 'start'}_{end or 'now'}.{FORMATS[fmt]['extension']}".replace(":", "")
+    return Response(
+        stream_export(all_batches(), table, fmt),
+        mimetype=FORMATS[fmt]["mimetype"],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+def swagger_spec(table, tag):
+    """Flasgger spec for an export endpoint over ``table``."""
+    parameters = [
+        {"name": "from", "in": "query", "type": "string", "required": False,
+         "description": "Inclusive lower bound on date_time (ISO-8601)"},
+        {"name": "to", "in": "query", "type": "string", "required": False,
+         "description": "Exclusive upper bound on date_time (ISO-8601)"},
+        {"name": "format", "in": "query", "type": "string", "required": False, "enum": list(FORMATS),
+         "default": "parquet", "description": "Parquet file or Arrow IPC stream (zstd-compressed)"},
+    ]
+    parameters += [{"name": column, "in": "query", "type": "string", "required": False,
+                    "description": f"Only rows with this {column}"} for column in FILTERS[table]]
+    return {
+        "tags": [tag],
+        "summary": f"Export {table} as Parquet or Arrow",
+        "description": "Streams the matching rows in compressed chunks without building the result in memory.",
+        "produces": [f["mimetype"] for f in FORMATS.values()],
+        "parameters": parameters,
+        "responses": {
+            200: {"description": "The export file"},
+            400: {"description": "Invalid format or date range"},
+            500: {"description": "Server error"},
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export logs or errorlogs to Parquet or Arrow")
+    parser.add_argument("table", choices=list(SCHEMAS))
+    parser.add_argument("--from", dest="start", help="inclusive lower bound on date_time (ISO-8601)")
+    parser.add_argument("--to", dest="end", help="exclusive upper bound on date_time (ISO-8601)")
+    parser.add_argument("--format", choices=list(FORMATS), default="parquet")
+    parser.add_argument("--filter", action="append", default=[], metavar="COLUMN=VALUE",
+                        help="equality filter, may be repeated")
+    parser.add_argument("--out", required=True, help="output file ('-' for stdout)")
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+    from supabase import create_client
+
+    load_dotenv()
+    supabase = create_client(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_KEY"))
+    filters = dict(f.split("=", 1) for f in args.filter)
+    unknown = set(filters) - set(FILTERS[args.table])
+    if unknown:
+        parser.error(f"cannot filter {args.table} on {', '.join(sorted(unknown))}")
+
+    out = sys.stdout.buffer if args.out == "-" else open(args.out, "wb")
+    with out:
+        for data in stream_export(fetch_chunks(supabase, args.table, args.start, args.end, filters),
+                                  args.table, args.format):
+            out.write(data)
+    print(f"💾 Exported {args.table} to {args.out}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+"""
+Device-side door timing for the lock services.
+
+``DoorController`` drives a relay through two callables (engage / release) and owns the
+open/close state. ``pulse(hold_ms)`` opens the door and closes it on a local timer, so a
+caller needs one request per entry and the door still closes if the caller goes away.
+A pulse that arrives while the door is open extends the window instead of re-engaging
+the relay.
+
+Used by ``lock/lock.py`` (GPIO relay) and ``testlock/testlock.py`` (simulated relay).
+
+Besides HTTP, a lock can take commands over AMQP: ``start_command_listener`` consumes
+``door.command`` events ("open", "close" or "pulse" with ``hold_ms``) published on
+``door.<door_id>.command``, executes them, and publishes a ``door.state`` event with the
+resulting state on ``door.<door_id>.state``. Commands wait in the door's queue for at most
+DOOR_COMMAND_TTL_MS (see amqp_topology.py), so a short network blip delays an entry
+instead of losing it, but a stale command never opens the door.
+
+Environment:
+    DOOR_HOLD_MS       - hold window when ``hold_ms`` is not given (default: 3000)
+    DOOR_MAX_HOLD_MS   - longest accepted hold window (default: 30000)
+    DOOR_ID            - door served by this lock (default: main)
+    AMQP_HOST          - RabbitMQ host for the command listener (default: rabbitmq)
+    AMQP_PORT          - (default: 5672)
+"""
+
+import os
+import threading
+import time
+from datetime import datetime
+
+DEFAULT_HOLD_MS = int(os.getenv("DOOR_HOLD_MS", "3000"))
+MAX_HOLD_MS = int(os.getenv("DOOR_MAX_HOLD_MS", "30000"))
+DOOR_ID = os.getenv("DOOR_ID", "main")
+AMQP_HOST = os.getenv("AMQP_HOST", "rabbitmq")
+AMQP_PORT = int(os.getenv("AMQP_PORT", "5672"))
+
+# Fields of a door state reported in door.state acks
+STATE_FIELDS = ("lock_state", "opened_at", "closes_at", "closed_at", "error")
+
+
+def _timestamp(ts):
+    return datetime.fromtimestamp(ts).isoformat(timespec="milliseconds") if ts is not None else None
+
+
+class DoorController:
+    """
+    Open/close state of one door, with timed pulses.
+
+    Args:
+        engage (Callable[[], None]): Energise the relay (unlock).
+        release (Callable[[], None]): De-energise the relay (lock).
+    """
+
+    def __init__(self, engage, release):
+        self._engage = engage
+        self._release = release
+        self._lock = threading.RLock()
+        self._timer = None
+        self.is_open = False
+        self.opened_at = None
+        self.closes_at = None
+        self.closed_at = None
+
+    def _cancel_timer(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def open(self):
+        """
+        Open until close() is called.
+
+        Returns:
+            bool: False if the door was already open.
+        """
+        with self._lock:
+            self._cancel_timer()
+            self.closes_at = None
+            if self.is_open:
+                return False
+            self._engage()
+            self.is_open, self.opened_at = True, time.time()
+            return True
+
+    def close(self):
+        """
+        Close now, cancelling any pending pulse.
+
+        Returns:
+            bool: False if the door was already closed.
+        """
+        with self._lock:
+            self._cancel_timer()
+            self.closes_at = None
+            if not self.is_open:
+                return False
+            self._release()
+            self.is_open, self.closed_at = False, time.time()
+            return True
+
+    def pulse(self, hold_ms=DEFAULT_HOLD_MS):
+        """
+        Open the door for ``hold_ms`` milliseconds, or extend the current window.
+
+        Args:
+            hold_ms (int): Hold window, 1..MAX_HOLD_MS.
+
+        Returns:
+            dict: The actuation timestamps and whether the pulse extended an open window.
+
+        Raises:
+            ValueError: If ``hold_ms`` is out of range.
+        """
+        if not 0 < hold_ms <= MAX_HOLD_MS:
+            raise ValueError(f"hold_ms must be between 1 and {MAX_HOLD_MS}")
+        with self._lock:
+            extended = self.is_open
+            if not self.is_open:
+                self._engage()
+                self.is_open, self.opened_at = True, time.time()
+            now = time.time()
+            self.closes_at = max(self.closes_at or 0, now + hold_ms / 1000)
+            self._cancel_timer()
+            self._timer = threading.Timer(self.closes_at - now, self._expire, args=(self.closes_at,))
+            self._timer.daemon = True
+            self._timer.start()
+            return dict(self.state(), hold_ms=hold_ms, extended=extended)
+
+    def _expire(self, closes_at):
+        with self._lock:
+            # A later pulse or a manual open/close has replaced this timer
+            if self.closes_at != closes_at:
+                return
+            try:
+                self.close()
+            except Exception as e:
+                print(f"❌ Error closing door at the end of a pulse: {e}")
+
+    def state(self):
+        """Current state and actuation timestamps (ISO-8601, local time)."""
+        with self._lock:
+            return {
+                "lock_state": self.is_open,
+                "opened_at": _timestamp(self.opened_at),
+                "closes_at": _timestamp(self.closes_at),
+                "closed_at": _timestamp(self.closed_at),
+            }
+
+
+def execute_command(door, data):
+    """
+    Run a door command payload ({"command": "open" | "close" | "pulse", "hold_ms": ...}).
+
+    Returns:
+        dict: The door state after the command.
+
+    Raises:
+        ValueError: If the command or hold_ms is invalid.
+    """
+    command = data["command"]
+    if command == "pulse":
+        return door.pulse(int(data.get("hold_ms") or DEFAULT_HOLD_MS))
+    if command == "open":
+        door.open()
+    elif command == "close":
+        door.close()
+    else:
+        raise ValueError(f"Unknown door command '{command}'")
+    return door.state()
+
+
+def start_command_listener(door, door_id=DOOR_ID, source="lock"):
+    """
+    Execute AMQP door commands for ``door_id`` in a daemon thread, acknowledging each with a state event.
+
+    Args:
+        door (DoorController): The door to drive.
+        door_id (str): Door served by this lock.
+        source (str): Service name used as the source of state events.
+    """
+    from amqp_topology import EXCHANGE_NAME, EXCHANGE_TYPE, declare_topology, door_queue
+    from events import decode, make_event
+    from RabbitMQClient import RabbitMQClient
+
+    queue = door_queue(door_id)
+
+    def callback(channel, method, properties, body):
+        data = {"door_id": door_id, "command": "unknown"}
+        try:
+            event = decode(body, properties.content_type, method.routing_key)
+            if event["type"] != "door.command":
+                raise ValueError(f"Unexpected {event['type']} event on {method.routing_key}")
+            data.update(command=event["data"]["command"], command_id=event["id"])
+            state = execute_command(door, event["data"])
+        except Exception as e:
+            print(f"❌ Door command failed: {e}")
+            state = dict(door.state(), error=str(e))
+        data.update((key, state[key]) for key in STATE_FIELDS if key in state)
+        client.publish(f"door.{door_id}.state", make_event("door.state", data, source), delivery_mode=1)
+
+    def run():
+        nonlocal client
+        while True:
+            try:
+                client = RabbitMQClient(AMQP_HOST, AMQP_PORT, EXCHANGE_NAME, EXCHANGE_TYPE)
+                declare_topology(client.channel, [queue])
+                client.start_consuming(queue["name"], callback)
+            except Exception as e:
+                print(f"❌ Door command listener stopped: {e}. Restarting in 5 seconds...")
+            time.sleep(5)
+
+    client = None
+    threading.Thread(target=run, name="door-commands", daemon=True).start()
@@ -1,6 +1,7 @@
 from flask import Flask, request, jsonify, Blueprint
 from flask_cors import CORS
 import os
+import sys
 import base64
 import logging
 from email.mime.text import MIMEText
@@ -13,6 +14,10 @@ from googleapiclient.errors import HttpError
 
 from flasgger import Swagger, swag_from
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from fast_responses import enable_fast_responses
+from tracing import instrument_app
+
 # ------------------------------
 # Configuration
 # ------------------------------
@@ -31,6 +36,8 @@ SENDER_EMAIL = "serviceatpark@gmail.com"  # Change if needed
 app = Flask(__name__)
 Swagger(app)
 CORS(app)
+instrument_app(app, "emailservice")
+enable_fast_responses(app)
 email_blueprint = Blueprint("email", __name__)
 logging.basicConfig(level=logging.INFO)
 
@@ -0,0 +1,157 @@
+"""
+Door registry and per-door command workers for enterpark.
+
+Every door has its own serial command queue drained by its own worker thread, so an
+actuation at one gate never waits behind a slow or unreachable lock at another, and
+commands to the same gate are executed in order. The request that admits someone only
+enqueues the command, with its trace-context: the worker runs the command in a span of
+that request's trace, so the lock call and the published door command stay in it.
+
+Doors are configured as JSON, either inline in DOORS or in the file named by DOORS_FILE:
+
+    {
+        "main":  {"url": "http://testlock:8077/testlock"},
+        "north": {"url": "http://10.0.0.21:8079/lock", "hold_ms": 5000},
+        "south": {"transport": "amqp"}
+    }
+
+    url        - base URL of the lock service (HTTP transport)
+    transport  - "http" (default: DOOR_TRANSPORT) or "amqp" (publish on door.<id>.command)
+    hold_ms    - pulse length (default: DOOR_HOLD_MS)
+
+Without DOORS/DOORS_FILE there is a single door, DOOR_ID, served by LOCK_URL.
+
+Environment:
+    DOORS, DOORS_FILE   - door configuration (see above)
+    DOOR_ID             - default door, used when a request names none (default: main)
+    DOOR_TRANSPORT      - default transport (default: http)
+    DOOR_HOLD_MS        - default pulse length (default: 3000)
+    DOOR_QUEUE_SIZE     - commands a door may have waiting before new ones are refused (default: 100)
+"""
+
+import json
+import os
+import queue
+import threading
+
+import requests
+
+from events import make_event
+from tracing import inject_headers, start_span
+
+DEFAULT_DOOR = os.getenv("DOOR_ID", "main")
+DEFAULT_TRANSPORT = os.getenv("DOOR_TRANSPORT", "http")
+DEFAULT_HOLD_MS = int(os.getenv("DOOR_HOLD_MS", "3000"))
+QUEUE_SIZE = int(os.getenv("DOOR_QUEUE_SIZE", "100"))
+HTTP_TIMEOUT = 5
+
+
+class Door:
+    """
+    One gate and its command worker.
+
+    Args:
+        door_id (str): Door identifier.
+        url (str, optional): Base URL of its lock service (HTTP transport).
+        transport (str): "http" or "amqp".
+        hold_ms (int): Pulse length.
+        publish (Callable[[str, dict], None]): Publishes a door command (AMQP transport).
+        on_error (Callable[[str, Exception], None]): Called when a command fails.
+    """
+
+    def __init__(self, door_id, url=None, transport=DEFAULT_TRANSPORT, hold_ms=DEFAULT_HOLD_MS,
+                 publish=None, on_error=None):
+        if transport not in ("http", "amqp"):
+            raise ValueError(f"Door '{door_id}': unknown transport '{transport}'")
+        self.door_id = door_id
+        self.url = url
+        self.transport = transport
+        self.hold_ms = hold_ms
+        self._publish = publish
+        self._on_error = on_error
+        self._commands = queue.Queue(maxsize=QUEUE_SIZE)
+        self._session = requests.Session()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def submit(self, command="pulse"):
+        """
+        Queue a command ("pulse", "open" or "close") for this door without waiting for it.
+
+        Returns:
+            bool: False if the door's queue is full and the command was dropped.
+        """
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=f"door-{self.door_id}", daemon=True)
+                self._thread.start()
+        try:
+            self._commands.put_nowait((command, inject_headers()))
+            return True
+        except queue.Full:
+            return False
+
+    def _run(self):
+        while True:
+            command, trace_headers = self._commands.get()
+            try:
+                self.execute(command, trace_headers)
+            except Exception as e:
+                if self._on_error is not None:
+                    self._on_error(self.door_id, e)
+
+    def execute(self, command, trace_headers=None):
+        """
+        Send one command to the lock (blocking).
+
+        Args:
+            command (str): "pulse", "open" or "close".
+            trace_headers (dict, optional): Trace-context of the request that queued the command.
+        """
+        with start_span(f"door {self.door_id} {command}", parent_headers=trace_headers):
+            if self.transport == "amqp":
+                data = {"command": command}
+                if command == "pulse":
+                    data["hold_ms"] = self.hold_ms
+                self._publish(f"door.{self.door_id}.command", make_event("door.command", data, "enterpark"))
+            else:
+                if not self.url:
+                    raise ValueError(f"Door '{self.door_id}' has no lock URL")
+                params = {"hold_ms": self.hold_ms} if command == "pulse" else None
+                response = self._session.get(f"{self.url}/{command}", params=params,
+                                             headers=inject_headers(), timeout=HTTP_TIMEOUT)
+                response.raise_for_status()
+
+
+class DoorRegistry:
+    """
+    The configured doors, by id.
+
+    Args:
+        config (dict): {door_id: {"url": ..., "transport": ..., "hold_ms": ...}}.
+        publish (Callable[[str, dict], None]): Publishes a door command (AMQP doors).
+        on_error (Callable[[str, Exception], None]): Called when a door command fails.
+    """
+
+    def __init__(self, config, publish=None, on_error=None):
+        self.doors = {
+            door_id: Door(door_id, url=settings.get("url"),
+                          transport=settings.get("transport", DEFAULT_TRANSPORT),
+                          hold_ms=int(settings.get("hold_ms", DEFAULT_HOLD_MS)),
+                          publish=publish, on_error=on_error)
+            for door_id, settings in config.items()
+        }
+
+    def get(self, door_id=None):
+        """The door with this id (the default door if None), or None if it is not configured."""
+        return self.doors.get(door_id or DEFAULT_DOOR)
+
+
+def load_config():
+    """Door configuration from DOORS, DOORS_FILE or the single-door LOCK_URL settings."""
+    if os.getenv("DOORS"):
+        return json.loads(os.getenv("DOORS"))
+    if os.getenv("DOORS_FILE"):
+        with open(os.getenv("DOORS_FILE")) as f:
+            return json.load(f)
+    return {DEFAULT_DOOR: {"url": os.getenv("LOCK_URL"), "transport": DEFAULT_TRANSPORT}}
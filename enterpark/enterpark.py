@@ -1,17 +1,21 @@
 from flask import Flask, request, jsonify, Blueprint
 from flask_cors import CORS
 import requests
-import time
-import pika
 import sys
 import os
-import json
 from dotenv import load_dotenv
 from flasgger import Swagger, swag_from
 
 # Setup for module imports
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from RabbitMQClient import RabbitMQClient
+from doors import DoorRegistry, load_config
+from otp_filter import OtpGate
+from otp_replica import OtpReplica
+from purchase_feed import PurchaseFeed
+from events import make_event
+from fast_responses import enable_fast_responses
+from tracing import inject_headers, instrument_app
 
 # -----------------------------
 # RabbitMQ Configuration
@@ -32,12 +36,7 @@ def log_error(service, endpoint, error):
         "endpoint": endpoint,
         "error": str(error)
     }
-    rabbit_client.channel.basic_publish(
-        exchange=exchange_name,
-        routing_key=f"{service}.error",
-        body=json.dumps(message),
-        properties=pika.BasicProperties(delivery_mode=2),
-    )
+    rabbit_client.publish(f"{service}.error", make_event("error", message, "enterpark"))
 
 # -----------------------------
 # Flask App Setup
@@ -45,23 +44,85 @@ def log_error(service, endpoint, error):
 app = Flask(__name__)
 CORS(app)
 Swagger(app)
+instrument_app(app, "enterpark")
+enable_fast_responses(app)
 enterpark_blueprint = Blueprint("enterpark", __name__)
 load_dotenv()
 
 staff_URL = os.getenv('STAFF_URL')
 guest_URL = os.getenv('GUEST_URL')
-lock_URL = os.getenv('LOCK_URL')  # or use LOCK_URL if Pi connected
+
+# -----------------------------
+# Doors
+# -----------------------------
+def publish_door_command(routing_key, command):
+    rabbit_client.publish(routing_key, command, delivery_mode=1)
+
+def door_command_failed(door_id, error):
+    log_error("enterpark", f"/open_door ({door_id})", error)
+
+# Each door has its own serial command queue and worker (see doors.py)
+doors = DoorRegistry(load_config(), publish=publish_door_command, on_error=door_command_failed)
+
+GUEST_TIMEOUT = float(os.getenv("GUEST_TIMEOUT", "3"))
+
+# Purchase events shared by the OTP filter and the OTP replica (see purchase_feed.py)
+purchase_feed = PurchaseFeed()
+
+# Rejects unknown and recently rejected OTPs without asking the guest service (see otp_filter.py)
+otp_gate = OtpGate(guest_URL, purchase_feed)
+OTP_FILTER_ENABLED = os.getenv("OTP_FILTER_ENABLED", "true").lower() == "true"
+if OTP_FILTER_ENABLED:
+    otp_gate.start()
+
+# Validates OTPs locally while the guest service or Supabase is slow or down (see otp_replica.py)
+otp_replica = OtpReplica(guest_URL, purchase_feed)
+OTP_REPLICA_ENABLED = os.getenv("OTP_REPLICA_ENABLED", "true").lower() == "true"
+if OTP_REPLICA_ENABLED:
+    otp_replica.start()
 
 # -----------------------------
 # Helper: Door Open
 # -----------------------------
-def open_door():
-    try:
-        requests.get(lock_URL + "/open")
-        time.sleep(3)
-        requests.get(lock_URL + "/close")
-    except Exception as e:
-        log_error("enterpark", "/open_door", e)
+def open_door(door):
+    """Queue a pulse for the door; False if its command queue is full."""
+    # The lock closes itself after hold_ms, so one command admits one person
+    if door.submit("pulse"):
+        return True
+    log_error("enterpark", f"/open_door ({door.door_id})", "Door command queue is full")
+    return False
+
+def door_busy(door):
+    return jsonify({"error": f"Door '{door.door_id}' is not accepting commands. Try again shortly."}), 503
+
+def unknown_door(door_id):
+    return jsonify({"error": f"Unknown door '{door_id}'"}), 404
+
+# -----------------------------
+# Helpers: Guest Admission
+# -----------------------------
+def no_valid_ticket():
+    return jsonify({"message": "No valid ticket found. Please purchase a ticket."}), 404
+
+def admit_guest(door, guest):
+    if not open_door(door):
+        return door_busy(door)
+    data = {
+        "user_id": guest["guest_id"],
+        "user_type": "guest",
+        "action": "Entry",
+        "type": "Success",
+        "name": guest["guest_name"]
+        }
+    rabbit_client.publish("enterpark.access", make_event("access", data, "enterpark"))
+    return jsonify({"message": "Access granted! Door opening."}), 200
+
+def admit_from_replica(door, otp):
+    # Only the guest service's rejections are remembered: the replica may lack a new ticket
+    guest = otp_replica.lookup(otp)
+    if guest is None:
+        return no_valid_ticket()
+    return admit_guest(door, guest)
 
 # -----------------------------
 # Guest Entry Route
@@ -76,40 +137,48 @@ def open_door():
             'type': 'integer',
             'required': True,
             'description': 'One-Time Password (OTP) to validate guest entry'
+        },
+        {
+            'name': 'door',
+            'in': 'query',
+            'type': 'string',
+            'required': False,
+            'description': 'Door to open (default: the DOOR_ID door)'
         }
     ],
     'responses': {
         200: {'description': 'Access granted'},
-        404: {'description': 'No valid ticket found'},
-        503: {'description': 'Guest service unavailable'}
+        404: {'description': 'No valid ticket found, or unknown door'},
+        503: {'description': 'Guest service unavailable, or the door is not accepting commands'}
     }
 })
 def guest_enterpark(otp):
+    door = doors.get(request.args.get("door"))
+    if door is None:
+        return unknown_door(request.args.get("door"))
+    if OTP_FILTER_ENABLED and otp_gate.definitely_invalid(otp):
+        return no_valid_ticket()
     try:
-        response = requests.get(f"{guest_URL}/validate/{otp}")
+        if OTP_REPLICA_ENABLED and otp_replica.ready():
+            guest = otp_replica.lookup(otp)
+            if guest is not None:
+                return admit_guest(door, guest)
+            # A miss may be a ticket the replica has not caught up with: the guest service decides
+
+        response = requests.get(f"{guest_URL}/validate/{otp}", headers=inject_headers(), timeout=GUEST_TIMEOUT)
+        if response.status_code >= 500:
+            response.raise_for_status()
+        if response.status_code == 404:
+            otp_gate.remember_rejection(otp)
         if response.status_code == 200:
-            response_data = response.json()
-            data = {
-                "user_id": response_data["guest"]["guest_id"],
-                "user_type": "guest",
-                "action": "Entry",
-                 "type": "Success",
-                "message": f"Guest {response_data['guest']['guest_name']} entered the Park!"
-                }
-            rabbit_client.channel.basic_publish(
-                exchange=exchange_name,
-                routing_key="enterpark.access",
-                body=json.dumps(data),
-                properties=pika.BasicProperties(delivery_mode=2),
-                )
-            open_door()
-            return jsonify({"message": "Access granted! Door opening."}), 200
+            return admit_guest(door, response.json()["guest"])
         else:
-            return jsonify({
-                "message": "No valid ticket found. Please purchase a ticket."
-            }), 404
+            return no_valid_ticket()
     except requests.exceptions.RequestException as e:
         log_error("enterpark", f"/guest/{otp} (GET)", e)
+        # Last known replica state beats turning every guest away
+        if OTP_REPLICA_ENABLED and otp_replica.has_data():
+            return admit_from_replica(door, otp)
         return jsonify({"error": "Guest service unavailable. Try again later."}), 503
     except Exception as e:
         log_error("enterpark", f"/guest/{otp} (GET)", e)
@@ -134,6 +203,13 @@ def guest_enterpark(otp):
                 },
                 'required': ['staff_tele', 'password']
             }
+        },
+        {
+            'name': 'door',
+            'in': 'query',
+            'type': 'string',
+            'required': False,
+            'description': 'Door to open (default: the DOOR_ID door)'
         }
     ],
     'responses': {
@@ -141,35 +217,35 @@ def guest_enterpark(otp):
         401: {'description': 'Invalid password'},
         403: {'description': 'Account locked'},
         400: {'description': 'Missing request body'},
-        503: {'description': 'Staff service unavailable'},
+        404: {'description': 'Unknown door'},
+        503: {'description': 'Staff service unavailable, or the door is not accepting commands'},
         500: {'description': 'Unexpected error'}
     }
 })
 def staff_enterpark():
     if not request.json:
         return jsonify({"error": "Missing request body"}), 400
+    door = doors.get(request.args.get("door"))
+    if door is None:
+        return unknown_door(request.args.get("door"))
 
     try:
-        response = requests.post(f"{staff_URL}/validate", json=request.json)
+        response = requests.post(f"{staff_URL}/validate", json=request.json, headers=inject_headers())
         status = response.status_code
         response_data = response.json()
 
         if status == 200:
-            open_door()
+            if not open_door(door):
+                return door_busy(door)
             try:
                 data = {
                     "user_id": response_data["Staff"]["staff_id"],
                     "user_type": "staff",
                     "action": "Entry",
                     "type": "Success",
-                    "message": f"Staff member {response_data['Staff']['staff_name']} entered the Park!"
+                    "name": response_data["Staff"]["staff_name"]
                 }
-                rabbit_client.channel.basic_publish(
-                    exchange=exchange_name,
-                    routing_key="enterpark.access",
-                    body=json.dumps(data),
-                    properties=pika.BasicProperties(delivery_mode=2),
-                )
+                rabbit_client.publish("enterpark.access", make_event("access", data, "enterpark"))
             except Exception as e:
                 log_error("enterpark", "/staff (POST) - publish success", e)
                 return jsonify({"error": "Staff notification failed"}), 503
@@ -184,14 +260,9 @@ def staff_enterpark():
                     "user_type": "staff",
                     "action": "Entry",
                     "type": "Failed",
-                    "message": f"Staff member {response_data['Staff']['staff_name']} attempted to access the park but failed."
+                    "name": response_data["Staff"]["staff_name"]
                 }
-                rabbit_client.channel.basic_publish(
-                    exchange=exchange_name,
-                    routing_key="enterpark.access",
-                    body=json.dumps(data),
-                    properties=pika.BasicProperties(delivery_mode=2),
-                )
+                rabbit_client.publish("enterpark.access", make_event("access", data, "enterpark"))
             except Exception as e:
                 log_error("enterpark", "/staff (POST) - publish failure", e)
 
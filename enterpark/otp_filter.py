@@ -0,0 +1,161 @@
+"""
+Local rejection of invalid OTPs at the gate.
+
+``OtpGate`` keeps:
+    - a Bloom filter of the OTPs that are currently valid, rebuilt from ``GET /guest/valid_otps``
+      every OTP_FILTER_REFRESH seconds and extended with the OTP of every ``payment.notification``
+      and ``guest.changed`` event from the purchase feed (purchase_feed.py), so a newly issued
+      OTP works immediately
+    - a short-lived negative cache of OTPs the guest service has just rejected
+
+An OTP that is definitely not in the filter, or was rejected within OTP_NEGATIVE_TTL seconds,
+is refused without calling the guest service. Anything else (including Bloom false positives)
+is validated by the guest service as before.
+
+The gate fails open: until the first rebuild, when the last rebuild is older than twice the
+refresh interval, or while the purchase event feed is disconnected, every OTP goes to the
+guest service, so a stale filter can never lock out a valid ticket.
+
+Environment:
+    OTP_FILTER_ENABLED        - "false" to always ask the guest service (default: true)
+    OTP_FILTER_REFRESH        - seconds between rebuilds (default: 60)
+    OTP_FILTER_FP_RATE        - target false-positive rate of the filter (default: 0.01)
+    OTP_NEGATIVE_TTL          - seconds a rejected OTP is remembered (default: 30)
+    OTP_NEGATIVE_CACHE_SIZE   - rejected OTPs remembered at most (default: 10000)
+"""
+
+import hashlib
+import logging
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+
+REFRESH_INTERVAL = float(os.getenv("OTP_FILTER_REFRESH", "60"))
+FP_RATE = float(os.getenv("OTP_FILTER_FP_RATE", "0.01"))
+NEGATIVE_TTL = float(os.getenv("OTP_NEGATIVE_TTL", "30"))
+NEGATIVE_CACHE_SIZE = int(os.getenv("OTP_NEGATIVE_CACHE_SIZE", "10000"))
+MIN_CAPACITY = 1024
+
+
+class BloomFilter:
+    """
+    Fixed-size Bloom filter over integers (double hashing on one BLAKE2b digest).
+
+    Args:
+        capacity (int): Expected number of items.
+        fp_rate (float): Target false-positive rate at capacity.
+    """
+
+    def __init__(self, capacity, fp_rate=FP_RATE):
+        capacity = max(capacity, 1)
+        self.size = max(8, int(-capacity * math.log(fp_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(str(item).encode(), digest_size=16).digest()
+        h1, h2 = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, item):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class OtpGate:
+    """
+    Bloom filter of valid OTPs plus a negative cache, kept current in background threads.
+
+    Args:
+        guest_url (str): Base URL of the guest service.
+        feed (PurchaseFeed): Purchase event feed; the gate subscribes to it in ``start()``.
+    """
+
+    def __init__(self, guest_url, feed):
+        self.guest_url = guest_url
+        self.feed = feed
+        self._lock = threading.Lock()
+        self._filter = None
+        self._built_at = None
+        self._added_since_build = set()  # OTPs from events while a rebuild is in flight
+        self._rejected = OrderedDict()   # otp -> expiry (monotonic)
+
+    # --- lookups -----------------------------------------------------------------
+
+    def _filter_usable(self):
+        return (self._filter is not None and self.feed.connected
+                and time.monotonic() - self._built_at < 2 * REFRESH_INTERVAL)
+
+    def definitely_invalid(self, otp):
+        """True if ``otp`` can be rejected without asking the guest service."""
+        with self._lock:
+            expiry = self._rejected.get(otp)
+            if expiry is not None:
+                if expiry > time.monotonic():
+                    return True
+                del self._rejected[otp]
+            return self._filter_usable() and otp not in self._filter
+
+    def remember_rejection(self, otp):
+        """Cache a rejection by the guest service for NEGATIVE_TTL seconds."""
+        with self._lock:
+            self._rejected[otp] = time.monotonic() + NEGATIVE_TTL
+            self._rejected.move_to_end(otp)
+            while len(self._rejected) > NEGATIVE_CACHE_SIZE:
+                self._rejected.popitem(last=False)
+
+    def add(self, otp):
+        """Mark a newly issued OTP as valid."""
+        with self._lock:
+            self._rejected.pop(otp, None)
+            self._added_since_build.add(otp)
+            if self._filter is not None:
+                self._filter.add(otp)
+
+    # --- maintenance -------------------------------------------------------------
+
+    def rebuild(self):
+        """Replace the filter with one built from the guest service's current valid OTPs."""
+        with self._lock:
+            self._added_since_build = set()
+        response = requests.get(f"{self.guest_url}/valid_otps", timeout=10)
+        response.raise_for_status()
+        otps = response.json()["otps"]
+
+        bloom = BloomFilter(max(MIN_CAPACITY, 2 * len(otps)))
+        for otp in otps:
+            bloom.add(int(otp))
+        with self._lock:
+            for otp in self._added_since_build:
+                bloom.add(otp)
+            self._filter, self._built_at = bloom, time.monotonic()
+        logging.info("OTP filter rebuilt with %s valid OTPs", len(otps))
+
+    def resync(self):
+        """Purchase feed (re)connected: purchases made while it was down are only in a fresh rebuild."""
+        self.rebuild()
+
+    def on_event(self, event):
+        if event["type"] in ("payment.notification", "guest.changed") and event["data"].get("otp") is not None:
+            self.add(int(event["data"]["otp"]))
+
+    def start(self):
+        """Start the rebuild loop in a daemon thread and follow the purchase feed."""
+        threading.Thread(target=self._rebuild_forever, name="otp-filter", daemon=True).start()
+        self.feed.subscribe(self)
+        self.feed.start()
+
+    def _rebuild_forever(self):
+        while True:
+            try:
+                self.rebuild()
+            except Exception:
+                logging.exception("OTP filter rebuild failed; OTPs are checked with the guest service")
+            time.sleep(REFRESH_INTERVAL)
@@ -0,0 +1,251 @@
+"""
+Local replica of valid OTPs, so the gate keeps admitting guests when the guest service or
+Supabase is slow or unreachable.
+
+``OtpReplica`` keeps every currently valid OTP with its guest and expiry in SQLite:
+    - bootstrapped from ``GET /guest/valid_otps?detail=true`` and fully re-synced every
+      OTP_REPLICA_SYNC seconds and whenever the purchase feed (purchase_feed.py) reconnects
+    - updated from every ``payment.notification`` event, so a newly bought ticket works at once
+      and the guest's previous OTP stops working
+    - updated from ``guest.changed`` events: a deleted guest's OTP is dropped at once, and a
+      guest whose OTP, expiry or name changed is re-read from ``GET /guest/<guest_id>``
+
+``lookup(otp)`` validates locally with the guest service's rules: an unused OTP becomes valid
+until the end of the day (Asia/Singapore) on its first use, a used one until its expiry.
+First uses are stored in the replica and reported to the guest service
+(``PUT /guest/first_use/<otp>``) by a background thread, so the guest record catches up
+after an outage. They survive a restart when OTP_REPLICA_PATH is a file.
+
+``ready()`` is True while the replica is current (synced recently and the purchase feed is
+connected); enterpark then admits the OTPs the replica knows without asking the guest service,
+and asks it only about the others. Otherwise it asks the guest service and falls back to the
+replica, however old, only when the guest service fails.
+
+Environment:
+    OTP_REPLICA_ENABLED     - "false" to always ask the guest service (default: true)
+    OTP_REPLICA_PATH        - SQLite database file (default: otp_replica.sqlite3; ":memory:" for none)
+    OTP_REPLICA_SYNC        - seconds between full syncs (default: 60)
+    OTP_REPLICA_RECONCILE   - seconds between first-use reports to the guest service (default: 5)
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+import pytz
+import requests
+
+REPLICA_PATH = os.getenv("OTP_REPLICA_PATH", "otp_replica.sqlite3")
+SYNC_INTERVAL = float(os.getenv("OTP_REPLICA_SYNC", "60"))
+RECONCILE_INTERVAL = float(os.getenv("OTP_REPLICA_RECONCILE", "5"))
+HTTP_TIMEOUT = 10
+SG_TZ = pytz.timezone("Asia/Singapore")
+REPLICATED_FIELDS = {"otp", "otp_valid_datetime", "guest_name"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS otp (
+    otp          INTEGER PRIMARY KEY,
+    guest_id     INTEGER NOT NULL,
+    guest_name   TEXT,
+    valid_until  TEXT
+);
+CREATE INDEX IF NOT EXISTS otp_guest_id ON otp (guest_id);
+CREATE TABLE IF NOT EXISTS first_use (
+    otp          INTEGER PRIMARY KEY,
+    valid_until  TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key          TEXT PRIMARY KEY,
+    value        TEXT
+);
+"""
+
+
+def end_of_today():
+    """End of the current day in Asia/Singapore, as the guest service sets it on first use."""
+    today = datetime.now(SG_TZ).date()
+    return SG_TZ.localize(datetime(today.year, today.month, today.day, 23, 59, 59, 999999)).isoformat()
+
+
+class OtpReplica:
+    """
+    SQLite replica of valid OTPs, kept current in background threads.
+
+    Args:
+        guest_url (str): Base URL of the guest service.
+        feed (PurchaseFeed): Purchase event feed; the replica subscribes to it in ``start()``.
+        path (str): SQLite database file.
+    """
+
+    def __init__(self, guest_url, feed, path=REPLICA_PATH):
+        self.guest_url = guest_url
+        self.feed = feed
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.executescript(SCHEMA)
+        self._synced_at = None            # monotonic time of the last full sync in this process
+        self._changes_since_sync = None   # (method, args) applied while a sync is in flight, replayed after it
+
+    # --- lookups -----------------------------------------------------------------
+
+    def ready(self):
+        """True if the replica is complete enough to be the only source of truth."""
+        return (self._synced_at is not None and self.feed.connected
+                and time.monotonic() - self._synced_at < 2 * SYNC_INTERVAL)
+
+    def has_data(self):
+        """True if the replica was ever synced (possibly by an earlier process)."""
+        with self._lock:
+            return self._db.execute("SELECT 1 FROM meta WHERE key = 'synced_at'").fetchone() is not None
+
+    def lookup(self, otp):
+        """
+        Validate ``otp`` locally, recording its first use.
+
+        Returns:
+            dict: {"guest_id", "guest_name", "otp_valid_datetime"}, or None if the OTP is unknown or expired.
+        """
+        with self._lock:
+            row = self._db.execute("SELECT guest_id, guest_name, valid_until FROM otp WHERE otp = ?",
+                                   (otp,)).fetchone()
+            if row is None:
+                return None
+            guest_id, guest_name, valid_until = row
+            if valid_until is None:
+                valid_until = end_of_today()
+                with self._db:
+                    self._db.execute("BEGIN")
+                    self._db.execute("UPDATE otp SET valid_until = ? WHERE otp = ?", (valid_until, otp))
+                    self._db.execute("INSERT OR IGNORE INTO first_use (otp, valid_until) VALUES (?, ?)",
+                                     (otp, valid_until))
+            elif datetime.fromisoformat(valid_until) < datetime.now(SG_TZ):
+                return None
+            return {"guest_id": guest_id, "guest_name": guest_name, "otp_valid_datetime": valid_until}
+
+    # --- maintenance -------------------------------------------------------------
+
+    def _issue(self, otp, guest_id, guest_name, valid_until=None):
+        # A guest has one OTP at a time: buying a ticket replaces the previous one
+        self._db.execute("DELETE FROM otp WHERE guest_id = ?", (guest_id,))
+        self._db.execute("INSERT OR REPLACE INTO otp (otp, guest_id, guest_name, valid_until) VALUES (?, ?, ?, ?)",
+                         (otp, guest_id, guest_name, valid_until))
+
+    def _drop(self, guest_id):
+        self._db.execute("DELETE FROM otp WHERE guest_id = ?", (guest_id,))
+
+    def _apply(self, method, *args):
+        """Apply a change under ``_lock``, and keep it for replay if a sync is in flight."""
+        method(*args)
+        if self._changes_since_sync is not None:
+            self._changes_since_sync.append((method, args))
+
+    def sync(self):
+        """Replace the replica with the guest service's current valid OTPs."""
+        with self._sync_lock:
+            self._sync()
+
+    def _sync(self):
+        with self._lock:
+            self._changes_since_sync = []
+        try:
+            response = requests.get(f"{self.guest_url}/valid_otps", params={"detail": "true"}, timeout=HTTP_TIMEOUT)
+            response.raise_for_status()
+            guests = response.json()["guests"]
+        except Exception:
+            with self._lock:
+                self._changes_since_sync = None
+            raise
+
+        with self._lock, self._db:
+            self._db.execute("BEGIN")
+            self._db.execute("DELETE FROM otp")
+            self._db.executemany(
+                "INSERT OR REPLACE INTO otp (otp, guest_id, guest_name, valid_until) VALUES (?, ?, ?, ?)",
+                [(int(g["otp"]), g["guest_id"], g.get("guest_name"), g.get("otp_valid_datetime")) for g in guests])
+            # The snapshot may predate purchases and deletes seen while it was read
+            for method, args in self._changes_since_sync:
+                method(*args)
+            # First uses not yet reported to the guest service are newer than its records
+            self._db.execute("UPDATE otp SET valid_until = (SELECT valid_until FROM first_use WHERE first_use.otp = otp.otp) "
+                             "WHERE otp IN (SELECT otp FROM first_use)")
+            self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('synced_at', ?)",
+                             (datetime.now(SG_TZ).isoformat(),))
+            self._changes_since_sync = None
+            self._synced_at = time.monotonic()
+        logging.info("OTP replica synced with %s valid OTPs", len(guests))
+
+    def resync(self):
+        """Purchase feed (re)connected: purchases made while it was down are only in a full sync."""
+        self.sync()
+
+    def _refresh_guest(self, guest_id):
+        try:
+            response = requests.get(f"{self.guest_url}/{guest_id}", timeout=HTTP_TIMEOUT)
+            if response.status_code != 404:
+                response.raise_for_status()
+        except Exception:
+            # Not trusted again until the next full sync
+            self._synced_at = None
+            raise
+        guest = response.json()["guest"] if response.status_code == 200 else None
+        with self._lock, self._db:
+            self._db.execute("BEGIN")
+            if guest is None or guest.get("otp") is None:
+                self._apply(self._drop, guest_id)
+                return
+            pending = self._db.execute("SELECT valid_until FROM first_use WHERE otp = ?", (guest["otp"],)).fetchone()
+            valid_until = pending[0] if pending else guest.get("otp_valid_datetime")
+            if valid_until is None or datetime.fromisoformat(valid_until) >= datetime.now(SG_TZ):
+                self._apply(self._issue, int(guest["otp"]), guest_id, guest.get("guest_name"), valid_until)
+            else:
+                self._apply(self._drop, guest_id)
+
+    def on_event(self, event):
+        data = event["data"]
+        if event["type"] == "guest.changed":
+            if data["op"] == "delete":
+                with self._lock:
+                    self._apply(self._drop, data["guest_id"])
+            elif REPLICATED_FIELDS & set(data.get("fields") or ()):
+                self._refresh_guest(data["guest_id"])
+            return
+        if event["type"] != "payment.notification" or data.get("otp") is None:
+            return
+        with self._lock, self._db:
+            self._db.execute("BEGIN")
+            self._apply(self._issue, int(data["otp"]), data["guest_id"], data.get("guest_name"))
+
+    def reconcile(self):
+        """Report recorded first uses to the guest service; unreported ones are retried next time."""
+        with self._lock:
+            pending = self._db.execute("SELECT otp, valid_until FROM first_use").fetchall()
+        for otp, valid_until in pending:
+            response = requests.put(f"{self.guest_url}/first_use/{otp}",
+                                    json={"otp_valid_datetime": valid_until}, timeout=HTTP_TIMEOUT)
+            # 409: the guest service already has a first use (or the OTP was replaced)
+            if response.status_code not in (200, 409):
+                response.raise_for_status()
+            with self._lock:
+                self._db.execute("DELETE FROM first_use WHERE otp = ? AND valid_until = ?", (otp, valid_until))
+
+    def start(self):
+        """Start the sync and reconcile loops in daemon threads and follow the purchase feed."""
+        threading.Thread(target=self._every, args=(SYNC_INTERVAL, self.sync, "sync"),
+                         name="otp-replica-sync", daemon=True).start()
+        threading.Thread(target=self._every, args=(RECONCILE_INTERVAL, self.reconcile, "reconcile"),
+                         name="otp-replica-reconcile", daemon=True).start()
+        self.feed.subscribe(self)
+        self.feed.start()
+
+    @staticmethod
+    def _every(interval, task, name):
+        while True:
+            try:
+                task()
+            except Exception:
+                logging.exception("OTP replica %s failed; retrying in %s seconds", name, interval)
+            time.sleep(interval)
@@ -0,0 +1,82 @@
+"""
+Live feed of guest purchase and change events for enterpark's local OTP state.
+
+``PurchaseFeed`` consumes ``payment.notification`` and ``guest.changed`` events (see
+cache_invalidation.py) through a private, auto-deleted queue (so every enterpark instance sees every purchase) and hands each decoded event to its
+subscribers. A subscriber implements:
+
+    resync()          - reload its full state; called on every (re)connect, before events are
+                        delivered, so purchases made while the feed was down are not missed
+    on_event(event)   - apply one decoded event envelope
+
+``connected`` is True only between a completed resync and the next disconnect; subscribers
+use it to decide whether their local state can be trusted.
+"""
+
+import logging
+import threading
+import time
+
+import pika
+
+from amqp_topology import EXCHANGE_NAME
+from events import decode
+
+AMQP_HOST = "rabbitmq"
+AMQP_PORT = 5672
+ROUTING_KEYS = ("payment.notification", "guest.changed")
+
+
+class PurchaseFeed:
+    """Fan-out of purchase events to in-process subscribers."""
+
+    def __init__(self):
+        self.subscribers = []
+        self.connected = False
+        self._thread = None
+
+    def subscribe(self, subscriber):
+        self.subscribers.append(subscriber)
+
+    def start(self):
+        """Start consuming in a daemon thread (no-op if already started)."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run_forever, name="purchase-feed", daemon=True)
+            self._thread.start()
+
+    def _run_forever(self):
+        while True:
+            try:
+                self._consume()
+            except Exception:
+                logging.exception("Purchase feed disconnected; retrying in 5 seconds")
+            time.sleep(5)
+
+    def _consume(self):
+        connection = pika.BlockingConnection(pika.ConnectionParameters(host=AMQP_HOST, port=AMQP_PORT))
+        try:
+            channel = connection.channel()
+            queue = channel.queue_declare(queue="", exclusive=True, auto_delete=True).method.queue
+            for routing_key in ROUTING_KEYS:
+                channel.queue_bind(exchange=EXCHANGE_NAME, queue=queue, routing_key=routing_key)
+            for subscriber in self.subscribers:
+                subscriber.resync()
+            self.connected = True
+
+            for method, properties, body in channel.consume(queue, auto_ack=True):
+                try:
+                    event = decode(body, properties.content_type, method.routing_key)
+                except ValueError as e:
+                    logging.warning("Skipping undecodable purchase event: %s", e)
+                    continue
+                for subscriber in self.subscribers:
+                    try:
+                        subscriber.on_event(event)
+                    except Exception:
+                        logging.exception("Failed to apply %s event", event["type"])
+        finally:
+            self.connected = False
+            try:
+                connection.close()
+            except Exception:
+                pass
@@ -4,9 +4,15 @@ from supabase import create_client, Client
 from dotenv import load_dotenv
 from datetime import datetime
 import os
+import sys
 import logging
 from flasgger import Swagger, swag_from
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from columnar_export import export_response, swagger_spec
+from fast_responses import enable_fast_responses, stream_json_array
+from tracing import instrument_app
+
 # -----------------------------
 # Environment Setup
 # -----------------------------
@@ -22,6 +28,8 @@ supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
 app = Flask(__name__)
 Swagger(app)
 CORS(app)
+instrument_app(app, "error")
+enable_fast_responses(app)
 error_blueprint = Blueprint("error", __name__)
 logging.basicConfig(level=logging.INFO)
 
@@ -172,7 +180,7 @@ def get_all_errors():
         response = supabase.table("errorlogs").select("*").execute()
 
         if response.data:
-            return jsonify(response.data), 200
+            return stream_json_array(response.data)
         else:
             return jsonify({"error": "No error logs found"}), 404
 
@@ -180,6 +188,11 @@ def get_all_errors():
         logging.exception("Unexpected error while retrieving error logs")
         return jsonify({"error": f"Server error: {str(e)}"}), 500
 
+@error_blueprint.route("/export", methods=["GET"])
+@swag_from(swagger_spec("errorlogs", "Error"))
+def export_errors():
+    return export_response(supabase, "errorlogs", request.args)
+
 # -----------------------------
 # Register Blueprint and Start App
 # -----------------------------
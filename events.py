@@ -0,0 +1,258 @@
+"""
+Versioned event envelope for messages published on park_topic.
+
+Envelope (schema version 1):
+    v     int   - schema version
+    id    str   - unique event id (hex UUID), usable for de-duplication
+    type  str   - event type, one of SCHEMAS
+    ts    int   - event time in milliseconds since the epoch (UTC)
+    src   str   - publishing service
+    data  dict  - type-specific payload, validated against SCHEMAS
+
+Access events no longer carry the human-readable log message. They carry the
+subject's ``name`` (and a free-text ``detail`` where needed) and consumers render
+the message with ``access_message()`` when they need it.
+
+Encodings are negotiated through the AMQP ``content_type`` property:
+    application/msgpack - compact binary encoding (default for publishers): the envelope is a
+                          positional array [v, id (16 raw bytes), type, ts, src, data] and
+                          ``data`` is an array in schema field order (required, then optional)
+    application/json    - the envelope as a JSON object; a JSON body without ``v`` is a legacy
+                          bare payload and is still accepted
+
+Environment:
+    EVENT_ENCODING - "msgpack" (default) or "json"; keep "json" while old consumers are still running
+"""
+
+import json
+import os
+import time
+import uuid
+from datetime import datetime
+
+import msgpack
+
+SCHEMA_VERSION = 1
+
+MSGPACK = "application/msgpack"
+JSON = "application/json"
+CONTENT_TYPES = {"msgpack": MSGPACK, "json": JSON}
+EVENT_ENCODING = os.getenv("EVENT_ENCODING", "msgpack")
+
+# Required and optional payload fields per event type
+SCHEMAS = {
+    "access": {
+        "required": ("user_id", "user_type", "action", "type", "name"),
+        "optional": ("detail",),
+    },
+    "error": {
+        "required": ("service", "endpoint", "error"),
+        "optional": (),
+    },
+    "payment.notification": {
+        "required": ("guest_id",),
+        "optional": ("otp", "guest_name"),
+    },
+    "door.command": {
+        "required": ("command",),
+        "optional": ("hold_ms",),
+    },
+    "door.state": {
+        "required": ("door_id", "command", "lock_state"),
+        "optional": ("opened_at", "closes_at", "closed_at", "command_id", "error"),
+    },
+    "guest.changed": {
+        "required": ("guest_id", "op", "version"),
+        "optional": ("fields", "otp"),
+    },
+    "staff.changed": {
+        "required": ("staff_id", "op", "version"),
+        "optional": ("fields",),
+    },
+}
+
+# Human-readable access log messages, keyed by (user_type, action, type)
+ACCESS_MESSAGES = {
+    ("guest", "Entry", "Success"): "Guest {name} entered the Park!",
+    ("guest", "Payment", "Success"): "Guest {name} {detail}",
+    ("staff", "Entry", "Success"): "Staff member {name} entered the Park!",
+    ("staff", "Entry", "Failed"): "Staff member {name} attempted to access the park but failed.",
+    ("staff", "Broadcast", "Success"): "Staff member {name} broadcasted {detail}!",
+}
+
+
+def validate(event_type, data):
+    """
+    Check a payload against the schema of its event type.
+
+    Raises:
+        ValueError: If the event type is unknown, a required field is missing or a field is not in the schema.
+    """
+    schema = SCHEMAS.get(event_type)
+    if schema is None:
+        raise ValueError(f"Unknown event type: {event_type}")
+    missing = [field for field in schema["required"] if field not in data]
+    if missing:
+        raise ValueError(f"{event_type} event is missing {', '.join(missing)}")
+    unknown = set(data) - set(schema["required"]) - set(schema["optional"])
+    if unknown:
+        raise ValueError(f"{event_type} event has unknown fields {', '.join(sorted(unknown))}")
+
+
+def make_event(event_type, data, source):
+    """
+    Build a validated event envelope.
+
+    Args:
+        event_type (str): One of SCHEMAS.
+        data (dict): The payload.
+        source (str): Name of the publishing service.
+
+    Returns:
+        dict: The envelope.
+    """
+    validate(event_type, data)
+    return {
+        "v": SCHEMA_VERSION,
+        "id": uuid.uuid4().hex,
+        "type": event_type,
+        "ts": int(time.time() * 1000),
+        "src": source,
+        "data": data,
+    }
+
+
+def is_event(message):
+    """Whether ``message`` is an envelope (as opposed to a legacy bare payload)."""
+    return isinstance(message, dict) and "v" in message and "data" in message
+
+
+def _fields(event_type):
+    schema = SCHEMAS[event_type]
+    return schema["required"] + schema["optional"]
+
+
+def _pack(event):
+    """Envelope -> positional msgpack array."""
+    values = [event["data"].get(field) for field in _fields(event["type"])]
+    while values and values[-1] is None and len(values) > len(SCHEMAS[event["type"]]["required"]):
+        values.pop()
+    return msgpack.packb(
+        [event["v"], uuid.UUID(event["id"]).bytes, event["type"], event["ts"], event["src"], values],
+        use_bin_type=True,
+    )
+
+
+def _unpack(body):
+    """Positional msgpack array -> envelope."""
+    v, raw_id, event_type, ts, src, values = msgpack.unpackb(body, raw=False)
+    if event_type not in SCHEMAS:
+        raise ValueError(f"Unknown event type: {event_type}")
+    required = SCHEMAS[event_type]["required"]
+    data = {field: value for field, value in zip(_fields(event_type), values)
+            if value is not None or field in required}
+    return {"v": v, "id": uuid.UUID(bytes=raw_id).hex, "type": event_type, "ts": ts, "src": src, "data": data}
+
+
+def encode(event, encoding=None):
+    """
+    Serialise an envelope.
+
+    Args:
+        event (dict): An envelope from make_event().
+        encoding (str, optional): "msgpack" or "json" (default: EVENT_ENCODING).
+
+    Returns:
+        tuple[bytes, str]: The body and its content type.
+    """
+    content_type = CONTENT_TYPES[encoding or EVENT_ENCODING]
+    if content_type == MSGPACK:
+        return _pack(event), content_type
+    return json.dumps(event, separators=(",", ":")).encode(), content_type
+
+
+def decode(body, content_type=None, routing_key=None):
+    """
+    Deserialise a message body into an envelope.
+
+    Legacy bare JSON payloads are wrapped in a version-0 envelope whose type is taken
+    from the routing key (``<service>.access``, ``<service>.error``, ``payment.notification``).
+
+    Args:
+        body (bytes): The message body.
+        content_type (str, optional): The AMQP content_type; JSON is assumed when absent.
+        routing_key (str, optional): The routing key, used to type legacy payloads.
+
+    Returns:
+        dict: The envelope.
+
+    Raises:
+        ValueError: If the body cannot be decoded or does not match its schema.
+    """
+    try:
+        if content_type == MSGPACK:
+            message = _unpack(body)
+        else:
+            message = json.loads(body)
+    except Exception as e:
+        raise ValueError(f"Undecodable {content_type or JSON} body: {e}") from e
+
+    if is_event(message):
+        if message["v"] > SCHEMA_VERSION:
+            raise ValueError(f"Unsupported event schema version {message['v']}")
+        validate(message["type"], message["data"])
+        return message
+
+    if not isinstance(message, dict):
+        raise ValueError("Event payload is not an object")
+    return {"v": 0, "id": None, "type": legacy_type(routing_key), "ts": None, "src": None, "data": message}
+
+
+def legacy_type(routing_key):
+    """Event type implied by the routing key of a legacy bare payload."""
+    if routing_key and routing_key.endswith(".access"):
+        return "access"
+    if routing_key and routing_key.endswith(".error"):
+        return "error"
+    return routing_key
+
+
+def access_message(data):
+    """Render the human-readable log message of an access event."""
+    if "message" in data:  # legacy payload
+        return data["message"]
+    template = ACCESS_MESSAGES.get((data["user_type"], data["action"], data["type"]))
+    if template is None:
+        return f"{data['user_type'].capitalize()} {data['name']}: {data['action']} {data['type']}"
+    return template.format(name=data["name"], detail=data.get("detail", ""))
+
+
+def event_time(event):
+    """
+    Event time as a local ISO-8601 string, like the ``date_time`` the logs service writes.
+
+    Legacy payloads carry no timestamp, so the current time is used for them.
+    """
+    if event.get("ts") is None:
+        return datetime.now().isoformat()
+    return datetime.fromtimestamp(event["ts"] / 1000).isoformat()
+
+
+def to_log_entry(event):
+    """
+    Flatten an access or error event into the body expected by the logs/error services.
+
+    Returns:
+        dict: For access events: user_id, user_type, action, type, message.
+              For error events: service, endpoint, error.
+    """
+    data = event["data"]
+    if event["type"] == "access":
+        return {
+            "user_id": data["user_id"],
+            "user_type": data["user_type"],
+            "action": data["action"],
+            "type": data["type"],
+            "message": access_message(data),
+        }
+    return dict(data)
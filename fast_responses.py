@@ -0,0 +1,151 @@
+"""
+Fast JSON encoding and response compression for the Flask services.
+
+``enable_fast_responses(app)``:
+    - replaces Flask's JSON provider with one backed by orjson, so ``jsonify`` encodes
+      large result sets several times faster (output is unchanged apart from whitespace)
+    - compresses JSON and text responses with brotli or gzip, whichever the client prefers
+      in ``Accept-Encoding``, when the body is at least COMPRESS_MIN_SIZE bytes;
+      streamed responses are compressed chunk by chunk
+
+``stream_json_array(rows)`` returns a response that encodes a list in chunks as it is
+sent, instead of building the whole body first.
+
+A compressed response's strong ETag is downgraded to a weak one, since the bytes on the
+wire depend on the encoding; If-None-Match comparisons are weak, so 304s still work.
+
+Environment:
+    COMPRESS_MIN_SIZE   - smallest body, in bytes, worth compressing (default: 1024)
+    COMPRESS_LEVEL      - gzip level, 1-9 (default: 6)
+    BROTLI_QUALITY      - brotli quality, 0-11 (default: 4)
+"""
+
+import os
+import zlib
+
+import orjson
+from flask import request
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", "1024"))
+COMPRESS_LEVEL = int(os.getenv("COMPRESS_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "4"))
+
+COMPRESSIBLE_MIMETYPES = ("application/json", "text/html", "text/plain", "text/css", "application/javascript")
+ENCODINGS = ["br", "gzip"] if brotli is not None else ["gzip"]
+STREAM_CHUNK_ROWS = 500
+
+# Datetimes go through DefaultJSONProvider.default, which formats them as HTTP dates like Flask does
+_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider that encodes with orjson."""
+
+    def _options(self, indent=False):
+        options = _OPTIONS
+        if self.sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        if indent:
+            options |= orjson.OPT_INDENT_2
+        return options
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=self._options()).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = self.compact is False or (self.compact is None and self._app.debug)
+        body = orjson.dumps(obj, default=self.default, option=self._options(indent))
+        return self._app.response_class(body + b"\n", mimetype=self.mimetype)
+
+
+def stream_json_array(rows, status=200):
+    """
+    Build a streamed JSON array response, encoding STREAM_CHUNK_ROWS rows at a time.
+
+    Args:
+        rows (list): JSON-serialisable items.
+        status (int): Response status code.
+
+    Returns:
+        flask.Response: The streaming response.
+    """
+    from flask import current_app
+
+    provider = current_app.json
+    options = provider._options() if isinstance(provider, OrjsonProvider) else _OPTIONS
+
+    def generate():
+        yield b"["
+        for start in range(0, len(rows), STREAM_CHUNK_ROWS):
+            chunk = orjson.dumps(rows[start:start + STREAM_CHUNK_ROWS], default=provider.default, option=options)
+            yield (b"," if start else b"") + chunk[1:-1]
+        yield b"]\n"
+
+    return current_app.response_class(generate(), status=status, mimetype="application/json")
+
+
+def _compressor(encoding):
+    """Return (compress, finish) functions for an incremental compressor."""
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        return compressor.process, compressor.finish
+    compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress, compressor.flush
+
+
+def _compress_stream(chunks, encoding):
+    compress, finish = _compressor(encoding)
+    for chunk in chunks:
+        data = compress(chunk.encode() if isinstance(chunk, str) else chunk)
+        if data:
+            yield data
+    yield finish()
+
+
+def compress_response(response):
+    """Compress a response in place if the client accepts it and it is worth it."""
+    if (response.status_code < 200 or response.status_code in (204, 304)
+            or "Content-Encoding" in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+    encoding = request.accept_encodings.best_match(ENCODINGS)
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        response.response = _compress_stream(response.response, encoding)
+        response.headers.pop("Content-Length", None)
+    else:
+        body = response.get_data()
+        if len(body) < COMPRESS_MIN_SIZE:
+            return response
+        compress, finish = _compressor(encoding)
+        response.set_data(compress(body) + finish())
+
+    response.headers["Content-Encoding"] = encoding
+    response.vary.add("Accept-Encoding")
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def enable_fast_responses(app):
+    """
+    Use orjson for ``jsonify`` and compress responses of a Flask app.
+
+    Args:
+        app (flask.Flask): The Flask application.
+    """
+    app.json = OrjsonProvider(app)
+    app.after_request(compress_response)
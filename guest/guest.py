@@ -1,6 +1,7 @@
 from datetime import datetime
 import math
 import os
+import sys
 import pytz
 from flask import Blueprint, Flask, jsonify, request
 from flask_cors import CORS
@@ -8,6 +9,14 @@ from flasgger import Swagger
 from dotenv import load_dotenv
 from supabase import create_client, Client
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from fast_responses import enable_fast_responses, stream_json_array
+from tracing import instrument_app
+from http_cache import conditional
+from cache_invalidation import ChangePublisher
+from wallet import GuestNotFound, InsufficientFunds, WalletLedger, entry
+from singleflight import SingleFlight
+
 # Load environment variables from .env
 load_dotenv()
 
@@ -20,20 +29,97 @@ supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
 app = Flask(__name__)
 CORS(app)
 Swagger(app)
+instrument_app(app, "guest")
+enable_fast_responses(app)
 
 # Create Blueprint for guest routes
 guest_blueprint = Blueprint("guest", __name__)
 
+# guest.changed events for other services' caches (see cache_invalidation.py)
+changes = ChangePublisher("guest")
+
+# Wallet and loyalty points movements (see wallet.py and wallet_ledger.sql)
+ledger = WalletLedger(supabase)
+ledger.start_snapshots()
+
+# Concurrent reads of the same guest share one Supabase query (see singleflight.py)
+reads = SingleFlight()
+
 
 def error_response(e):
     """Helper to return a JSON error response."""
     return jsonify({"error": str(e)}), 500
 
 
+# Columns a caller may project with ?fields=
+GUEST_COLUMNS = ("guest_id", "guest_name", "guest_email", "guest_tele", "wallet", "loyalty_points",
+                 "otp", "otp_valid_datetime", "chat_id")
+MAX_BULK_IDS = 1000
+# Rows per request when listing valid OTPs; PostgREST returns at most 1000 (max-rows) per request
+VALID_OTPS_PAGE_SIZE = 1000
+
+
+def parse_ids(value):
+    """Helper to parse a comma-separated id list (ValueError if malformed), keeping order and dropping repeats."""
+    return list(dict.fromkeys(int(part) for part in value.split(",") if part.strip()))
+
+
+def parse_columns(value):
+    """Helper to parse a comma-separated column projection; None if it names an unknown column."""
+    if not value:
+        return ["*"]
+    columns = [column.strip() for column in value.split(",") if column.strip()]
+    return columns if columns and set(columns) <= set(GUEST_COLUMNS) else None
+
+
 def validate_fields(data, required_fields):
     """Helper to check that all required fields exist in the JSON payload."""
     return all(field in data for field in required_fields)
 
+
+def read_guests(column, value):
+    """Helper to read the guest rows whose column equals value, sharing the query with concurrent reads."""
+    return reads.do((column, value), lambda: supabase.table("guest").select("*").eq(column, value).execute().data)
+
+
+def publish_changes(op, rows, fields):
+    """Helper to publish a guest.changed event for every row a write returned."""
+    # Reads starting after this write must not join a query that may predate it
+    reads.forget()
+    for row in rows:
+        changes.publish("guest", row.get("guest_id"), op, fields,
+                        otp=row.get("otp") if "otp" in fields else None)
+
+
+def ledger_ref(scope):
+    """Helper to derive a ledger entry ref from the request's Idempotency-Key, if it has one."""
+    key = request.headers.get("Idempotency-Key")
+    return f"{request.path}:{key}:{scope}" if key else None
+
+
+def issue_ticket(guest_id, new_otp, entries):
+    """
+    Helper to post the ledger entries of a ticket purchase and issue its OTP in one transaction.
+
+    Returns:
+        dict | None: The updated guest row, or None if the guest does not exist.
+
+    Raises:
+        InsufficientFunds: If the guest cannot pay; nothing is changed.
+    """
+    try:
+        guest = ledger.issue_ticket(entries, guest_id, new_otp)
+    except GuestNotFound:
+        return None
+    if guest is not None:
+        publish_changes("update", [guest], {"otp", "otp_valid_datetime", "wallet", "loyalty_points"})
+    return guest
+
+
+def purchase_summary(guest):
+    """Helper to pick the guest fields that callers need for purchase events."""
+    return {"guest_id": guest.get("guest_id"), "guest_name": guest.get("guest_name"), "otp": guest.get("otp")}
+
 # =========================
 # Guest Management Endpoints
 # =========================
@@ -80,13 +166,15 @@ def create_guest():
         if not validate_fields(data, required):
             return jsonify({"error": "Missing required fields"}), 400
 
-        response = supabase.table("guest").insert({
+        new_guest = {
             "guest_name": data["guest_name"],
             "guest_email": data["guest_email"],
             "guest_tele": data["guest_tele"]
-        }).execute()
+        }
+        response = supabase.table("guest").insert(new_guest).execute()
 
         if response.data:
+            publish_changes("insert", response.data, new_guest)
             guest_id = response.data[0].get("guest_id")
             return jsonify({"message": "Guest created successfully", "guest_id": guest_id}), 201
         return jsonify({"error": "Failed to create guest"}), 400
@@ -96,27 +184,58 @@ def create_guest():
 @guest_blueprint.route('', methods=["GET"])
 def get_all_guests():
     """
-    Retrieve all guests
+    Retrieve all guests, or the guests with the given IDs
     ---
     tags:
       - Guest Management
+    parameters:
+      - name: ids
+        in: query
+        type: string
+        required: false
+        description: Comma-separated guest IDs to fetch in one query (at most 1000); unknown IDs are left out
+        example: "1,2,3"
+      - name: fields
+        in: query
+        type: string
+        required: false
+        description: Comma-separated columns to return (default all)
+        example: "guest_id,chat_id"
     responses:
       200:
-        description: List of guests
+        description: List of guests (with ids, possibly empty)
+      400:
+        description: Malformed ids, too many ids or unknown field
       404:
         description: No guests found
       500:
         description: Internal server error
     """
     try:
-        response = supabase.table("guest").select("*").execute()
+        columns = parse_columns(request.args.get("fields"))
+        if columns is None:
+            return jsonify({"error": f"fields must be among {', '.join(GUEST_COLUMNS)}"}), 400
+        query = supabase.table("guest").select(*columns)
+
+        if "ids" in request.args:
+            try:
+                ids = parse_ids(request.args["ids"])
+            except ValueError:
+                return jsonify({"error": "ids must be a comma-separated list of integers"}), 400
+            if len(ids) > MAX_BULK_IDS:
+                return jsonify({"error": f"At most {MAX_BULK_IDS} ids per request"}), 400
+            rows = query.in_("guest_id", ids).execute().data if ids else []
+            return stream_json_array(rows)
+
+        response = query.execute()
         if response.data:
-            return jsonify(response.data), 200
+            return stream_json_array(response.data)
         return jsonify({"error": "No guests found"}), 404
     except Exception as e:
         return error_response(e)
 
 @guest_blueprint.route('/<int:guest_id>', methods=['GET'])
+@conditional()
 def get_guest(guest_id):
     """
     Retrieve a specific guest by ID
@@ -143,11 +262,11 @@ def get_guest(guest_id):
         description: Internal server error
     """
     try:
-        response = supabase.table("guest").select("*").eq("guest_id", guest_id).execute()
-        if not response.data:
+        rows = read_guests("guest_id", guest_id)
+        if not rows:
             return jsonify({"error": "No guest found"}), 404
 
-        guest = response.data[0]
+        guest = rows[0]
         field = request.args.get('field')
         if field and field in guest:
             return jsonify({field: guest[field]}), 200
@@ -170,7 +289,10 @@ def update_guest(guest_id):
         description: ID of the guest to update
       - in: body
         name: body
-        description: Guest object with updated details
+        description: >
+          Guest object with updated details. wallet and loyalty_points only change through the
+          wallet ledger (PUT /guest/updatewallet/<guest_id>, POST /guest/wallet/ledger); values
+          sent here are ignored.
         required: true
         schema:
           type: object
@@ -178,9 +300,7 @@ def update_guest(guest_id):
             - guest_name
             - guest_email
             - guest_tele
-            - wallet
             - otp
-            - loyalty_points
             - otp_valid_datetime
             - chat_id
           properties:
@@ -193,15 +313,9 @@ def update_guest(guest_id):
             guest_tele:
               type: string
               example: "+1234567890"
-            wallet:
-              type: number
-              example: 100
             otp:
               type: string
               example: "123456"
-            loyalty_points:
-              type: integer
-              example: 50
             otp_valid_datetime:
               type: string
               example: "2025-03-19T10:00:00+00:00"
@@ -218,8 +332,8 @@ def update_guest(guest_id):
     """
     try:
         data = request.json
-        required = {"guest_name", "guest_email", "guest_tele", "wallet",
-                    "otp", "loyalty_points", "otp_valid_datetime", "chat_id"}
+        # wallet and loyalty_points are left to the ledger, which keeps them equal to its entries
+        required = {"guest_name", "guest_email", "guest_tele", "otp", "otp_valid_datetime", "chat_id"}
         if not required.issubset(data):
             return jsonify({"error": "Missing required fields"}), 400
 
@@ -227,18 +341,18 @@ def update_guest(guest_id):
             data["otp_valid_datetime"], "%Y-%m-%dT%H:%M:%S%z"
         ).isoformat()
 
-        response = supabase.table("guest").update({
+        update_data = {
             "guest_name": data["guest_name"],
             "guest_email": data["guest_email"],
             "guest_tele": data["guest_tele"],
-            "wallet": data["wallet"],
             "otp": data["otp"],
-            "loyalty_points": data["loyalty_points"],
             "otp_valid_datetime": otp_valid_datetime,
             "chat_id": data["chat_id"]
-        }).eq("guest_id", guest_id).execute()
+        }
+        response = supabase.table("guest").update(update_data).eq("guest_id", guest_id).execute()
 
         if response.data:
+            publish_changes("update", response.data, update_data)
             return jsonify({"message": "Guest updated successfully"}), 200
         return jsonify({"error": "Failed to update guest"}), 400
     except Exception as e:
@@ -270,6 +384,7 @@ def delete_guest(guest_id):
         if response.data:
             delete_response = supabase.table("guest").delete().eq("guest_id", guest_id).execute()
             if delete_response.data:
+                publish_changes("delete", delete_response.data, ())
                 return jsonify({"message": "Guest deleted successfully"}), 200
             return jsonify({"error": "Failed to delete guest"}), 400
         return jsonify({"error": "Guest not found"}), 404
@@ -351,11 +466,11 @@ def validate_otp(otp):
         description: Internal server error
     """
     try:
-        response = supabase.table("guest").select("*").eq("otp", otp).execute()
-        if not response.data:
+        rows = read_guests("otp", otp)
+        if not rows:
             return jsonify({"message": "No guest found"}), 404
 
-        guest = response.data[0]
+        guest = rows[0]
         otp_valid_datetime = guest.get("otp_valid_datetime")
 
         if otp_valid_datetime is None:
@@ -366,7 +481,9 @@ def validate_otp(otp):
 
             time_iso = end_of_day.isoformat()
 
-            supabase.table("guest").update({"otp_valid_datetime": time_iso}).eq("guest_id", guest["guest_id"]).execute()
+            update_response = supabase.table("guest").update({"otp_valid_datetime": time_iso}) \
+                .eq("guest_id", guest["guest_id"]).execute()
+            publish_changes("update", update_response.data, ["otp_valid_datetime"])
             # return jsonify({"message": "OTP validated, OTP will be available till end of today."}), 200
 
         elif datetime.fromisoformat(otp_valid_datetime) < datetime.now(pytz.utc):
@@ -375,6 +492,56 @@ def validate_otp(otp):
     except Exception as e:
         return error_response(e)
 
+@guest_blueprint.route('/first_use/<int:otp>', methods=['PUT'])
+def record_first_use(otp):
+    """
+    Record the first use of an OTP that was validated elsewhere (e.g. by an offline gate)
+    ---
+    tags:
+      - OTP
+    parameters:
+      - name: otp
+        in: path
+        type: integer
+        required: true
+        description: OTP that was used
+      - in: body
+        name: body
+        required: true
+        schema:
+          type: object
+          required:
+            - otp_valid_datetime
+          properties:
+            otp_valid_datetime:
+              type: string
+              example: "2025-03-01T23:59:59.999999+08:00"
+    responses:
+      200:
+        description: First use recorded
+      400:
+        description: Missing otp_valid_datetime
+      409:
+        description: The OTP is unknown or its first use is already recorded
+      500:
+        description: Internal server error
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        if not data.get("otp_valid_datetime"):
+            return jsonify({"error": "Missing required field: otp_valid_datetime"}), 400
+
+        # Only an OTP that has never been used gets the expiry, so a replayed or late
+        # report can neither extend a ticket nor touch an OTP issued since
+        response = supabase.table("guest").update({"otp_valid_datetime": data["otp_valid_datetime"]}) \
+            .eq("otp", otp).is_("otp_valid_datetime", "null").execute()
+        if not response.data:
+            return jsonify({"message": "OTP unknown or first use already recorded"}), 409
+        publish_changes("update", response.data, ["otp_valid_datetime"])
+        return jsonify({"guest": response.data[0]}), 200
+    except Exception as e:
+        return error_response(e)
+
 @guest_blueprint.route('/isotpunique/<int:otp>', methods=['GET'])
 def is_otp_unique(otp):
     """
@@ -453,10 +620,12 @@ def update_chat_id_by_otp():
         guest = response.data[0]
         guest_id = guest["guest_id"]
 
-        supabase.table("guest").update({"chat_id": None}).eq("chat_id", chat_id).neq("guest_id", guest_id).execute()
+        cleared = supabase.table("guest").update({"chat_id": None}).eq("chat_id", chat_id).neq("guest_id", guest_id).execute()
+        publish_changes("update", cleared.data, ["chat_id"])
 
         update_response = supabase.table("guest").update({"chat_id": chat_id}).eq("guest_id", guest_id).execute()
         if update_response.data:
+            publish_changes("update", update_response.data, ["chat_id"])
             return jsonify({"message": "Chat ID updated successfully"}), 200
         return jsonify({"error": "Failed to update Chat ID"}), 400
     except Exception as e:
@@ -513,29 +682,22 @@ def buy_ticket_by_loyalty(id):
         points_to_subtract = float(data['points'])
         new_otp = data['otp']
 
-        response = supabase.table("guest").select("guest_id", "loyalty_points", "otp", "otp_valid_datetime").eq("guest_id", id).execute()
-        if not response.data:
-            return jsonify({"error": "Guest not found"}), 404
-
-        guest_data = response.data[0]
-        current_loyalty_points = guest_data.get('loyalty_points')
-        if current_loyalty_points < points_to_subtract:
+        try:
+            guest = issue_ticket(id, new_otp, [
+                entry(id, "ticket (loyalty points)", points=-points_to_subtract, ref=ledger_ref("ticket"),
+                      require_funds=True)
+            ])
+        except InsufficientFunds:
             return jsonify({"error": "Insufficient loyalty points"}), 400
+        if guest is None:
+            return jsonify({"error": "Guest not found"}), 404
 
-        new_loyalty_points = current_loyalty_points - points_to_subtract
-        update_response = supabase.table("guest").update({
-            "loyalty_points": new_loyalty_points,
-            "otp": new_otp,
-            "otp_valid_datetime": None
-        }).eq("guest_id", id).execute()
-
-        if update_response.data:
-            return jsonify({
-                "message": "Ticket bought successfully using loyalty points",
-                "new_loyalty_points": new_loyalty_points,
-                "updated_otp": new_otp
-            }), 200
-        return jsonify({"error": "Failed to update guest"}), 500
+        return jsonify({
+            "message": "Ticket bought successfully using loyalty points",
+            "new_loyalty_points": guest.get("loyalty_points"),
+            "updated_otp": new_otp,
+            "guest": purchase_summary(guest)
+        }), 200
     except Exception as e:
         return error_response(e)
 
@@ -587,27 +749,18 @@ def buy_ticket(id):
         new_otp = data['otp']
         points_to_add = math.ceil(float(amount) * 0.10)
 
-        response = supabase.table("guest").select("guest_id", "loyalty_points", "otp", "otp_valid_datetime").eq("guest_id", id).execute()
-        if not response.data:
+        guest = issue_ticket(id, new_otp, [
+            entry(id, "ticket (card)", points=points_to_add, ref=ledger_ref("ticket"))
+        ])
+        if guest is None:
             return jsonify({"error": "Guest not found"}), 404
 
-        guest_data = response.data[0]
-        current_loyalty_points = guest_data.get('loyalty_points')
-        new_loyalty_points = current_loyalty_points + points_to_add
-
-        update_response = supabase.table("guest").update({
-            "loyalty_points": new_loyalty_points,
-            "otp": new_otp,
-            "otp_valid_datetime": None
-        }).eq("guest_id", id).execute()
-
-        if update_response.data:
-            return jsonify({
-                "message": "Ticket bought successfully, loyalty points added.",
-                "points_added": points_to_add,
-                "updated_otp": new_otp
-            }), 200
-        return jsonify({"error": "Failed to update guest"}), 500
+        return jsonify({
+            "message": "Ticket bought successfully, loyalty points added.",
+            "points_added": points_to_add,
+            "updated_otp": new_otp,
+            "guest": purchase_summary(guest)
+        }), 200
     except Exception as e:
         return error_response(e)
 
@@ -659,34 +812,23 @@ def buy_ticket_from_wallet(id):
         new_otp = data['otp']
         points_to_add = math.ceil(float(amount) * 0.10)
 
-        response = supabase.table("guest").select("guest_id", "wallet", "loyalty_points", "otp", "otp_valid_datetime").eq("guest_id", id).execute()
-        if not response.data:
-            return jsonify({"error": "Guest not found"}), 404
-
-        guest_data = response.data[0]
-        current_wallet = guest_data.get('wallet')
-        current_loyalty_points = guest_data.get('loyalty_points')
-        if current_wallet < amount:
+        try:
+            guest = issue_ticket(id, new_otp, [
+                entry(id, "ticket (wallet)", wallet=-amount, points=points_to_add, ref=ledger_ref("ticket"),
+                      require_funds=True)
+            ])
+        except InsufficientFunds:
             return jsonify({"error": "Insufficient wallet funds"}), 400
+        if guest is None:
+            return jsonify({"error": "Guest not found"}), 404
 
-        new_wallet_balance = current_wallet - amount
-        new_loyalty_points = current_loyalty_points + points_to_add
-
-        update_response = supabase.table("guest").update({
-            "wallet": new_wallet_balance,
-            "loyalty_points": new_loyalty_points,
-            "otp": new_otp,
-            "otp_valid_datetime": None
-        }).eq("guest_id", id).execute()
-
-        if update_response.data:
-            return jsonify({
-                "message": "Ticket bought successfully, wallet updated, loyalty points added.",
-                "amount_subtracted": amount,
-                "loyalty_points_added": points_to_add,
-                "updated_otp": new_otp
-            }), 200
-        return jsonify({"error": "Failed to update guest"}), 500
+        return jsonify({
+            "message": "Ticket bought successfully, wallet updated, loyalty points added.",
+            "amount_subtracted": amount,
+            "loyalty_points_added": points_to_add,
+            "updated_otp": new_otp,
+            "guest": purchase_summary(guest)
+        }), 200
     except Exception as e:
         return error_response(e)
 
@@ -739,20 +881,138 @@ def update_wallet(guest_id):
         if wallet_amount == 0:
             return jsonify({"error": "Wallet amount cannot be zero"}), 400
 
-        response = supabase.table("guest").select("wallet").eq("guest_id", guest_id).execute()
-        if not response.data:
+        reason = "wallet top-up" if wallet_amount > 0 else "wallet adjustment"
+        try:
+            posted = ledger.post([entry(guest_id, reason, wallet=int(wallet_amount), ref=ledger_ref("wallet"))])
+        except GuestNotFound:
             return jsonify({"error": "Guest not found"}), 404
+        publish_changes("update", posted, ["wallet"])
+
+        if not posted:
+            # A retry of a posting that already went through
+            posted = supabase.table("guest").select("*").eq("guest_id", guest_id).execute().data
+            if not posted:
+                return jsonify({"error": "Guest not found"}), 404
+        return jsonify({
+            "message": "Wallet updated successfully",
+            "wallet": posted[0].get("wallet"),
+            "guest": purchase_summary(posted[0])
+        }), 200
+    except Exception as e:
+        return error_response(e)
 
-        current_wallet = response.data[0].get('wallet')
-        # if wallet_amount < 0 and current_wallet < abs(wallet_amount):
-        #     return jsonify({"error": "Insufficient funds"}), 400
-
-        new_wallet = current_wallet + int(wallet_amount)
-        update_response = supabase.table("guest").update({"wallet": new_wallet}).eq("guest_id", guest_id).execute()
+@guest_blueprint.route('/wallet/ledger', methods=['POST'])
+def post_ledger_entries():
+    """
+    Post wallet and loyalty points entries for one or more guests in one transaction
+    ---
+    tags:
+      - Wallet
+    parameters:
+      - in: body
+        name: body
+        required: true
+        schema:
+          type: object
+          required:
+            - entries
+          properties:
+            entries:
+              type: array
+              items:
+                type: object
+                required:
+                  - guest_id
+                  - reason
+                properties:
+                  guest_id:
+                    type: integer
+                    example: 1
+                  reason:
+                    type: string
+                    example: "promotion credit"
+                  wallet:
+                    type: number
+                    example: 5
+                  points:
+                    type: number
+                    example: 10
+                  ref:
+                    type: string
+                    description: Unique reference; an entry whose ref was already posted is skipped
+                  require_funds:
+                    type: boolean
+                    description: Refuse the whole posting if this entry would leave a balance negative
+    responses:
+      200:
+        description: Entries posted; returns the guests whose balances changed
+      400:
+        description: Missing fields or insufficient funds
+      404:
+        description: An entry names an unknown guest
+      500:
+        description: Internal server error
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        items = data.get("entries")
+        if not items or not all(validate_fields(item, ["guest_id", "reason"]) for item in items):
+            return jsonify({"error": "entries must be a non-empty list of objects with guest_id and reason"}), 400
+
+        entries = [entry(item["guest_id"], item["reason"], wallet=item.get("wallet", 0), points=item.get("points", 0),
+                         ref=item.get("ref"), require_funds=bool(item.get("require_funds")))
+                   for item in items]
+        try:
+            posted = ledger.post(entries)
+        except InsufficientFunds:
+            return jsonify({"error": "Insufficient funds"}), 400
+        except GuestNotFound:
+            return jsonify({"error": "Guest not found"}), 404
+        publish_changes("update", posted, ["wallet", "loyalty_points"])
+        return jsonify({
+            "guests": [{"guest_id": g["guest_id"], "wallet": g.get("wallet"), "loyalty_points": g.get("loyalty_points")}
+                       for g in posted]
+        }), 200
+    except Exception as e:
+        return error_response(e)
 
-        if update_response.data:
-            return jsonify({"message": "Wallet updated successfully", "wallet": new_wallet}), 200
-        return jsonify({"error": "Failed to update wallet"}), 500
+@guest_blueprint.route('/wallet/ledger/<int:guest_id>', methods=['GET'])
+def get_ledger_entries(guest_id):
+    """
+    Retrieve a guest's wallet and loyalty points history, newest first
+    ---
+    tags:
+      - Wallet
+    parameters:
+      - name: guest_id
+        in: path
+        type: integer
+        required: true
+      - name: limit
+        in: query
+        type: integer
+        required: false
+        description: Entries returned at most (default 100, max 1000)
+      - name: before
+        in: query
+        type: integer
+        required: false
+        description: Only entries older than this entry_id (for paging)
+    responses:
+      200:
+        description: Ledger entries (possibly empty)
+      400:
+        description: Invalid limit or before
+      500:
+        description: Internal server error
+    """
+    try:
+        try:
+            limit = min(int(request.args.get("limit", 100)), 1000)
+            before = int(request.args["before"]) if "before" in request.args else None
+        except ValueError:
+            return jsonify({"error": "limit and before must be integers"}), 400
+        return jsonify({"entries": ledger.history(guest_id, limit=limit, before=before)}), 200
     except Exception as e:
         return error_response(e)
 
@@ -828,6 +1088,65 @@ def get_valid_chat_ids():
     except Exception as e:
         return error_response(e)
 
+@guest_blueprint.route('/valid_otps', methods=['GET'])
+def get_valid_otps():
+    """
+    Retrieve every OTP that is currently valid (issued and not yet expired)
+    ---
+    tags:
+      - OTP
+    parameters:
+      - name: detail
+        in: query
+        type: boolean
+        required: false
+        description: Return the owning guest and expiry of each OTP instead of bare OTPs
+    responses:
+      200:
+        description: List of valid OTPs (possibly empty)
+      500:
+        description: Internal server error
+    """
+    try:
+        detail = request.args.get("detail", "false").lower() == "true"
+        current_time = datetime.now(pytz.timezone('Asia/Singapore'))
+        columns = ("otp", "otp_valid_datetime", "guest_id", "guest_name") if detail else ("otp", "otp_valid_datetime", "guest_id")
+
+        # Filtered in the query and paged by guest_id, so no valid OTP is cut off by max-rows
+        valid = []
+        while True:
+            query = (supabase.table("guest").select(*columns)
+                     .not_.is_("otp", "null")
+                     .or_(f'otp_valid_datetime.is.null,otp_valid_datetime.gte."{current_time.isoformat()}"'))
+            if valid:
+                query = query.gt("guest_id", valid[-1]["guest_id"])
+            page = query.order("guest_id").limit(VALID_OTPS_PAGE_SIZE).execute().data
+            valid.extend(page)
+            if len(page) < VALID_OTPS_PAGE_SIZE:
+                break
+
+        if detail:
+            return jsonify({"guests": valid}), 200
+        return jsonify({"otps": [guest["otp"] for guest in valid]}), 200
+    except Exception as e:
+        return error_response(e)
+
+@guest_blueprint.route('/singleflight', methods=['GET'])
+def get_singleflight_stats():
+    """
+    Single-flight read counters
+    ---
+    tags:
+      - Monitoring
+    description: >
+      Reads of GET /guest/<guest_id> and /guest/validate/<otp> that ran their own Supabase
+      query (misses), that shared a concurrent identical query (hits), and queries running now.
+    responses:
+      200:
+        description: Counters since the service started
+    """
+    return jsonify(reads.stats()), 200
+
 # Register the guest Blueprint with the app
 app.register_blueprint(guest_blueprint, url_prefix="/guest")
 
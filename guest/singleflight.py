@@ -0,0 +1,84 @@
+"""
+Single-flight reads for the guest service.
+
+At park opening many requests read the same guest at once (enterpark validating an OTP,
+makepayment's post-purchase read, sendnotification's notification fetch). ``SingleFlight.do``
+lets identical concurrent reads share one Supabase query: the first request for a key runs the
+query, and requests for the same key that arrive while it is in flight wait for it and get the
+same result (or the same exception). Nothing is kept once the query returns, so a request never
+gets a result that was read before it arrived, except from a query already running when it did.
+
+Writes in this process call ``forget()``, so a read that starts after a write never joins a
+query that may have read the row before it.
+
+Counters, as returned by ``stats()``:
+    misses     - requests that ran their own query
+    hits       - requests that shared an in-flight query instead
+    in_flight  - queries running now
+"""
+
+import threading
+
+
+class _Call:
+    """One in-flight query and its outcome."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Shares in-flight calls between concurrent callers asking for the same key."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.hits = 0
+        self.misses = 0
+
+    def do(self, key, fn):
+        """
+        Return ``fn()``, sharing the call with concurrent callers for the same key.
+
+        Args:
+            key (Hashable): Identifies the read, e.g. ("guest_id", 42).
+            fn (Callable[[], Any]): Runs the read. Its result is shared, so callers must not modify it.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.misses += 1
+            else:
+                self.hits += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def forget(self):
+        """Make later callers start new calls instead of joining those in flight."""
+        with self._lock:
+            self._calls.clear()
+
+    def stats(self):
+        """Hit and miss counters since the service started."""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "in_flight": len(self._calls)}
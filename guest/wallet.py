@@ -0,0 +1,145 @@
+"""
+Append-only wallet and loyalty ledger for guests.
+
+Every wallet or loyalty points movement is an entry in ``wallet_ledger``, posted through the
+``wallet_post`` database function (see wallet_ledger.sql). In one transaction it appends the
+entries and adds their totals to the guest's ``wallet`` and ``loyalty_points`` columns. Those
+columns stay the materialised current balance, so balance reads are a single-row read as
+before. Concurrent top-ups and purchases become atomic increments in the database instead
+of a read-modify-write in this service, so no update is lost.
+
+Entries carry an optional ``ref``; an entry whose ref is already in the ledger is skipped, so
+a retried request (same Idempotency-Key) never moves money twice. Entries posted together
+succeed or fail together. ``wallet_snapshot`` is called every WALLET_SNAPSHOT_INTERVAL seconds
+to fold new entries into per-guest balance snapshots, against which the materialised balance
+can be audited without replaying the whole ledger. Ticket purchases go through
+``wallet_issue_ticket``, which posts the payment and issues the ticket's OTP in the same
+transaction.
+
+Environment:
+    WALLET_SNAPSHOT_INTERVAL - seconds between snapshot runs (default: 300; 0 disables them)
+"""
+
+import logging
+import os
+import threading
+import time
+
+from postgrest.exceptions import APIError
+
+SNAPSHOT_INTERVAL = float(os.getenv("WALLET_SNAPSHOT_INTERVAL", "300"))
+FOREIGN_KEY_VIOLATION = "23503"
+
+
+class InsufficientFunds(Exception):
+    """An entry with ``require_funds`` would have left a balance negative."""
+
+
+class GuestNotFound(Exception):
+    """An entry names a guest that does not exist."""
+
+
+def entry(guest_id, reason, wallet=0, points=0, ref=None, require_funds=False):
+    """
+    Build a ledger entry.
+
+    Args:
+        guest_id (int): Guest whose balances move.
+        reason (str): What the movement is for, kept in the ledger.
+        wallet (float): Wallet change (negative to debit).
+        points (int): Loyalty points change (negative to redeem).
+        ref (str, optional): Unique reference; a second entry with the same ref is skipped.
+        require_funds (bool): Refuse the posting if it would leave a balance negative.
+    """
+    return {"guest_id": guest_id, "reason": reason, "wallet_delta": wallet, "points_delta": points,
+            "ref": ref, "require_funds": require_funds}
+
+
+class WalletLedger:
+    """
+    Posts and reads wallet ledger entries.
+
+    Args:
+        supabase (Client): Supabase client.
+    """
+
+    def __init__(self, supabase):
+        self.supabase = supabase
+        self._snapshot_thread = None
+
+    def post(self, entries):
+        """
+        Append entries and update the materialised balances, atomically.
+
+        Returns:
+            list[dict]: The guest rows whose balances changed (none if every entry was a repeat).
+
+        Raises:
+            InsufficientFunds: If an entry with ``require_funds`` would leave a balance negative.
+            GuestNotFound: If an entry names an unknown guest.
+        """
+        try:
+            return self.supabase.rpc("wallet_post", {"entries": entries}).execute().data or []
+        except APIError as e:
+            if e.hint == "insufficient_funds":
+                raise InsufficientFunds(e.message) from e
+            if e.code == FOREIGN_KEY_VIOLATION:
+                raise GuestNotFound(e.message) from e
+            raise
+
+    def issue_ticket(self, entries, guest_id, otp):
+        """
+        Post the entries of a ticket purchase and issue its OTP, atomically.
+
+        Returns:
+            dict | None: The updated guest row, or None if the guest does not exist.
+
+        Raises:
+            InsufficientFunds: If an entry with ``require_funds`` would leave a balance negative.
+            GuestNotFound: If an entry names an unknown guest.
+        """
+        params = {"entries": entries, "p_guest_id": guest_id, "p_otp": otp}
+        try:
+            rows = self.supabase.rpc("wallet_issue_ticket", params).execute().data
+        except APIError as e:
+            if e.hint == "insufficient_funds":
+                raise InsufficientFunds(e.message) from e
+            if e.code == FOREIGN_KEY_VIOLATION:
+                raise GuestNotFound(e.message) from e
+            raise
+        return rows[0] if rows else None
+
+    def history(self, guest_id, limit=100, before=None):
+        """
+        A guest's ledger entries, newest first.
+
+        Args:
+            guest_id (int): Guest to list.
+            limit (int): Entries returned at most.
+            before (int, optional): Only entries with a lower entry_id (for paging).
+        """
+        query = self.supabase.table("wallet_ledger").select("*").eq("guest_id", guest_id)
+        if before is not None:
+            query = query.lt("entry_id", before)
+        return query.order("entry_id", desc=True).limit(limit).execute().data
+
+    def snapshot(self):
+        """Fold new entries into balance snapshots; returns the number of snapshots taken."""
+        return self.supabase.rpc("wallet_snapshot", {}).execute().data
+
+    def start_snapshots(self):
+        """Take snapshots every SNAPSHOT_INTERVAL seconds in a daemon thread."""
+        if SNAPSHOT_INTERVAL > 0 and self._snapshot_thread is None:
+            self._snapshot_thread = threading.Thread(target=self._snapshot_forever, name="wallet-snapshots",
+                                                     daemon=True)
+            self._snapshot_thread.start()
+
+    def _snapshot_forever(self):
+        while True:
+            time.sleep(SNAPSHOT_INTERVAL)
+            try:
+                taken = self.snapshot()
+                if taken:
+                    logging.info("Took %s wallet snapshots", taken)
+            except Exception:
+                logging.exception("Wallet snapshot failed")
@@ -0,0 +1,163 @@
+-- Append-only wallet and loyalty ledger for guests (see guest/wallet.py).
+--
+-- Apply once in the Supabase SQL editor (or with psql) before deploying the guest service.
+-- Re-running it is harmless: only guests without any ledger entry get an opening balance.
+--
+--   wallet_ledger     every wallet / loyalty points movement, never updated
+--   wallet_snapshot   balances as of a ledger position, taken periodically
+--   wallet_post()     appends entries and adds their totals to guest.wallet / guest.loyalty_points
+--                     in one transaction; guest.wallet and guest.loyalty_points are the
+--                     materialised current balance
+--   wallet_issue_ticket() posts a ticket purchase and issues its OTP in one transaction
+--   wallet_snapshot() folds the entries since the last snapshot into new snapshots
+--   wallet_balance()  latest snapshot + later entries, to audit the materialised balance
+
+create table if not exists wallet_ledger (
+    entry_id      bigint generated always as identity primary key,
+    guest_id      bigint not null references guest (guest_id) on delete cascade,
+    wallet_delta  numeric not null default 0,
+    points_delta  numeric not null default 0,
+    reason        text not null,
+    ref           text unique,
+    created_at    timestamptz not null default now()
+);
+create index if not exists wallet_ledger_guest_entry on wallet_ledger (guest_id, entry_id);
+
+create table if not exists wallet_snapshot (
+    guest_id        bigint not null references guest (guest_id) on delete cascade,
+    last_entry_id   bigint not null,
+    wallet          numeric not null,
+    loyalty_points  numeric not null,
+    taken_at        timestamptz not null default now(),
+    primary key (guest_id, last_entry_id)
+);
+
+-- Entries are corrected with new entries, never edited
+create or replace function wallet_ledger_append_only() returns trigger
+language plpgsql as $$
+begin
+    raise exception 'wallet_ledger is append-only';
+end $$;
+
+drop trigger if exists wallet_ledger_append_only on wallet_ledger;
+create trigger wallet_ledger_append_only before update on wallet_ledger
+    for each row execute function wallet_ledger_append_only();
+
+-- The balances held before the ledger existed become each guest's first entry. A guest that
+-- already has entries (e.g. created after a first run) has its balance in the ledger already.
+insert into wallet_ledger (guest_id, wallet_delta, points_delta, reason, ref)
+select g.guest_id, coalesce(g.wallet, 0), coalesce(g.loyalty_points, 0), 'opening balance', 'opening:' || g.guest_id
+from guest g
+where not exists (select 1 from wallet_ledger l where l.guest_id = g.guest_id)
+on conflict (ref) do nothing;
+
+-- entries: [{"guest_id", "wallet_delta", "points_delta", "reason", "ref", "require_funds"}, ...]
+-- Returns the guest rows whose balance changed. Entries whose ref is already in the ledger
+-- are skipped. If an entry with require_funds would leave its guest's wallet or loyalty
+-- points negative, nothing is posted and the call fails with hint 'insufficient_funds'.
+create or replace function wallet_post(entries jsonb) returns setof guest
+language plpgsql as $$
+begin
+    return query
+    with inserted as (
+        insert into wallet_ledger (guest_id, wallet_delta, points_delta, reason, ref)
+        select (e->>'guest_id')::bigint,
+               coalesce((e->>'wallet_delta')::numeric, 0),
+               coalesce((e->>'points_delta')::numeric, 0),
+               e->>'reason',
+               e->>'ref'
+        from jsonb_array_elements(entries) as e
+        on conflict (ref) do nothing
+        returning guest_id, wallet_delta, points_delta
+    ), totals as (
+        select guest_id, sum(wallet_delta) as wallet_delta, sum(points_delta) as points_delta
+        from inserted
+        group by guest_id
+    )
+    update guest g
+    set wallet = coalesce(g.wallet, 0) + t.wallet_delta,
+        loyalty_points = coalesce(g.loyalty_points, 0) + t.points_delta
+    from totals t
+    where g.guest_id = t.guest_id
+    returning g.*;
+
+    if exists (
+        select 1
+        from jsonb_array_elements(entries) as e
+        join guest g on g.guest_id = (e->>'guest_id')::bigint
+        where coalesce((e->>'require_funds')::boolean, false)
+          and (g.wallet < 0 or g.loyalty_points < 0)
+    ) then
+        raise exception 'insufficient funds' using hint = 'insufficient_funds';
+    end if;
+end $$;
+
+-- Posts the entries of a ticket purchase as wallet_post() does, then issues the ticket's OTP, in
+-- one transaction: a guest is never charged without getting the ticket, nor gets it without being
+-- charged. A repeated ref means the purchase was already posted together with an OTP, so the
+-- (retried) OTP is issued again. Returns the guest row (none if the guest does not exist).
+create or replace function wallet_issue_ticket(entries jsonb, p_guest_id bigint, p_otp text)
+returns setof guest
+language plpgsql as $$
+begin
+    perform wallet_post(entries);
+
+    return query
+    update guest
+    set otp = p_otp, otp_valid_datetime = null
+    where guest_id = p_guest_id
+    returning *;
+end $$;
+
+-- Returns the number of snapshots taken. Entries younger than a minute are left for the
+-- next run: a lower entry_id may still be in an uncommitted transaction.
+create or replace function wallet_snapshot() returns integer
+language plpgsql as $$
+declare
+    since bigint;
+    cutoff bigint;
+    taken integer;
+begin
+    perform pg_advisory_xact_lock(hashtext('wallet_snapshot'));
+
+    select coalesce(max(last_entry_id), 0) into since from wallet_snapshot;
+    select max(entry_id) into cutoff from wallet_ledger where created_at < now() - interval '1 minute';
+    if cutoff is null or cutoff <= since then
+        return 0;
+    end if;
+
+    insert into wallet_snapshot (guest_id, last_entry_id, wallet, loyalty_points)
+    select l.guest_id, cutoff,
+           coalesce(prev.wallet, 0) + sum(l.wallet_delta),
+           coalesce(prev.loyalty_points, 0) + sum(l.points_delta)
+    from wallet_ledger l
+    left join lateral (
+        select s.wallet, s.loyalty_points
+        from wallet_snapshot s
+        where s.guest_id = l.guest_id
+        order by s.last_entry_id desc
+        limit 1
+    ) prev on true
+    where l.entry_id > since and l.entry_id <= cutoff
+    group by l.guest_id, prev.wallet, prev.loyalty_points;
+
+    get diagnostics taken = row_count;
+    return taken;
+end $$;
+
+create or replace function wallet_balance(p_guest_id bigint)
+returns table (wallet numeric, loyalty_points numeric)
+language sql stable as $$
+    with snap as (
+        select s.last_entry_id, s.wallet, s.loyalty_points
+        from wallet_snapshot s
+        where s.guest_id = p_guest_id
+        order by s.last_entry_id desc
+        limit 1
+    )
+    select coalesce((select snap.wallet from snap), 0) + coalesce(sum(l.wallet_delta), 0),
+           coalesce((select snap.loyalty_points from snap), 0) + coalesce(sum(l.points_delta), 0)
+    from wallet_ledger l
+    where l.guest_id = p_guest_id
+      and l.entry_id > coalesce((select snap.last_entry_id from snap), 0);
+$$;
@@ -0,0 +1,49 @@
+"""
+Conditional GET support for Flask read endpoints.
+
+``@conditional`` gives a successful GET response a strong ETag (a hash of its body) and
+answers a matching ``If-None-Match`` with ``304 Not Modified`` and no body, so pollers
+that already have the current representation do not download it again. It also sets
+``Cache-Control``:
+
+    @conditional()                  -> "private, no-cache": clients may keep it but must revalidate
+    @conditional(max_age=5)         -> "public, max-age=5": shared caches (Kong proxy-cache) may
+                                       serve it for 5 seconds without asking the service
+
+Only use ``max_age`` on data that is safe to share between users and fine to serve
+slightly stale.
+"""
+
+import functools
+
+from flask import make_response, request
+
+
+def conditional(max_age=0):
+    """
+    Decorate a Flask view with ETag / If-None-Match handling and Cache-Control hints.
+
+    Args:
+        max_age (int): Seconds a shared cache may reuse the response; 0 means revalidate every time.
+    """
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            response = make_response(view(*args, **kwargs))
+            if request.method not in ("GET", "HEAD") or response.status_code != 200:
+                return response
+
+            if "ETag" not in response.headers:
+                response.add_etag()
+            if max_age:
+                response.cache_control.public = True
+                response.cache_control.max_age = max_age
+            else:
+                response.cache_control.private = True
+                response.cache_control.no_cache = True
+            return response.make_conditional(request)
+
+        return wrapper
+
+    return decorator
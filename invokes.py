@@ -1,4 +1,7 @@
 import requests
+from opentelemetry.trace import SpanKind
+
+from tracing import inject_headers, start_span
 
 # Supported HTTP methods
 SUPPORTED_HTTP_METHODS = {
@@ -9,6 +12,9 @@ def invoke_http(url, method='GET', json=None, **kwargs):
     """
     A simple wrapper for making HTTP requests using the requests library.
 
+    The call is recorded as a CLIENT span and the current W3C trace-context is
+    forwarded in the request headers, so the downstream service joins the same trace.
+
     Args:
         url (str): The target URL for the HTTP request.
         method (str): HTTP method (e.g., 'GET', 'POST').
@@ -22,28 +28,34 @@ def invoke_http(url, method='GET', json=None, **kwargs):
     if method not in SUPPORTED_HTTP_METHODS:
         return {"code": 405, "message": f"HTTP method {method} is not supported."}
 
-    try:
-        response = requests.request(method, url, json=json, **kwargs)
-    except requests.exceptions.RequestException as e:
-        return {"code": 500, "message": f"Service invocation failed: {url}. {str(e)}"}
+    with start_span(f"HTTP {method}", kind=SpanKind.CLIENT,
+                    attributes={"http.method": method, "http.url": url}) as span:
+        kwargs["headers"] = inject_headers(kwargs.get("headers"))
+        try:
+            response = requests.request(method, url, json=json, **kwargs)
+        except requests.exceptions.RequestException as e:
+            span.record_exception(e)
+            return {"code": 500, "message": f"Service invocation failed: {url}. {str(e)}"}
+
+        span.set_attribute("http.status_code", response.status_code)
+
+        # Handle non-2xx status codes
+        if not (200 <= response.status_code < 300):
+            try:
+                error_json = response.json()
+                error_json["code"] = response.status_code
+                return error_json
+            except ValueError:
+                return {
+                    "code": response.status_code,
+                    "message": f"HTTP error {response.status_code} from {url} with no JSON body."
+                }
 
-    # Handle non-2xx status codes
-    if not (200 <= response.status_code < 300):
+        # Handle successful response
         try:
-            error_json = response.json()
-            error_json["code"] = response.status_code
-            return error_json
-        except ValueError:
+            return response.json() if response.content else {}
+        except ValueError as e:
             return {
-                "code": response.status_code,
-                "message": f"HTTP error {response.status_code} from {url} with no JSON body."
+                "code": 500,
+                "message": f"Invalid JSON output from service: {url}. {str(e)}"
             }
-
-    # Handle successful response
-    try:
-        return response.json() if response.content else {}
-    except ValueError as e:
-        return {
-            "code": 500,
-            "message": f"Invalid JSON output from service: {url}. {str(e)}"
-        }
@@ -1,7 +1,12 @@
-from flask import Flask, Blueprint, jsonify
+import os
+import sys
+from flask import Flask, Blueprint, jsonify, request
 from flasgger import Swagger
 import RPi.GPIO as GPIO
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from door import DEFAULT_HOLD_MS, DoorController, start_command_listener
+
 # -------------------------------
 # Flask App Setup
 # -------------------------------
@@ -18,39 +23,33 @@ relay_pin = 18
 GPIO.setmode(GPIO.BCM)
 GPIO.setup(relay_pin, GPIO.IN)
 
-app_lock_open = False  # Track lock state internally
-
 # -------------------------------
 # Lock Control Functions
 # -------------------------------
 
-def open_lock():
-    global app_lock_open
+def engage_relay():
     try:
-        if not app_lock_open:
-            GPIO.setup(relay_pin, GPIO.OUT, initial=GPIO.HIGH)
-            GPIO.output(relay_pin, False)  # Set pin LOW to activate relay
-            app_lock_open = True
-            print("🔓 Lock opened")
-        else:
-            print("🔓 Lock already open")
+        GPIO.setup(relay_pin, GPIO.OUT, initial=GPIO.HIGH)
+        GPIO.output(relay_pin, False)  # Set pin LOW to activate relay
+        print("🔓 Lock opened")
     except Exception as e:
         print(f"❌ Error opening lock: {e}")
         raise
 
-def close_lock():
-    global app_lock_open
+def release_relay():
     try:
-        if app_lock_open:
-            GPIO.setup(relay_pin, GPIO.IN)  # Set back to input mode
-            app_lock_open = False
-            print("🔒 Lock closed")
-        else:
-            print("🔒 Lock already closed")
+        GPIO.setup(relay_pin, GPIO.IN)  # Set back to input mode
+        print("🔒 Lock closed")
     except Exception as e:
         print(f"❌ Error closing lock: {e}")
         raise
 
+door = DoorController(engage=engage_relay, release=release_relay)  # Tracks lock state and pulse timing
+
+# Also take door commands over AMQP (door.<DOOR_ID>.command)
+if os.getenv("DOOR_COMMANDS_ENABLED", "false").lower() == "true":
+    start_command_listener(door, source="lock")
+
 # -------------------------------
 # API Routes
 # -------------------------------
@@ -81,8 +80,7 @@ def open_lock_api():
               example: "Failed to open lock: <error message>"
     """
     try:
-        if not app_lock_open:
-            open_lock()
+        if door.open():
             return jsonify({"message": "Lock opened!"}), 200
         return jsonify({"message": "Lock is already open!"}), 200
     except Exception as e:
@@ -114,13 +112,62 @@ def close_lock_api():
               example: "Failed to close lock: <error message>"
     """
     try:
-        if app_lock_open:
-            close_lock()
+        if door.close():
             return jsonify({"message": "Lock closed!"}), 200
         return jsonify({"message": "Lock is already closed!"}), 200
     except Exception as e:
         return jsonify({"error": f"Failed to close lock: {e}"}), 500
 
+@lock_blueprint.route("/pulse", methods=["GET"])
+def pulse_lock_api():
+    """
+    Open the lock for a hold window, then close it on a device-side timer.
+    A pulse while the lock is open extends the window.
+    ---
+    tags:
+      - Lock Control
+    parameters:
+      - name: hold_ms
+        in: query
+        type: integer
+        required: false
+        description: Milliseconds to hold the lock open (default 3000)
+    responses:
+      200:
+        description: Lock opened (or window extended); returns the actuation timestamps.
+        schema:
+          type: object
+          properties:
+            lock_state:
+              type: boolean
+              example: true
+            opened_at:
+              type: string
+              example: "2024-04-04T12:30:41.120"
+            closes_at:
+              type: string
+              example: "2024-04-04T12:30:44.120"
+            closed_at:
+              type: string
+              example: "2024-04-04T12:29:02.415"
+            hold_ms:
+              type: integer
+              example: 3000
+            extended:
+              type: boolean
+              example: false
+      400:
+        description: Invalid hold_ms.
+      500:
+        description: Failed to open lock.
+    """
+    try:
+        return jsonify(door.pulse(int(request.args.get("hold_ms", DEFAULT_HOLD_MS)))), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": f"Failed to open lock: {e}"}), 500
+
 @lock_blueprint.route("/get_state", methods=["GET"])
 def get_lock_state():
     """
@@ -147,7 +194,7 @@ def get_lock_state():
               example: "Failed to get lock state: <error message>"
     """
     try:
-        return jsonify({"lock_state": app_lock_open}), 200
+        return jsonify(door.state()), 200
     except Exception as e:
         return jsonify({"error": f"Failed to get lock state: {e}"}), 500
 
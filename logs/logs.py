@@ -1,12 +1,22 @@
 from flask import Blueprint, Flask, jsonify, request
 from flask_cors import CORS
 import os
+import sys
 from supabase import create_client, Client
 from dotenv import load_dotenv
+from collections import Counter
 from datetime import datetime
 import logging
 from flasgger import Swagger, swag_from
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from columnar_export import export_response, swagger_spec
+from http_cache import conditional
+from fast_responses import enable_fast_responses
+from tracing import instrument_app
+from occupancy import OccupancyAggregator
+from maintenance import start_scheduler
+
 # Load environment variables
 load_dotenv()
 
@@ -19,11 +29,26 @@ supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
 app = Flask(__name__)
 Swagger(app)
 CORS(app)
+instrument_app(app, "logs")
+enable_fast_responses(app)
 logs_blueprint = Blueprint("log", __name__)
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
 
+# Seconds Kong's proxy cache may serve log reads without asking this service
+CACHE_MAX_AGE = int(os.getenv("LOG_CACHE_MAX_AGE", "5"))
+DAILY_CACHE_MAX_AGE = int(os.getenv("LOG_DAILY_CACHE_MAX_AGE", "300"))
+
+# Occupancy counters, fed from access events in the background
+occupancy = OccupancyAggregator(supabase)
+if os.getenv("OCCUPANCY_ENABLED", "true").lower() == "true":
+    occupancy.start()
+
+# Daily retention, rollup and archival of old rows
+if os.getenv("MAINTENANCE_ENABLED", "false").lower() == "true":
+    start_scheduler(supabase)
+
 # ---------------------------
 # Routes
 # ---------------------------
@@ -153,9 +178,10 @@ def create_log():
         }
     }
 })
+@conditional(max_age=CACHE_MAX_AGE)
 def read_all_logs():
     try:
-        response = supabase.table("logs").select("*").execute()
+        response = supabase.table("logs").select("*").order("id").execute()
 
         if not response.data:
             return jsonify({"error": "No activity logs found"}), 404
@@ -209,9 +235,10 @@ def read_all_logs():
         }
     }
 })
+@conditional(max_age=CACHE_MAX_AGE)
 def read_all_guest():
     try:
-        response = supabase.table("logs").select("*").eq("user_type","guest").execute()
+        response = supabase.table("logs").select("*").eq("user_type","guest").order("id").execute()
 
         if not response.data:
             return jsonify({"error": "No guest logs found"}), 404
@@ -264,9 +291,10 @@ def read_all_guest():
         }
     }
 })
+@conditional(max_age=CACHE_MAX_AGE)
 def read_all_staff():
     try:
-        response = supabase.table("logs").select("*").eq("user_type","staff").execute()
+        response = supabase.table("logs").select("*").eq("user_type","staff").order("id").execute()
 
         if not response.data:
             return jsonify({"error": "No staff logs found"}), 404
@@ -329,9 +357,10 @@ def read_all_staff():
         }
     }
 })
+@conditional(max_age=CACHE_MAX_AGE)
 def read_guest_logs(guest_id):
     try:
-        response = supabase.table("logs").select("*").eq("user_type", "guest").eq("user_id", guest_id).execute()
+        response = supabase.table("logs").select("*").eq("user_type", "guest").eq("user_id", guest_id).order("id").execute()
 
         if not response.data:
             return jsonify({"error": f"No logs found for guest_id {guest_id}"}), 404
@@ -394,9 +423,10 @@ def read_guest_logs(guest_id):
         }
     }
 })
+@conditional(max_age=CACHE_MAX_AGE)
 def read_staff_logs(staff_id):
     try:
-        response = supabase.table("logs").select("*").eq("user_type", "staff").eq("user_id", staff_id).execute()
+        response = supabase.table("logs").select("*").eq("user_type", "staff").eq("user_id", staff_id).order("id").execute()
 
         if not response.data:
             return jsonify({"error": f"No logs found for staff_id {staff_id}"}), 404
@@ -406,6 +436,111 @@ def read_staff_logs(staff_id):
     except Exception as e:
         return jsonify({"error": f"Server error: {str(e)}"}), 500
 
+@logs_blueprint.route("/occupancy", methods=["GET"])
+@swag_from({
+    'tags': ['Logs'],
+    'summary': 'Get live occupancy and entry-rate counters',
+    'description': 'Counters maintained incrementally from access events: unique guests and entries today, '
+                   'failed staff attempts today, and entries per minute (last hour) and per hour (last day).',
+    'responses': {
+        200: {
+            'description': 'Current counters',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'day': {'type': 'string', 'example': '2023-04-04'},
+                    'guests_today': {'type': 'integer', 'example': 312},
+                    'guest_entries_today': {'type': 'integer', 'example': 318},
+                    'staff_entries_today': {'type': 'integer', 'example': 14},
+                    'failed_staff_attempts_today': {'type': 'integer', 'example': 2},
+                    'failed_staff_attempts_by_staff': {'type': 'object', 'example': {'3': 2}},
+                    'entries_last_minute': {'type': 'integer', 'example': 4},
+                    'entries_last_hour': {'type': 'integer', 'example': 96},
+                    'entries_per_minute': {
+                        'type': 'array',
+                        'items': {
+                            'type': 'object',
+                            'properties': {
+                                'minute': {'type': 'string', 'example': '2023-04-04T12:30:00'},
+                                'entries': {'type': 'integer', 'example': 4}
+                            }
+                        }
+                    },
+                    'entries_per_hour': {
+                        'type': 'array',
+                        'items': {
+                            'type': 'object',
+                            'properties': {
+                                'hour': {'type': 'string', 'example': '2023-04-04T12:00:00'},
+                                'entries': {'type': 'integer', 'example': 96}
+                            }
+                        }
+                    },
+                    'last_event_at': {'type': 'string', 'example': '2023-04-04T12:30:41'}
+                }
+            }
+        }
+    }
+})
+@conditional(max_age=CACHE_MAX_AGE)
+def read_occupancy():
+    return jsonify(occupancy.counters.snapshot()), 200
+
+@logs_blueprint.route("/daily", methods=["GET"])
+@swag_from({
+    'tags': ['Logs'],
+    'summary': 'Get daily activity summaries',
+    'description': 'Daily counts by user_type, action and type for days whose raw logs have been rolled up and archived.',
+    'parameters': [
+        {'name': 'from', 'in': 'query', 'type': 'string', 'required': False, 'description': 'First day (YYYY-MM-DD)'},
+        {'name': 'to', 'in': 'query', 'type': 'string', 'required': False, 'description': 'Last day (YYYY-MM-DD)'}
+    ],
+    'responses': {
+        200: {
+            'description': 'Daily summaries',
+            'schema': {
+                'type': 'array',
+                'items': {
+                    'type': 'object',
+                    'properties': {
+                        'day': {'type': 'string', 'example': '2023-04-04'},
+                        'user_type': {'type': 'string', 'example': 'guest'},
+                        'action': {'type': 'string', 'example': 'Entry'},
+                        'type': {'type': 'string', 'example': 'Success'},
+                        'count': {'type': 'integer', 'example': 812}
+                    }
+                }
+            }
+        },
+        500: {'description': 'Server error'}
+    }
+})
+@conditional(max_age=DAILY_CACHE_MAX_AGE)
+def read_daily_summaries():
+    try:
+        query = supabase.table("logs_daily").select("*")
+        if request.args.get("from"):
+            query = query.gte("day", request.args["from"])
+        if request.args.get("to"):
+            query = query.lte("day", request.args["to"])
+        response = query.order("day").execute()
+        # A day rolled up in several parts (late rows) has one summary row per part
+        totals = Counter()
+        for row in response.data:
+            totals[(row["day"], row["user_type"], row["action"], row["type"])] += row["count"]
+        return jsonify([
+            {"day": day, "user_type": user_type, "action": action, "type": type_, "count": count}
+            for (day, user_type, action, type_), count in totals.items()
+        ]), 200
+
+    except Exception as e:
+        return jsonify({"error": f"Server error: {str(e)}"}), 500
+
+@logs_blueprint.route("/export", methods=["GET"])
+@swag_from(swagger_spec("logs", "Logs"))
+def export_logs():
+    return export_response(supabase, "logs", request.args)
+
 # ---------------------------
 # Register Blueprint & Start App
 # ---------------------------
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+Retention, rollup and archival for the logs and errorlogs tables.
+
+For every whole day older than the retention horizon, one day at a time:
+    1. the day's raw rows are streamed into a zstd-compressed Parquet part file
+       (``<LOG_ARCHIVE_DIR>/<table>/<table>_<day>_<last id>.parquet``) and, in the same pass,
+       counted into daily summaries
+    2. the summaries are upserted into ``logs_daily`` / ``errorlogs_daily`` under the part's
+       last id, next to those of earlier parts of the day
+    3. only then are the part's raw rows (the day's rows up to its last id) deleted from the
+       hot table
+
+logsink writes rows by event time, so a day can receive late rows after it was archived.
+The next run archives them as a new part and adds their counts as new summary rows; earlier
+parts and their counts are kept. Days without rows are skipped. A part whose rows are still in
+the hot table was interrupted after step 1: the next run counts it again from its file,
+re-upserts its summaries and deletes its rows, so a run interrupted at any point is completed
+by the next without counting anything twice.
+
+Runs inside the logs service once a day (MAINTENANCE_ENABLED=true), or standalone:
+
+    python logs/maintenance.py                 # archive, roll up and delete
+    python logs/maintenance.py --dry-run       # only report what would be done
+
+Summary tables (a day's count is the sum over its parts):
+    create table logs_daily (
+        day        date not null,
+        part       text not null default '',
+        user_type  text not null,
+        action     text not null,
+        type       text not null,
+        count      int  not null,
+        primary key (day, part, user_type, action, type)
+    );
+    create table errorlogs_daily (
+        day      date not null,
+        part     text not null default '',
+        service  text not null,
+        count    int  not null,
+        primary key (day, part, service)
+    );
+
+Tables created before parts existed are migrated with, e.g. for logs_daily:
+    alter table logs_daily add column part text not null default '';
+    alter table logs_daily drop constraint logs_daily_pkey,
+        add primary key (day, part, user_type, action, type);
+
+Environment:
+    LOG_RETENTION_DAYS  - days of raw rows kept in the hot tables (default: 90)
+    LOG_ARCHIVE_DIR     - where archive files are written (default: logs/archive)
+    MAINTENANCE_ENABLED - run daily inside the logs service (default: false)
+    MAINTENANCE_HOUR    - local hour of the daily run (default: 3)
+"""
+
+import argparse
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import date, datetime, timedelta
+from itertools import chain
+
+import pyarrow.parquet as pq
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from columnar_export import fetch_chunks, stream_export
+
+RETENTION_DAYS = int(os.getenv("LOG_RETENTION_DAYS", "90"))
+ARCHIVE_DIR = os.getenv("LOG_ARCHIVE_DIR", os.path.join(os.path.dirname(__file__), "archive"))
+MAINTENANCE_HOUR = int(os.getenv("MAINTENANCE_HOUR", "3"))
+
+# Summary table and the columns rows are grouped by, per raw table
+ROLLUPS = {
+    "logs": {"table": "logs_daily", "keys": ("user_type", "action", "type")},
+    "errorlogs": {"table": "errorlogs_daily", "keys": ("service",)},
+}
+
+
+def oldest_day(supabase, table):
+    """Day of the oldest raw row in ``table``, or None if it is empty."""
+    response = supabase.table(table).select("date_time").order("date_time").limit(1).execute()
+    if not response.data:
+        return None
+    return datetime.fromisoformat(response.data[0]["date_time"]).date()
+
+
+def archive_path(table, day, last_id):
+    return os.path.join(ARCHIVE_DIR, table, f"{table}_{day.isoformat()}_{last_id}.parquet")
+
+
+def archive_parts(table, day):
+    """Archive part files of one day, as (last id, path) pairs in id order."""
+    directory = os.path.join(ARCHIVE_DIR, table)
+    prefix, suffix = f"{table}_{day.isoformat()}_", ".parquet"
+    if not os.path.isdir(directory):
+        return []
+    return sorted((int(name[len(prefix):-len(suffix)]), os.path.join(directory, name))
+                  for name in os.listdir(directory) if name.startswith(prefix) and name.endswith(suffix))
+
+
+def day_range(query, day):
+    return query.gte("date_time", day.isoformat()).lt("date_time", (day + timedelta(days=1)).isoformat())
+
+
+def archive_and_count(supabase, table, day):
+    """
+    Write the day's raw rows still in the hot table to a new part file and count them for the rollup.
+
+    The file is written under a temporary name and renamed once complete, so a partial
+    file is never mistaken for an archive. Nothing is written if the day has no rows.
+
+    Returns:
+        tuple[int, collections.Counter, int | None]: Number of rows archived, counts per
+        rollup key and the part's last id (None if there were no rows).
+    """
+    keys = ROLLUPS[table]["keys"]
+    counts = Counter()
+    rows = 0
+    last_id = None
+
+    def counted(batches):
+        nonlocal rows, last_id
+        for batch in batches:
+            columns = [batch.column(key).to_pylist() for key in keys]
+            counts.update(zip(*columns))
+            rows += batch.num_rows
+            last_id = batch.column("id")[-1].as_py()
+            yield batch
+
+    batches = fetch_chunks(supabase, table, day.isoformat(), (day + timedelta(days=1)).isoformat())
+    first = next(batches, None)
+    if first is None:
+        return 0, counts, None
+
+    tmp_path = os.path.join(ARCHIVE_DIR, table, f"{table}_{day.isoformat()}.parquet.tmp")
+    os.makedirs(os.path.dirname(tmp_path), exist_ok=True)
+    with open(tmp_path, "wb") as f:
+        for data in stream_export(counted(chain([first], batches)), table, "parquet"):
+            f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, archive_path(table, day, last_id))
+    return rows, counts, last_id
+
+
+def count_part(table, path):
+    """Count an archived part for the rollup, as ``archive_and_count`` did when writing it."""
+    keys = ROLLUPS[table]["keys"]
+    columns = pq.read_table(path, columns=list(keys))
+    return Counter(zip(*(columns.column(key).to_pylist() for key in keys)))
+
+
+def roll_up_and_delete(supabase, table, day, last_id, counts):
+    """Upsert a part's summaries (idempotent per part), then delete its raw rows."""
+    rollup = ROLLUPS[table]
+    if counts:
+        supabase.table(rollup["table"]).upsert(
+            [dict(zip(rollup["keys"], key), day=day.isoformat(), part=str(last_id), count=count)
+             for key, count in counts.items()],
+            on_conflict=",".join(("day", "part") + rollup["keys"]),
+        ).execute()
+    # Rows that arrived after the part was written have higher ids and stay for the next part
+    day_range(supabase.table(table).delete(), day).lte("id", last_id).execute()
+
+
+def finish_interrupted_parts(supabase, table, day):
+    """Roll up and delete the parts of a day whose raw rows are still in the hot table."""
+    for last_id, path in archive_parts(table, day):
+        remaining = day_range(supabase.table(table).select("id"), day).lte("id", last_id).limit(1).execute()
+        if remaining.data:
+            roll_up_and_delete(supabase, table, day, last_id, count_part(table, path))
+            logging.info("%s %s: finished interrupted part %s", table, day, path)
+
+
+def maintain_day(supabase, table, day, dry_run=False):
+    """
+    Archive, roll up and delete one day of ``table``.
+
+    Returns:
+        int: Number of raw rows processed.
+    """
+    if dry_run:
+        response = day_range(supabase.table(table).select("id", count="exact"), day).limit(1).execute()
+        logging.info("[dry run] %s %s: would archive, roll up and delete %s rows", table, day, response.count)
+        return response.count or 0
+
+    finish_interrupted_parts(supabase, table, day)
+    rows, counts, last_id = archive_and_count(supabase, table, day)
+    if last_id is None:
+        return 0
+    # The part must hold every row the delete will remove (a row with a lower id may have
+    # been committed while the part was read); if not, it is dropped and redone next run
+    expected = day_range(supabase.table(table).select("id", count="exact"), day).lte("id", last_id).limit(1).execute()
+    if expected.count != rows:
+        os.remove(archive_path(table, day, last_id))
+        logging.warning("%s %s: part read %s rows but %s are in range; retrying at the next run",
+                        table, day, rows, expected.count)
+        return 0
+    roll_up_and_delete(supabase, table, day, last_id, counts)
+    logging.info("%s %s: archived %s rows to %s, rolled up into %s groups and deleted them",
+                 table, day, rows, archive_path(table, day, last_id), len(counts))
+    return rows
+
+
+def run_maintenance(supabase, retention_days=RETENTION_DAYS, dry_run=False):
+    """
+    Process every whole day older than the retention horizon, for logs and errorlogs.
+
+    Returns:
+        dict: Raw rows processed per table.
+    """
+    cutoff = date.today() - timedelta(days=retention_days)
+    processed = {}
+    for table in ROLLUPS:
+        processed[table] = 0
+        day = oldest_day(supabase, table)
+        while day is not None and day < cutoff:
+            processed[table] += maintain_day(supabase, table, day, dry_run)
+            day += timedelta(days=1)
+    return processed
+
+
+def start_scheduler(supabase):
+    """Run maintenance once a day at MAINTENANCE_HOUR (local time) in a daemon thread."""
+
+    def loop():
+        while True:
+            now = datetime.now()
+            next_run = now.replace(hour=MAINTENANCE_HOUR, minute=0, second=0, microsecond=0)
+            if next_run <= now:
+                next_run += timedelta(days=1)
+            time.sleep((next_run - now).total_seconds())
+            try:
+                logging.info("Log maintenance finished: %s", run_maintenance(supabase))
+            except Exception:
+                logging.exception("Log maintenance failed; will retry at the next scheduled run")
+
+    threading.Thread(target=loop, name="log-maintenance", daemon=True).start()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Archive, roll up and delete old logs and errorlogs")
+    parser.add_argument("--retention-days", type=int, default=RETENTION_DAYS)
+    parser.add_argument("--dry-run", action="store_true", help="only report what would be done")
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+    from supabase import create_client
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+    supabase = create_client(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_KEY"))
+    print(f"✅ Log maintenance finished: {run_maintenance(supabase, args.retention_days, args.dry_run)}")
+
+
+if __name__ == "__main__":
+    main()
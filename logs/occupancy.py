@@ -0,0 +1,266 @@
+"""
+Incremental occupancy and entry-rate counters built from access events.
+
+A background consumer reads the ``Occupancy`` queue (bound to ``*.access``) and keeps, in memory:
+    - entries per minute for the last hour and per hour for the last day
+    - unique guests that entered today
+    - staff entries and failed staff attempts today
+
+so the dashboard can answer "how many people are in the park right now" without scanning the
+logs table. Buckets use the event time (not the arrival time), in the service's local time zone.
+
+The counters are checkpointed to a single row of the ``occupancy_checkpoint`` table, and messages
+are only acknowledged after the checkpoint that includes them has been written. On restart the
+counters are restored from the checkpoint and unacknowledged events are redelivered; events of the
+last checkpointed batch are remembered by id so a redelivery after a crash is not counted twice.
+
+Checkpoint table:
+    create table occupancy_checkpoint (
+        id          int primary key,
+        state       jsonb not null,
+        updated_at  timestamptz not null default now()
+    );
+
+Environment:
+    OCCUPANCY_ENABLED              - "false" to disable the consumer (default: true)
+    OCCUPANCY_CHECKPOINT_EVERY     - events between checkpoints (default: 200)
+    OCCUPANCY_CHECKPOINT_INTERVAL  - maximum seconds between checkpoints (default: 5)
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from datetime import date, datetime
+
+import pika
+
+from amqp_topology import declare_topology, queues_named
+from events import decode
+
+AMQP_HOST = "rabbitmq"
+AMQP_PORT = 5672
+QUEUE = queues_named("Occupancy")[0]
+
+CHECKPOINT_TABLE = "occupancy_checkpoint"
+CHECKPOINT_ID = 1
+CHECKPOINT_EVERY = int(os.getenv("OCCUPANCY_CHECKPOINT_EVERY", "200"))
+CHECKPOINT_INTERVAL = float(os.getenv("OCCUPANCY_CHECKPOINT_INTERVAL", "5"))
+
+MINUTE_MS = 60 * 1000
+HOUR_MS = 60 * MINUTE_MS
+MINUTES_KEPT = 60
+HOURS_KEPT = 24
+
+
+class OccupancyCounters:
+    """In-memory counters, updated one access event at a time."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.day = date.today().isoformat()
+        self.per_minute = Counter()   # minute since epoch -> guest and staff entries
+        self.per_hour = Counter()     # hour since epoch -> guest and staff entries
+        self.guests_today = set()
+        self.guest_entries_today = 0
+        self.staff_entries_today = 0
+        self.failed_staff_attempts = Counter()  # staff_id -> failed attempts today
+        self.last_event_at = None
+        self.batch_ids = set()        # ids applied since the last checkpoint
+        self.replayed_ids = set()     # ids of the last checkpointed batch
+
+    def apply(self, event):
+        """
+        Count one decoded access event.
+
+        Returns:
+            bool: False if the event was already counted before the last checkpoint.
+        """
+        if event["id"] is not None and event["id"] in self.replayed_ids:
+            return False
+
+        data = event["data"]
+        ts = event["ts"] if event["ts"] is not None else int(time.time() * 1000)
+        event_day = datetime.fromtimestamp(ts / 1000).date().isoformat()
+
+        with self._lock:
+            if event_day > self.day:
+                self._roll_over(event_day)
+            if data.get("action") == "Entry":
+                if data.get("type") == "Success":
+                    self.per_minute[ts // MINUTE_MS] += 1
+                    self.per_hour[ts // HOUR_MS] += 1
+                    if event_day == self.day:
+                        if data.get("user_type") == "guest":
+                            self.guests_today.add(data.get("user_id"))
+                            self.guest_entries_today += 1
+                        else:
+                            self.staff_entries_today += 1
+                elif data.get("user_type") == "staff" and event_day == self.day:
+                    self.failed_staff_attempts[str(data.get("user_id"))] += 1
+            self._prune(ts)
+            self.last_event_at = max(self.last_event_at or 0, ts)
+            if event["id"] is not None:
+                self.batch_ids.add(event["id"])
+        return True
+
+    def _roll_over(self, day):
+        self.day = day
+        self.guests_today = set()
+        self.guest_entries_today = 0
+        self.staff_entries_today = 0
+        self.failed_staff_attempts = Counter()
+
+    def _prune(self, now_ms):
+        for bucket in [m for m in self.per_minute if m <= now_ms // MINUTE_MS - MINUTES_KEPT]:
+            del self.per_minute[bucket]
+        for bucket in [h for h in self.per_hour if h <= now_ms // HOUR_MS - HOURS_KEPT]:
+            del self.per_hour[bucket]
+
+    def snapshot(self):
+        """
+        Current counters for the occupancy endpoint.
+
+        Returns:
+            dict: Counters, with per-minute/per-hour series oldest first.
+        """
+        now_ms = int(time.time() * 1000)
+        with self._lock:
+            if date.today().isoformat() > self.day:
+                self._roll_over(date.today().isoformat())
+            minute, hour = now_ms // MINUTE_MS, now_ms // HOUR_MS
+            per_minute = [
+                {"minute": datetime.fromtimestamp(m * 60).isoformat(), "entries": self.per_minute.get(m, 0)}
+                for m in range(minute - MINUTES_KEPT + 1, minute + 1)
+            ]
+            per_hour = [
+                {"hour": datetime.fromtimestamp(h * 3600).isoformat(), "entries": self.per_hour.get(h, 0)}
+                for h in range(hour - HOURS_KEPT + 1, hour + 1)
+            ]
+            return {
+                "day": self.day,
+                "guests_today": len(self.guests_today),
+                "guest_entries_today": self.guest_entries_today,
+                "staff_entries_today": self.staff_entries_today,
+                "failed_staff_attempts_today": sum(self.failed_staff_attempts.values()),
+                "failed_staff_attempts_by_staff": dict(self.failed_staff_attempts),
+                "entries_last_minute": per_minute[-1]["entries"],
+                "entries_last_hour": sum(b["entries"] for b in per_minute),
+                "entries_per_minute": per_minute,
+                "entries_per_hour": per_hour,
+                "last_event_at": (datetime.fromtimestamp(self.last_event_at / 1000).isoformat()
+                                  if self.last_event_at else None),
+            }
+
+    def to_state(self):
+        """Serialise the counters for the checkpoint row."""
+        with self._lock:
+            return {
+                "day": self.day,
+                "per_minute": {str(k): v for k, v in self.per_minute.items()},
+                "per_hour": {str(k): v for k, v in self.per_hour.items()},
+                "guests_today": sorted(self.guests_today, key=str),
+                "guest_entries_today": self.guest_entries_today,
+                "staff_entries_today": self.staff_entries_today,
+                "failed_staff_attempts": dict(self.failed_staff_attempts),
+                "last_event_at": self.last_event_at,
+                "batch_ids": sorted(self.batch_ids),
+            }
+
+    @classmethod
+    def from_state(cls, state):
+        """Restore counters from a checkpoint row."""
+        counters = cls()
+        counters.day = state["day"]
+        counters.per_minute = Counter({int(k): v for k, v in state["per_minute"].items()})
+        counters.per_hour = Counter({int(k): v for k, v in state["per_hour"].items()})
+        counters.guests_today = set(state["guests_today"])
+        counters.guest_entries_today = state["guest_entries_today"]
+        counters.staff_entries_today = state["staff_entries_today"]
+        counters.failed_staff_attempts = Counter(state["failed_staff_attempts"])
+        counters.last_event_at = state["last_event_at"]
+        counters.replayed_ids = set(state.get("batch_ids", []))
+        if date.today().isoformat() > counters.day:
+            counters._roll_over(date.today().isoformat())
+        return counters
+
+
+class OccupancyAggregator:
+    """
+    Consumes access events into OccupancyCounters and checkpoints them to Supabase.
+
+    Args:
+        supabase (supabase.Client): Client used for the checkpoint table.
+    """
+
+    def __init__(self, supabase):
+        self.supabase = supabase
+        self.counters = OccupancyCounters()
+        self._thread = None
+
+    def load_checkpoint(self):
+        """Restore the counters from the checkpoint table, if a checkpoint exists."""
+        response = self.supabase.table(CHECKPOINT_TABLE).select("state").eq("id", CHECKPOINT_ID).execute()
+        if response.data:
+            self.counters = OccupancyCounters.from_state(response.data[0]["state"])
+            logging.info("Occupancy counters restored from checkpoint (%s)", self.counters.day)
+
+    def checkpoint(self):
+        """Write the counters to the checkpoint table."""
+        state = self.counters.to_state()
+        self.supabase.table(CHECKPOINT_TABLE).upsert({
+            "id": CHECKPOINT_ID,
+            "state": state,
+            "updated_at": datetime.now().astimezone().isoformat(),
+        }).execute()
+        self.counters.replayed_ids = set(state["batch_ids"])
+        self.counters.batch_ids = set()
+
+    def start(self):
+        """Start consuming in a daemon thread (no-op if already started)."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run_forever, name="occupancy", daemon=True)
+            self._thread.start()
+
+    def _run_forever(self):
+        while True:
+            try:
+                self.load_checkpoint()
+                self._consume()
+            except Exception:
+                logging.exception("Occupancy consumer failed; restarting in 10 seconds")
+                time.sleep(10)
+
+    def _consume(self):
+        connection = pika.BlockingConnection(
+            pika.ConnectionParameters(host=AMQP_HOST, port=AMQP_PORT, heartbeat=0,
+                                      blocked_connection_timeout=None)
+        )
+        try:
+            channel = connection.channel()
+            declare_topology(channel, [QUEUE])
+            channel.basic_qos(prefetch_count=CHECKPOINT_EVERY * 2)
+            logging.info("Occupancy consumer listening on %s", QUEUE["name"])
+
+            last_tag, pending, deadline = None, 0, None
+            for method, properties, body in channel.consume(QUEUE["name"], inactivity_timeout=1):
+                if method is not None:
+                    try:
+                        event = decode(body, properties.content_type, method.routing_key)
+                        if event["type"] == "access":
+                            self.counters.apply(event)
+                    except ValueError as e:
+                        logging.warning("Skipping undecodable access event: %s", e)
+                    last_tag, pending = method.delivery_tag, pending + 1
+                    deadline = deadline or time.monotonic() + CHECKPOINT_INTERVAL
+
+                if pending and (pending >= CHECKPOINT_EVERY or time.monotonic() >= deadline):
+                    self.checkpoint()
+                    channel.basic_ack(delivery_tag=last_tag, multiple=True)
+                    pending, deadline = 0, None
+        finally:
+            try:
+                connection.close()
+            except Exception:
+                pass
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+A standalone consumer that writes access events to the logs table in bulk
+
+This module reads the ``Access`` queue with a large prefetch and inserts access events into the
+Supabase ``logs`` table in batches. A batch is flushed when it reaches LOGSINK_BATCH_SIZE messages
+or when its oldest message has waited LOGSINK_FLUSH_INTERVAL seconds, and its messages are only
+acknowledged after the insert has committed. ``date_time`` is the time of the event, not of the
+insert, so a backlog drained after a gate burst is still logged in order.
+
+Delivery is at-least-once: if the sink dies between the insert and the ack, the batch is
+delivered again and inserted twice.
+
+Failures:
+    - The logs store is unreachable: the batch is kept (unacknowledged) and retried with backoff.
+    - The logs store rejects the batch: rows are inserted one by one and the rejected ones are
+      parked (dead-lettered to the Parking queue), so one bad event cannot block the queue.
+    - A message cannot be decoded: it is parked immediately.
+
+Environment:
+    LOGSINK_BATCH_SIZE      - maximum rows per insert (default: 500)
+    LOGSINK_FLUSH_INTERVAL  - maximum seconds a message waits before its batch is flushed (default: 1)
+    LOGSINK_PREFETCH        - unacknowledged messages held by the sink (default: 2 x batch size)
+"""
+
+import os
+import sys
+import time
+
+import pika
+from dotenv import load_dotenv
+from postgrest.exceptions import APIError
+from supabase import Client, create_client
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from amqp_topology import declare_topology, queues_named
+from events import decode, event_time, to_log_entry
+from tracing import init_tracing, start_span
+
+# -------------------------------
+# Environment
+# -------------------------------
+
+load_dotenv()
+init_tracing("logsink")
+
+SUPABASE_URL = os.getenv("SUPABASE_URL")
+SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+
+# -------------------------------
+# Configuration
+# -------------------------------
+
+AMQP_HOST = "rabbitmq"
+AMQP_PORT = 5672
+QUEUE = queues_named("Access")[0]
+
+BATCH_SIZE = int(os.getenv("LOGSINK_BATCH_SIZE", "500"))
+FLUSH_INTERVAL = float(os.getenv("LOGSINK_FLUSH_INTERVAL", "1"))
+PREFETCH_COUNT = int(os.getenv("LOGSINK_PREFETCH", str(BATCH_SIZE * 2)))
+MAX_BACKOFF = 30  # seconds
+
+# -------------------------------
+# RabbitMQ Setup
+# -------------------------------
+
+def connect_to_rabbitmq():
+    """
+    Attempt to connect to the RabbitMQ broker with retries.
+
+    Returns:
+        pika.BlockingConnection: An active connection to RabbitMQ.
+
+    Raises:
+        Exception: If unable to connect after multiple attempts.
+    """
+    for i in range(5):
+        try:
+            print(f"Attempt {i+1}: Connecting to RabbitMQ at {AMQP_HOST}:{AMQP_PORT}...")
+            connection = pika.BlockingConnection(
+                pika.ConnectionParameters(
+                    host=AMQP_HOST,
+                    port=AMQP_PORT,
+                    heartbeat=0,
+                    blocked_connection_timeout=None
+                )
+            )
+            print("✅ Connected to RabbitMQ")
+            return connection
+        except pika.exceptions.AMQPConnectionError:
+            print("⏳ RabbitMQ not ready. Retrying in 10 seconds...")
+            time.sleep(10)
+    raise Exception("❌ Failed to connect to RabbitMQ after multiple attempts")
+
+# -------------------------------
+# Batching
+# -------------------------------
+
+def is_rejection(error):
+    """
+    Whether the logs store refused the data itself, as opposed to being unavailable.
+
+    PostgreSQL data exceptions (class 22) and integrity violations (class 23) will fail
+    again on every retry; anything else (timeouts, 5xx, PostgREST errors) is transient.
+    """
+    return isinstance(error, APIError) and str(error.code or "")[:2] in ("22", "23")
+
+
+def to_row(method, properties, body):
+    """
+    Decode an access event into a row of the logs table.
+
+    Returns:
+        dict | None: The row, or None if the message is not a valid access event.
+    """
+    try:
+        event = decode(body, properties.content_type, method.routing_key)
+        if event["type"] != "access":
+            raise ValueError(f"Unexpected event type {event['type']}")
+        return dict(to_log_entry(event), date_time=event_time(event))
+    except (ValueError, KeyError) as e:
+        print(f"⚠️ Undecodable access event ({e}): {body!r}")
+        return None
+
+
+def insert_one_by_one(channel, pending):
+    """
+    Insert rows individually after the store rejected a whole batch.
+
+    Rejected rows are parked; accepted rows are acknowledged as they commit.
+
+    Returns:
+        list: The (delivery_tag, row) pairs still pending because the store became unreachable.
+    """
+    for index, (delivery_tag, row) in enumerate(pending):
+        try:
+            supabase.table("logs").insert(row).execute()
+            channel.basic_ack(delivery_tag=delivery_tag)
+        except Exception as e:
+            if not is_rejection(e):
+                return pending[index:]
+            print(f"🪦 Parking access event rejected by the logs store ({e.message}): {row}")
+            channel.basic_nack(delivery_tag=delivery_tag, requeue=False)
+    return []
+
+
+def flush(connection, channel, pending):
+    """
+    Insert a batch and acknowledge it once committed, retrying while the store is unreachable.
+
+    Args:
+        connection (pika.BlockingConnection): Used to sleep without starving the connection.
+        channel (pika.adapters.blocking_connection.BlockingChannel): The consuming channel.
+        pending (list): (delivery_tag, row) pairs in delivery order.
+    """
+    backoff = 1
+    with start_span("logsink flush", attributes={"logsink.batch_size": len(pending)}):
+        while pending:
+            try:
+                supabase.table("logs").insert([row for _, row in pending]).execute()
+                channel.basic_ack(delivery_tag=pending[-1][0], multiple=True)
+                print(f"✅ {len(pending)} access logs saved.")
+                return
+            except Exception as e:
+                if is_rejection(e):
+                    print(f"⚠️ Logs store rejected a batch of {len(pending)} ({e.message}); inserting one by one")
+                    pending = insert_one_by_one(channel, pending)
+                    if not pending:
+                        return
+                print(f"⏳ Logs store unavailable ({e!r}); retrying {len(pending)} rows in {backoff}s")
+            connection.sleep(backoff)
+            backoff = min(backoff * 2, MAX_BACKOFF)
+
+
+def run(connection, channel):
+    """
+    Consume the Access queue and flush batches by size or age.
+
+    Returns:
+        None
+
+    Side Effects:
+        Runs until the connection is closed or the process is interrupted.
+    """
+    pending = []
+    deadline = None
+    for method, properties, body in channel.consume(QUEUE["name"], inactivity_timeout=FLUSH_INTERVAL):
+        if method is not None:
+            row = to_row(method, properties, body)
+            if row is None:
+                channel.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+            else:
+                pending.append((method.delivery_tag, row))
+                deadline = deadline or time.monotonic() + FLUSH_INTERVAL
+
+        if pending and (len(pending) >= BATCH_SIZE or time.monotonic() >= deadline):
+            flush(connection, channel, pending)
+            pending = []
+            deadline = None
+
+# -------------------------------
+# Entrypoint
+# -------------------------------
+
+if __name__ == "__main__":
+    """
+    Entry point of the script.
+
+    Declares the Access queue, then consumes it until interrupted.
+    """
+    connection = None
+    try:
+        connection = connect_to_rabbitmq()
+        channel = connection.channel()
+        declare_topology(channel, [QUEUE])
+        channel.basic_qos(prefetch_count=PREFETCH_COUNT)
+        print(f"🚀 Sinking {QUEUE['name']} into logs (batches of {BATCH_SIZE}, every {FLUSH_INTERVAL}s)")
+        run(connection, channel)
+    except KeyboardInterrupt:
+        print("🛑 Log sink interrupted. Shutting down.")
+    except Exception as e:
+        print(f"❌ Log sink error: {e}")
+        raise
+    finally:
+        try:
+            connection.close()
+            print("🔌 Connection closed.")
+        except Exception:
+            pass
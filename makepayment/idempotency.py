@@ -0,0 +1,223 @@
+"""
+Idempotency-Key support for the makepayment routes.
+
+A retried request carrying the same ``Idempotency-Key`` header as an earlier one gets the
+stored outcome of the first request instead of charging Stripe and allocating an OTP again.
+Outcomes live in a small SQLite database, so every makepayment worker sharing the file
+(e.g. through a volume) sees the same keys. While the first request is still running,
+duplicates wait for its result instead of starting a second purchase.
+
+Only successful (2xx) outcomes are stored. A failed attempt releases its key so the client
+can retry; the key is also forwarded to Stripe, so a retry never charges the card twice.
+
+Environment:
+    IDEMPOTENCY_DB            - path of the SQLite database (default: makepayment/idempotency.db)
+    IDEMPOTENCY_TTL           - seconds a stored outcome is replayed for (default: 86400)
+    IDEMPOTENCY_WAIT_TIMEOUT  - seconds a duplicate waits for the in-flight request (default: 30)
+    IDEMPOTENCY_LEASE         - seconds after which an unfinished claim is considered abandoned (default: 120)
+"""
+
+import functools
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+from flask import Response, jsonify, make_response, request
+
+IDEMPOTENCY_DB = os.getenv("IDEMPOTENCY_DB", os.path.join(os.path.dirname(__file__), "idempotency.db"))
+IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", "86400"))
+IDEMPOTENCY_WAIT_TIMEOUT = float(os.getenv("IDEMPOTENCY_WAIT_TIMEOUT", "30"))
+IDEMPOTENCY_LEASE = float(os.getenv("IDEMPOTENCY_LEASE", "120"))
+
+HEADER = "Idempotency-Key"
+POLL_INTERVAL = 0.05
+
+SWAGGER_PARAMETER = {
+    "name": HEADER,
+    "in": "header",
+    "type": "string",
+    "required": False,
+    "description": "Client-generated key; retries with the same key replay the first outcome instead of paying again",
+}
+
+
+class IdempotencyStore:
+    """SQLite-backed record of in-flight and completed idempotent requests."""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._waiters = {}
+        self._waiters_lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn().execute(
+            """
+            CREATE TABLE IF NOT EXISTS idempotency (
+                key          TEXT PRIMARY KEY,
+                fingerprint  TEXT NOT NULL,
+                state        TEXT NOT NULL,
+                status_code  INTEGER,
+                body         BLOB,
+                updated_at   REAL NOT NULL
+            )
+            """
+        )
+
+    def _conn(self):
+        """Return this thread's connection (sqlite3 connections are not shared across threads)."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _event(self, key):
+        with self._waiters_lock:
+            return self._waiters.setdefault(key, threading.Event())
+
+    def _notify(self, key):
+        with self._waiters_lock:
+            event = self._waiters.pop(key, None)
+        if event is not None:
+            event.set()
+
+    def claim(self, key, fingerprint):
+        """
+        Try to become the request that executes ``key``.
+
+        Returns:
+            tuple: (state, row) where state is one of
+                "owner"     - the caller must execute the request and then complete() or release()
+                "done"      - row holds (status_code, body) of the stored outcome
+                "in_flight" - another request with this key is running
+                "mismatch"  - the key was already used with a different request body
+        """
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT fingerprint, state, status_code, body, updated_at FROM idempotency WHERE key = ?",
+                (key,),
+            ).fetchone()
+
+            expired = row is not None and (
+                (row[1] == "done" and row[4] < now - IDEMPOTENCY_TTL)
+                or (row[1] == "in_flight" and row[4] < now - IDEMPOTENCY_LEASE)
+            )
+            if row is None or expired:
+                conn.execute(
+                    "INSERT OR REPLACE INTO idempotency (key, fingerprint, state, updated_at) "
+                    "VALUES (?, ?, 'in_flight', ?)",
+                    (key, fingerprint, now),
+                )
+                conn.execute("DELETE FROM idempotency WHERE state = 'done' AND updated_at < ?",
+                             (now - IDEMPOTENCY_TTL,))
+                conn.execute("COMMIT")
+                return "owner", None
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        if row[0] != fingerprint:
+            return "mismatch", None
+        if row[1] == "done":
+            return "done", (row[2], row[3])
+        return "in_flight", None
+
+    def complete(self, key, status_code, body):
+        """Store the outcome of the owning request and wake any waiting duplicates."""
+        self._conn().execute(
+            "UPDATE idempotency SET state = 'done', status_code = ?, body = ?, updated_at = ? WHERE key = ?",
+            (status_code, body, time.time(), key),
+        )
+        self._notify(key)
+
+    def release(self, key):
+        """Forget an unsuccessful attempt so the key can be retried."""
+        self._conn().execute("DELETE FROM idempotency WHERE key = ? AND state = 'in_flight'", (key,))
+        self._notify(key)
+
+    def wait(self, key, fingerprint, timeout):
+        """
+        Wait for an in-flight request to finish, then claim or replay it.
+
+        Duplicates in this process are woken directly; duplicates in other processes
+        fall back to polling the database.
+        """
+        deadline = time.monotonic() + timeout
+        try:
+            while time.monotonic() < deadline:
+                self._event(key).wait(POLL_INTERVAL)
+                state, row = self.claim(key, fingerprint)
+                if state != "in_flight":
+                    return state, row
+            return "in_flight", None
+        finally:
+            with self._waiters_lock:
+                self._waiters.pop(key, None)
+
+
+store = IdempotencyStore(IDEMPOTENCY_DB)
+
+
+def current_key(scope):
+    """
+    Return the request's Idempotency-Key, namespaced for a downstream call.
+
+    Args:
+        scope (str): Name of the downstream operation (e.g. "charge").
+
+    Returns:
+        str | None: A key to forward downstream, or None if the request carried no key.
+    """
+    key = request.headers.get(HEADER)
+    return f"{request.path}:{key}:{scope}" if key else None
+
+
+def idempotent(view):
+    """Make a Flask view replay its first successful outcome for a repeated Idempotency-Key."""
+
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        client_key = request.headers.get(HEADER)
+        if not client_key:
+            return view(*args, **kwargs)
+
+        key = f"{request.path}:{client_key}"
+        fingerprint = hashlib.sha256(request.get_data()).hexdigest()
+
+        state, row = store.claim(key, fingerprint)
+        if state == "in_flight":
+            state, row = store.wait(key, fingerprint, IDEMPOTENCY_WAIT_TIMEOUT)
+
+        if state == "mismatch":
+            return jsonify({"error": f"{HEADER} was already used with a different request"}), 422
+        if state == "in_flight":
+            return jsonify({"error": f"A request with this {HEADER} is still in progress"}), 409
+        if state == "done":
+            status_code, body = row
+            response = Response(body, status=status_code, mimetype="application/json")
+            response.headers["Idempotent-Replayed"] = "true"
+            return response
+
+        try:
+            response = make_response(view(*args, **kwargs))
+        except Exception:
+            store.release(key)
+            raise
+
+        if 200 <= response.status_code < 300:
+            store.complete(key, response.status_code, response.get_data())
+        else:
+            store.release(key)
+        return response
+
+    return wrapper
@@ -1,8 +1,8 @@
-import json
+import contextvars
 import os
 import sys
-import pika
 import requests
+from concurrent.futures import ThreadPoolExecutor
 from flask import Blueprint, request, jsonify, Flask
 from flask_cors import CORS
 from flasgger import Swagger, swag_from
@@ -10,7 +10,12 @@ from dotenv import load_dotenv
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 from RabbitMQClient import RabbitMQClient
+from events import make_event
 from invokes import invoke_http
+from fast_responses import enable_fast_responses
+from tracing import instrument_app
+from idempotency import SWAGGER_PARAMETER as IDEMPOTENCY_KEY_PARAMETER, current_key, idempotent
+from outbox import OUTBOX_DB, Outbox
 
 # Load env
 load_dotenv()
@@ -19,6 +24,8 @@ load_dotenv()
 app = Flask(__name__)
 CORS(app)
 Swagger(app)
+instrument_app(app, "makepayment")
+enable_fast_responses(app)
 
 payment_blueprint = Blueprint("makepayment", __name__)
 
@@ -33,6 +40,15 @@ rabbit_client = RabbitMQClient(
     exchange_type=exchange_type,
 )
 
+# Purchase events go through the outbox; its relay has its own connection (see outbox.py)
+outbox = Outbox(OUTBOX_DB)
+outbox.start_relay(lambda: RabbitMQClient(
+    hostname="rabbitmq",
+    port=5672,
+    exchange_name=exchange_name,
+    exchange_type=exchange_type,
+))
+
 # Service URLs from env
 staff_URL = os.getenv("STAFF_URL")
 guest_URL = os.getenv("GUEST_URL")
@@ -40,15 +56,43 @@ error_URL = os.getenv("ERROR_URL")
 stripe_URL = os.getenv("STRIPE_URL")
 otp_URL = os.getenv("OTP_URL")
 
+OTP_MAX_ATTEMPTS = 10
+
+# Shared pool for downstream calls that run concurrently within one purchase
+executor = ThreadPoolExecutor(max_workers=int(os.getenv("MAKEPAYMENT_WORKERS", "32")))
+
+
+class DownstreamError(Exception):
+    """A downstream service call failed; the client may retry with the same Idempotency-Key."""
+
+
+def checked(result, what):
+    """Return a downstream result, or raise DownstreamError if invoke_http reported a failure."""
+    if isinstance(result, dict) and result.get("code", 200) != 200:
+        raise DownstreamError(f"{what} failed (HTTP {result['code']}): {result.get('error') or result.get('message')}")
+    return result
+
+
+def retry_later(endpoint, error):
+    """
+    Response for a purchase that failed after the payment may have been taken. The
+    Idempotency-Key is released on a 5xx, and the charge reuses it, so retrying with the
+    same key completes the purchase without charging again.
+    """
+    log_error("payment_service", endpoint, error)
+    return jsonify({"error": "Purchase could not be completed. Retry with the same Idempotency-Key."}), 503
+
+
+def purchase_failed(endpoint, result):
+    """Response for a failed guest purchase call: its own 4xx (e.g. not enough funds), or a retry for a 5xx."""
+    if result["code"] < 500:
+        return jsonify({"error": result.get("error") or "Payment processing failed."}), result["code"]
+    return retry_later(endpoint, result.get("error") or result.get("message"))
+
 
 def log_error(service, endpoint, error):
     message = {"service": service, "endpoint": endpoint, "error": str(error)}
-    rabbit_client.channel.basic_publish(
-        exchange=exchange_name,
-        routing_key=f"{service}.error",
-        body=json.dumps(message),
-        properties=pika.BasicProperties(delivery_mode=2),
-    )
+    rabbit_client.publish(f"{service}.error", make_event("error", message, "makepayment"))
 
 
 def validate_otp(otp):
@@ -59,6 +103,58 @@ def validate_otp(otp):
         return False
 
 
+def submit(fn, *args, **kwargs):
+    """Run ``fn`` on the shared pool, keeping the caller's trace context."""
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+def allocate_otp():
+    """Draw OTPs from the OTP service until one is not already assigned to a guest."""
+    for _ in range(OTP_MAX_ATTEMPTS):
+        otp = checked(invoke_http(f"{otp_URL}", method="GET"), "OTP service")
+        if validate_otp(otp):
+            return otp
+    raise DownstreamError(f"No unique OTP after {OTP_MAX_ATTEMPTS} attempts")
+
+
+def publish_purchase_events(guest, action, notify=True):
+    """
+    Record the access log for a purchase and, for ticket purchases, the OTP notification in
+    the outbox, from which they are published to RabbitMQ in the background.
+
+    Args:
+        guest (dict): guest_id, guest_name and otp as returned by the guest purchase endpoints.
+        action (str): What the guest did, appended to the rendered log message.
+        notify (bool): Whether to also send the OTP notification.
+    """
+    events = [("enterpark.access", make_event("access", {
+        "user_id": guest["guest_id"],
+        "user_type": "guest",
+        "action": "Payment",
+        "type": "Success",
+        "name": guest["guest_name"],
+        "detail": action,
+    }, "makepayment"))]
+    if notify:
+        events.append(("payment.notification",
+                       make_event("payment.notification", {"guest_id": guest["guest_id"], "otp": guest.get("otp"),
+                                                             "guest_name": guest.get("guest_name")},
+                                  "makepayment")))
+    outbox.record(events)
+
+
+def stripe_headers():
+    """Forward the client's Idempotency-Key so a retried purchase is never charged twice."""
+    key = current_key("charge")
+    return {"Idempotency-Key": key} if key else {}
+
+
+def guest_headers():
+    """Forward the client's Idempotency-Key so a retried purchase never moves wallet or points twice."""
+    key = current_key("ledger")
+    return {"Idempotency-Key": key} if key else {}
+
+
 # -----------------------------
 # Buy Ticket (Stripe)
 # -----------------------------
@@ -68,6 +164,7 @@ def validate_otp(otp):
         "tags": ["Payment"],
         "summary": "Buy ticket using Stripe",
         "parameters": [
+            IDEMPOTENCY_KEY_PARAMETER,
             {
                 "name": "body",
                 "in": "body",
@@ -93,54 +190,40 @@ def validate_otp(otp):
         "responses": {
             200: {"description": "Ticket purchased successfully"},
             400: {"description": "Payment processing failed"},
-            503: {"description": "Guest service unavailable"},
+            503: {"description": "Purchase not completed; retry with the same Idempotency-Key"},
         },
     }
 )
+@idempotent
 def buyticket():
     try:
         data = request.get_json()
         charge = data["charge"]
-        # otp = data["otp"]
         guest_id = data["guest_id"]
-        response = invoke_http(f"{stripe_URL}/charges", method="POST", json=charge)
-        if response.get("code", 200) == 200:
-            otp = None
-            while True:
-                otp = invoke_http(f"{otp_URL}", method="GET")
-                if validate_otp(otp):
-                    break
-
-            invoke_http(
+
+        # Allocate the OTP while the Stripe charge is in flight
+        charge_future = submit(invoke_http, f"{stripe_URL}/charges", method="POST", json=charge,
+                               headers=stripe_headers())
+        otp_future = submit(allocate_otp)
+
+        response = charge_future.result()
+        if response.get("code", 200) != 200:
+            otp_future.cancel()
+            return jsonify({"error": "Stripe payment failed"}), 400
+
+        # The card is charged: from here on a failure must be retried, not reported as declined
+        try:
+            otp = otp_future.result()
+            purchase = checked(invoke_http(
                 f"{guest_URL}/buyticket/{guest_id}",
                 method="PUT",
                 json={"otp": otp, "amount": charge["amount"]},
-            )
-            # Get Guest Info
-            guest_data = invoke_http(f"{guest_URL}/{guest_id}")
-            data = {
-                "user_id": guest_data["guest"]["guest_id"],
-                "user_type": "guest",
-                "action": "Payment",
-                 "type": "Success",
-                "message": f"Guest {guest_data['guest']['guest_name']} purchased a ticket via Credit/Debit Card!"
-                }
-            rabbit_client.channel.basic_publish(
-                exchange=exchange_name,
-                routing_key="enterpark.access",
-                body=json.dumps(data),
-                properties=pika.BasicProperties(delivery_mode=2),
-                )
-
-            rabbit_client.channel.basic_publish(
-                exchange=exchange_name,
-                routing_key="payment.notification",
-                body=json.dumps({"guest_id": guest_id}),
-                properties=pika.BasicProperties(delivery_mode=2),
-            )
-            return jsonify({"message": "Payment successful! Ticket purchased."}), 200
-
-        return jsonify({"error": "Stripe payment failed"}), 400
+                headers=guest_headers(),
+            ), "Guest ticket purchase")
+        except DownstreamError as e:
+            return retry_later("/buyticket", e)
+        publish_purchase_events(purchase["guest"], "purchased a ticket via Credit/Debit Card!")
+        return jsonify({"message": "Payment successful! Ticket purchased."}), 200
 
     except Exception as e:
         log_error("payment_service", "/buyticket", e)
@@ -156,6 +239,7 @@ def buyticket():
         "tags": ["Payment"],
         "summary": "Buy ticket using loyalty points",
         "parameters": [
+            IDEMPOTENCY_KEY_PARAMETER,
             {
                 "name": "body",
                 "in": "body",
@@ -181,10 +265,11 @@ def buyticket():
         "responses": {
             200: {"description": "Ticket purchased successfully"},
             400: {"description": "Payment processing failed"},
-            503: {"description": "Guest service unavailable"},
+            503: {"description": "Purchase not completed; retry with the same Idempotency-Key"},
         },
     }
 )
+@idempotent
 def buyticketbyloyalty():
     try:
         data = request.get_json()
@@ -195,43 +280,23 @@ def buyticketbyloyalty():
 
         # response = invoke_http(f"{stripe_URL}/charges", method="POST", json=charge)
         # if response.get("code", 200) == 200:
-        otp = None
-        while True:
-            otp = invoke_http(f"{otp_URL}", method="GET")
-            if validate_otp(otp):
-                break
+        otp = allocate_otp()
 
-        invoke_http(
+        purchase = invoke_http(
             f"{guest_URL}/buyticketbyloyalty/{guest_id}",
             method="PUT",
             json={"otp": otp, "points": points},
+            headers=guest_headers(),
         )
-        # Get Guest Info
-        guest_data = invoke_http(f"{guest_URL}/{guest_id}")
-        data = {
-                "user_id": guest_data["guest"]["guest_id"],
-                "user_type": "guest",
-                "action": "Payment",
-                 "type": "Success",
-                "message": f"Guest {guest_data['guest']['guest_name']} purchased a ticket via Loyalty Points!"
-                }
-        rabbit_client.channel.basic_publish(
-                exchange=exchange_name,
-                routing_key="enterpark.access",
-                body=json.dumps(data),
-                properties=pika.BasicProperties(delivery_mode=2),
-                )
-
-        rabbit_client.channel.basic_publish(
-            exchange=exchange_name,
-            routing_key="payment.notification",
-            body=json.dumps({"guest_id": guest_id}),
-            properties=pika.BasicProperties(delivery_mode=2),
-        )
+        if purchase.get("code", 200) != 200:
+            return purchase_failed("/buyticketbyloyalty", purchase)
+        publish_purchase_events(purchase["guest"], "purchased a ticket via Loyalty Points!")
         return jsonify({"message": "Payment successful! Ticket purchased."}), 200
 
         # return jsonify({"error": "Stripe payment failed"}), 400
 
+    except DownstreamError as e:
+        return retry_later("/buyticketbyloyalty", e)
     except Exception as e:
         log_error("payment_service", "/buyticketbyloyalty", e)
         return jsonify({"error": "Payment processing failed."}), 400
@@ -246,6 +311,7 @@ def buyticketbyloyalty():
         "tags": ["Payment"],
         "summary": "Buy ticket using wallet balance",
         "parameters": [
+            IDEMPOTENCY_KEY_PARAMETER,
             {
                 "name": "body",
                 "in": "body",
@@ -271,14 +337,14 @@ def buyticketbyloyalty():
         "responses": {
             200: {"description": "Ticket purchased successfully"},
             400: {"description": "Payment processing failed"},
-            503: {"description": "Guest service unavailable"},
+            503: {"description": "Purchase not completed; retry with the same Idempotency-Key"},
         },
     }
 )
+@idempotent
 def buyticketbywallet():
     try:
         data = request.get_json()
-        charge = data["charge"]
 
         # otp = data["otp"]
         amount = data["charge"]["amount"]
@@ -286,43 +352,23 @@ def buyticketbywallet():
 
         # response = invoke_http(f"{stripe_URL}/charges", method="POST", json=charge)
         # if response.get("code", 200) == 200:
-        otp = None
-        while True:
-            otp = invoke_http(f"{otp_URL}", method="GET")
-            if validate_otp(otp):
-                break
+        otp = allocate_otp()
 
-        invoke_http(
+        purchase = invoke_http(
             f"{guest_URL}/buyticketfromwallet/{guest_id}",
             method="PUT",
             json={"otp": otp, "amount": amount},
+            headers=guest_headers(),
         )
-        # Get Guest Info
-        guest_data = invoke_http(f"{guest_URL}/{guest_id}")
-        data = {
-                "user_id": guest_data["guest"]["guest_id"],
-                "user_type": "guest",
-                "action": "Payment",
-                 "type": "Success",
-                "message": f"Guest {guest_data['guest']['guest_name']} purchased a ticket via Wallet!"
-                }
-        rabbit_client.channel.basic_publish(
-                exchange=exchange_name,
-                routing_key="enterpark.access",
-                body=json.dumps(data),
-                properties=pika.BasicProperties(delivery_mode=2),
-                )
-
-        rabbit_client.channel.basic_publish(
-            exchange=exchange_name,
-            routing_key="payment.notification",
-            body=json.dumps({"guest_id": guest_id}),
-            properties=pika.BasicProperties(delivery_mode=2),
-        )
+        if purchase.get("code", 200) != 200:
+            return purchase_failed("/buyticketbywallet", purchase)
+        publish_purchase_events(purchase["guest"], "purchased a ticket via Wallet!")
         return jsonify({"message": "Payment successful! Ticket purchased."}), 200
 
         # return jsonify({"error": "Stripe payment failed"}), 400
 
+    except DownstreamError as e:
+        return retry_later("/buyticketbywallet", e)
     except Exception as e:
         log_error("payment_service", "/buyticketbywallet", e)
         return jsonify({"error": "Payment processing failed."}), 400
@@ -337,6 +383,7 @@ def buyticketbywallet():
         "tags": ["Payment"],
         "summary": "Top up wallet via Stripe",
         "parameters": [
+            IDEMPOTENCY_KEY_PARAMETER,
             {
                 "name": "body",
                 "in": "body",
@@ -362,10 +409,11 @@ def buyticketbywallet():
         "responses": {
             200: {"description": "Top-up successful"},
             400: {"description": "Payment processing failed"},
-            503: {"description": "Guest service unavailable"},
+            503: {"description": "Purchase not completed; retry with the same Idempotency-Key"},
         },
     }
 )
+@idempotent
 def topupwallet():
     try:
         data = request.get_json()
@@ -373,31 +421,23 @@ def topupwallet():
         guest_id = data["guest_id"]
         amount = charge["amount"]
 
-        response = invoke_http(f"{stripe_URL}/charges", method="POST", json=charge)
-        if response.get("code", 200) == 200:
-            invoke_http(
+        response = invoke_http(f"{stripe_URL}/charges", method="POST", json=charge,
+                               headers=stripe_headers())
+        if response.get("code", 200) != 200:
+            return jsonify({"error": "Stripe payment failed"}), 400
+
+        # The card is charged: from here on a failure must be retried, not reported as declined
+        try:
+            topup = checked(invoke_http(
                 f"{guest_URL}/updatewallet/{guest_id}",
                 method="PUT",
                 json={"wallet": amount},
-            )
-            # Get Guest Info
-            guest_data = invoke_http(f"{guest_URL}/{guest_id}")
-            data = {
-                    "user_id": guest_data["guest"]["guest_id"],
-                    "user_type": "guest",
-                    "action": "Payment",
-                    "type": "Success",
-                    "message": f"Guest {guest_data['guest']['guest_name']} top up {amount} to their wallet!"
-                    }
-            rabbit_client.channel.basic_publish(
-                    exchange=exchange_name,
-                    routing_key="enterpark.access",
-                    body=json.dumps(data),
-                    properties=pika.BasicProperties(delivery_mode=2),
-                    )
-            return jsonify({"message": "Payment successful! Wallet Top-up."}), 200
-
-        return jsonify({"error": "Stripe payment failed"}), 400
+                headers=guest_headers(),
+            ), "Guest wallet top-up")
+        except DownstreamError as e:
+            return retry_later("/topupwallet", e)
+        publish_purchase_events(topup["guest"], f"top up {amount} to their wallet!", notify=False)
+        return jsonify({"message": "Payment successful! Wallet Top-up."}), 200
 
     except Exception as e:
         log_error("payment_service", "/topupwallet", e)
@@ -0,0 +1,181 @@
+"""
+Transactional outbox for the events makepayment publishes.
+
+Purchase routes no longer publish to RabbitMQ themselves. ``record()`` writes the events of a
+purchase to a SQLite outbox in one transaction and returns, so a stalled broker never stalls
+the request. A relay thread drains the outbox to park_topic in batches on a transactional
+channel: it publishes a whole batch, commits it with one ``tx_commit`` (a single broker round
+trip per batch, not per event), and deletes the batch's events only after the commit. An
+event recorded before a crash or a broker outage is therefore published once the relay gets
+through: delivery is at least once, and consumers can de-duplicate on the envelope ``id``.
+
+Several makepayment workers may share the database file (e.g. through a volume). The relay
+leases the rows it is publishing, so two relays never publish the same batch concurrently.
+The trace-context of the recording request is stored with each event, and the relay
+publishes it as a child of that trace.
+
+Environment:
+    OUTBOX_DB             - path of the SQLite database (default: makepayment/outbox.db)
+    OUTBOX_BATCH_SIZE     - events published per batch (default: 100)
+    OUTBOX_POLL_INTERVAL  - seconds between checks for events recorded by other workers (default: 1)
+    OUTBOX_LEASE          - seconds a relay may hold a batch before another may take it over (default: 60)
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from opentelemetry.trace import SpanKind
+
+from tracing import inject_headers, start_span
+
+OUTBOX_DB = os.getenv("OUTBOX_DB", os.path.join(os.path.dirname(__file__), "outbox.db"))
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "100"))
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "1"))
+OUTBOX_LEASE = float(os.getenv("OUTBOX_LEASE", "60"))
+
+RETRY_INTERVAL = 5
+
+
+class Outbox:
+    """SQLite-backed queue of events waiting to be published."""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._wakeup = threading.Event()
+        self._thread = None
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn().execute(
+            """
+            CREATE TABLE IF NOT EXISTS outbox (
+                id             INTEGER PRIMARY KEY AUTOINCREMENT,
+                routing_key    TEXT NOT NULL,
+                event          TEXT NOT NULL,
+                headers        TEXT NOT NULL,
+                delivery_mode  INTEGER NOT NULL,
+                leased_until   REAL NOT NULL DEFAULT 0,
+                created_at     REAL NOT NULL
+            )
+            """
+        )
+
+    def _conn(self):
+        """Return this thread's connection (sqlite3 connections are not shared across threads)."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=FULL")
+            self._local.conn = conn
+        return conn
+
+    def record(self, messages, delivery_mode=2):
+        """
+        Durably queue events for publishing, all or none.
+
+        Args:
+            messages (list[tuple[str, dict]]): (routing_key, event envelope) pairs, published in order.
+            delivery_mode (int): 2 for persistent messages, 1 for transient.
+        """
+        headers = json.dumps(inject_headers())
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "INSERT INTO outbox (routing_key, event, headers, delivery_mode, created_at) VALUES (?, ?, ?, ?, ?)",
+                [(routing_key, json.dumps(event), headers, delivery_mode, now) for routing_key, event in messages],
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self._wakeup.set()
+
+    def lease(self, limit=OUTBOX_BATCH_SIZE):
+        """
+        Take the oldest unleased events for publishing.
+
+        Returns:
+            list[tuple]: (id, routing_key, event, headers, delivery_mode) rows, oldest first.
+        """
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute(
+                "SELECT id, routing_key, event, headers, delivery_mode FROM outbox "
+                "WHERE leased_until < ? ORDER BY id LIMIT ?",
+                (now, limit),
+            ).fetchall()
+            conn.executemany("UPDATE outbox SET leased_until = ? WHERE id = ?",
+                             [(now + OUTBOX_LEASE, row[0]) for row in rows])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return [(id_, routing_key, json.loads(event), json.loads(headers), delivery_mode)
+                for id_, routing_key, event, headers, delivery_mode in rows]
+
+    def delete(self, ids):
+        """Remove events the broker has committed."""
+        self._conn().executemany("DELETE FROM outbox WHERE id = ?", [(id_,) for id_ in ids])
+
+    def release(self, ids):
+        """Give leased events back after a failed publish, so the next batch retries them."""
+        self._conn().executemany("UPDATE outbox SET leased_until = 0 WHERE id = ?", [(id_,) for id_ in ids])
+
+    def backlog(self):
+        """Number of events not yet published."""
+        return self._conn().execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+    def start_relay(self, connect):
+        """
+        Drain the outbox in a daemon thread.
+
+        Args:
+            connect (Callable[[], RabbitMQClient]): Opens a new client for the relay's own connection.
+        """
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._relay, args=(connect,), name="outbox-relay", daemon=True)
+            self._thread.start()
+
+    def _relay(self, connect):
+        client = None
+        while True:
+            self._wakeup.wait(OUTBOX_POLL_INTERVAL)
+            self._wakeup.clear()
+            try:
+                while True:
+                    batch = self.lease()
+                    if not batch:
+                        break
+                    if client is None:
+                        client = connect()
+                        client.channel.tx_select()
+                    self._publish(client, batch)
+            except Exception as e:
+                print(f"❌ Outbox relay failed: {e}. Retrying in {RETRY_INTERVAL} seconds...")
+                if client is not None:
+                    client.close()
+                client = None
+                time.sleep(RETRY_INTERVAL)
+
+    def _publish(self, client, batch):
+        ids = [row[0] for row in batch]
+        try:
+            for id_, routing_key, event, headers, delivery_mode in batch:
+                with start_span(f"outbox relay {routing_key}", kind=SpanKind.PRODUCER, parent_headers=headers):
+                    client.publish(routing_key, event, delivery_mode=delivery_mode)
+            # The broker takes the whole batch or none of it; one round trip for all its events
+            with start_span(f"outbox commit ({len(batch)})", kind=SpanKind.PRODUCER):
+                client.channel.tx_commit()
+        except Exception:
+            self.release(ids)
+            raise
+        self.delete(ids)
@@ -2,23 +2,30 @@
 """
 A standalone script to create exchanges and queues on RabbitMQ.
 
-This script connects to a RabbitMQ broker, declares an exchange, and creates queues
-with specified routing keys, binding them to the declared exchange.
+This script connects to a RabbitMQ broker and declares the topology described in
+``amqp_topology.py``: the park_topic exchange, its queues with their routing keys,
+per-queue length limits and queue type, the delayed-retry queues and the dead-letter
+exchange with its parking queue. Running it again is harmless.
+
+Failed messages are never retried inline by a consumer. Instead they go through:
+    <queue>.retry.<n>  - delay queues (one per retry tier, exponentially longer TTL) that
+                         dead-letter back to <queue> once the delay has passed
+    park_dlx / Parking - dead-letter exchange and parking queue for messages that ran out of
+                         retries, overflowed a full queue or can never succeed
 """
 
+import os
+import sys
+
 import pika
 
-# Configuration
-AMQP_HOST = "localhost"
-AMQP_PORT = 5672
-EXCHANGE_NAME = "park_topic"
-EXCHANGE_TYPE = "topic"
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from amqp_topology import EXCHANGE_NAME, EXCHANGE_TYPE, QUEUES, declare_topology, door_queue
 
-# Queues to bind
-QUEUES = [
-    {"name": "Error", "routing_key": "error.*"},
-    {"name": "Access", "routing_key": "access.*"},
-]
+# Configuration
+AMQP_HOST = os.getenv("AMQP_HOST", "localhost")
+AMQP_PORT = int(os.getenv("AMQP_PORT", "5672"))
+DOOR_IDS = os.getenv("DOOR_IDS", "main").split(",")  # Doors whose command queues are declared
 
 
 def create_exchange(hostname, port, exchange_name, exchange_type):
@@ -67,49 +74,16 @@ def create_exchange(hostname, port, exchange_name, exchange_type):
         raise
 
 
-def create_queue(channel, exchange_name, queue_name, routing_key):
-    """
-    Declare a queue and bind it to an exchange with a specific routing key.
-
-    This function declares a durable queue and binds it to a given exchange using the
-    provided routing key.
-
-    Args:
-        channel (pika.adapters.blocking_connection.BlockingChannel): The channel connected to RabbitMQ.
-        exchange_name (str): The name of the exchange to bind the queue to.
-        queue_name (str): The name of the queue to declare.
-        routing_key (str): The routing key used for binding the queue.
-
-    Raises:
-        Exception: If the queue declaration or binding fails.
-    """
-    try:
-        print(f"📬 Declaring queue: {queue_name}")
-        channel.queue_declare(queue=queue_name, durable=True)
-
-        print(f"🔗 Binding queue '{queue_name}' to exchange '{exchange_name}' with routing key '{routing_key}'")
-        channel.queue_bind(
-            exchange=exchange_name,
-            queue=queue_name,
-            routing_key=routing_key
-        )
-    except Exception as e:
-        print(f"❌ Failed to create or bind queue '{queue_name}': {e}")
-        raise
-
-
 if __name__ == "__main__":
     """
     Main execution block.
 
-    This block connects to the RabbitMQ broker, declares the exchange, and creates/binds the queues.
+    This block connects to the RabbitMQ broker and declares the exchanges and queues.
     It catches exceptions that may occur during the setup process.
     """
     try:
         channel = create_exchange(AMQP_HOST, AMQP_PORT, EXCHANGE_NAME, EXCHANGE_TYPE)
-
-        for q in QUEUES:
-            create_queue(channel, EXCHANGE_NAME, q["name"], q["routing_key"])
+        declare_topology(channel, QUEUES + [door_queue(door_id) for door_id in DOOR_IDS])
 
         print("✅ RabbitMQ setup completed successfully.")
 
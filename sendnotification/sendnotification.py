@@ -3,27 +3,36 @@
 A standalone script to consume RabbitMQ messages
 
 This module sets up a RabbitMQ consumer that listens on multiple queues defined by routing keys.
-Depending on the message type, it performs various actions such as logging errors, handling access
-attempts, and sending notifications via Telegram or email. Environment variables for external services
+Depending on the message type, it performs various actions such as logging errors, alerting staff
+about failed access attempts, and sending notifications via Telegram or email. Access logs are
+written by logsink, not here. Environment variables for external services
 are loaded using dotenv.
 
 Modules:
-    time, pika, os, json, requests: Standard libraries and external dependencies.
+    functools, time, pika, os, requests: Standard libraries and external dependencies.
     dotenv: To load environment variables.
 """
 
+import functools
 import time
 import pika
 import os
-import json
+import sys
 import requests
 from dotenv import load_dotenv
+from opentelemetry.trace import SpanKind
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from amqp_topology import RETRY_DELAYS_MS, declare_topology, queues_named, retry_queue_name
+from events import decode, to_log_entry
+from tracing import init_tracing, inject_headers, start_span
 
 # -------------------------------
 # Environment
 # -------------------------------
 
 load_dotenv()
+init_tracing("sendnotification")
 
 # -------------------------------
 # RabbitMQ Configuration
@@ -31,26 +40,62 @@ load_dotenv()
 
 AMQP_HOST = "rabbitmq"
 AMQP_PORT = 5672
-EXCHANGE_NAME = "park_topic"
-EXCHANGE_TYPE = "topic"
 
-QUEUES = {
-    "Error": "*.error",
-    "Access": "*.access",
-    "Notification": "payment.notification"
-}
+# Exchanges, queues and retry tiers are declared from amqp_topology.py.
+# Access events are written to the logs table by logsink (from the Access queue);
+# this consumer only sees them on AccessAlert to alert staff.
+QUEUES = queues_named("Error", "AccessAlert", "Notification")
+
+PREFETCH_COUNT = int(os.getenv("NOTIFICATION_PREFETCH", "10"))
+
+# Message headers carried across retries
+RETRY_COUNT_HEADER = "x-retry-count"
+COMPLETED_STEPS_HEADER = "x-completed-steps"
+ROUTING_KEY_HEADER = "x-original-routing-key"
 
 # -------------------------------
 # External Service URLs
 # -------------------------------
 
-LOG_URL = os.getenv("LOGS_URL")
 ERROR_URL = os.getenv("ERROR_URL")
 EMAIL_URL = os.getenv("EMAIL_URL")
 STAFF_URL = os.getenv("STAFF_URL")
 GUEST_URL = os.getenv("GUEST_URL")
 TELEGRAM_TOKEN = os.getenv("TOKEN")
-TELEGRAM_API_URL = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/sendMessage"
+TELEGRAM_API_BASE = os.getenv("TELEGRAM_API_BASE", "https://api.telegram.org")
+TELEGRAM_API_URL = f"{TELEGRAM_API_BASE}/bot{TELEGRAM_TOKEN}/sendMessage"
+
+# -------------------------------
+# Failure Handling
+# -------------------------------
+
+class PermanentError(Exception):
+    """A message that can never succeed (bad payload, unknown guest/staff); it is parked, not retried."""
+
+
+class Delivery:
+    """
+    The side effects of one message, tracked across retries.
+
+    Steps that succeeded on an earlier delivery are listed in the ``x-completed-steps``
+    header and skipped, so retrying after a partial failure (e.g. Telegram sent but
+    email failed) does not send the same OTP twice.
+    """
+
+    def __init__(self, completed=None):
+        self.completed = set(completed or [])
+        self.failed = []
+
+    def step(self, name, action, *args, **kwargs):
+        """Run ``action`` unless it already succeeded; record a failure instead of raising."""
+        if name in self.completed:
+            return
+        try:
+            action(*args, **kwargs)
+            self.completed.add(name)
+        except Exception as e:
+            print(f"❌ Step '{name}' failed: {e}")
+            self.failed.append(name)
 
 # -------------------------------
 # Utility: Send Telegram Message
@@ -64,18 +109,54 @@ def send_message(chat_id, text):
         chat_id (str/int): The Telegram chat ID to which the message should be sent.
         text (str): The text message to send.
 
-    Returns:
-        None
+    Raises:
+        requests.exceptions.RequestException: If the message could not be delivered.
+    """
+    response = requests.post(TELEGRAM_API_URL, json={"chat_id": chat_id, "text": text})
+    response.raise_for_status()
+    print("✅ Telegram message sent.")
 
-    Side Effects:
-        Prints the status of the Telegram message delivery.
+
+def send_email(to, subject, message):
     """
-    try:
-        response = requests.post(TELEGRAM_API_URL, json={"chat_id": chat_id, "text": text})
-        response.raise_for_status()
-        print("✅ Telegram message sent.")
-    except Exception as e:
-        print(f"❌ Failed to send Telegram message: {e}")
+    Send an email through the email service.
+
+    Raises:
+        requests.exceptions.RequestException: If the email service did not accept the email.
+    """
+    response = requests.post(EMAIL_URL, json={"to": to, "subject": subject, "message": message},
+                             headers=inject_headers())
+    response.raise_for_status()
+    print("📧 Email sent successfully.")
+
+
+def post_log(log_url, log_type, message):
+    """
+    Save a log entry through the logs or error service.
+
+    Raises:
+        Exception: If the entry was not created.
+    """
+    response = requests.post(log_url, json=message, headers=inject_headers())
+    if response.status_code != 201:
+        raise Exception(f"Failed to log {log_type}: {response.text}")
+    print(f"✅ {log_type} log saved.")
+
+
+def fetch_json(url, what):
+    """
+    GET a resource needed to process a message.
+
+    Raises:
+        PermanentError: If the resource does not exist.
+        Exception: If the service could not be reached (the message is retried).
+    """
+    response = requests.get(url, headers=inject_headers())
+    if response.status_code == 404:
+        raise PermanentError(f"{what} not found")
+    if response.status_code != 200:
+        raise Exception(f"Failed to fetch {what}: HTTP {response.status_code}")
+    return response.json()
 
 # -------------------------------
 # RabbitMQ Setup
@@ -116,8 +197,10 @@ def setup_rabbitmq():
     """
     Set up RabbitMQ exchange and queues.
 
-    Connects to RabbitMQ, declares the exchange and queues, and binds each queue to the exchange
-    using its corresponding routing key.
+    Connects to RabbitMQ and declares the shared topology from amqp_topology.py (exchange,
+    queues with their bindings and limits, retry tiers and the parking queue). Also enables
+    publisher confirms so that a failed message is only acknowledged once its retry copy is
+    safely queued.
 
     Returns:
         tuple: A tuple containing:
@@ -131,13 +214,10 @@ def setup_rabbitmq():
         connection = connect_to_rabbitmq()
         channel = connection.channel()
 
-        print(f"📦 Declaring exchange: {EXCHANGE_NAME}")
-        channel.exchange_declare(exchange=EXCHANGE_NAME, exchange_type=EXCHANGE_TYPE, durable=True)
+        declare_topology(channel, QUEUES)
 
-        for queue, routing_key in QUEUES.items():
-            print(f"📬 Declaring queue: {queue}")
-            channel.queue_declare(queue=queue, durable=True)
-            channel.queue_bind(exchange=EXCHANGE_NAME, queue=queue, routing_key=routing_key)
+        channel.confirm_delivery()
+        channel.basic_qos(prefetch_count=PREFETCH_COUNT)
 
         print("✅ RabbitMQ setup complete")
         return channel, connection
@@ -146,25 +226,135 @@ def setup_rabbitmq():
         raise
 
 # -------------------------------
-# Callback for Received Messages
+# Message Handling
 # -------------------------------
 
-def callback(channel, method, properties, body):
+def handle_message(event, delivery):
     """
-    Process incoming messages from RabbitMQ.
+    Perform the side effects of an event.
 
-    Decodes the JSON message and determines the action based on the routing key:
-      - For error messages, it sets the log endpoint to ERROR_URL.
-      - For access messages, it may fetch staff details and send Telegram alerts.
+    Determines the action based on the event type:
+      - For error messages, it logs the message to ERROR_URL.
+      - For access messages, it alerts every staff member on Telegram about locked-out staff.
       - For payment notifications, it fetches guest information and sends notifications via Telegram
         and email.
-      - Logs the message to an external API if applicable.
+
+    Each side effect runs as a step of ``delivery``; a failed step is recorded there and retried
+    later on its own, while the remaining steps still run.
+
+    Args:
+        event (dict): The decoded event envelope (see events.py).
+        delivery (Delivery): Completed and failed steps of this message.
+
+    Raises:
+        PermanentError: If the message can never be processed.
+        Exception: If a resource needed by every step could not be fetched.
+    """
+    message = event["data"]
+
+    if event["type"] == "error":
+        delivery.step("log", post_log, ERROR_URL, "Error", to_log_entry(event))
+
+    elif event["type"] == "access":
+        msg_type = message.get("type")
+        user_type = message.get("user_type")
+        if user_type == "staff" and msg_type == "Failed":
+            staff_id = message.get("user_id")
+            # One round trip: the staff name comes from the same list as the chat IDs
+            staff_members = fetch_json(STAFF_URL, "staff members")
+            staff_name = next((s.get("staff_name") for s in staff_members if s.get("staff_id") == staff_id), None)
+            if staff_name is None:
+                raise PermanentError(f"Staff {staff_id} not found")
+            for staff_member in staff_members:
+                chat_id = staff_member.get("chat_id")
+                if chat_id:
+                    delivery.step(f"telegram:{chat_id}", send_message, chat_id,
+                                  f"❌ {staff_name} has made multiple unsuccessful attempts to access Door 1.")
+                else:
+                    print(f"⚠️ No chat_id found for staff member {staff_member}")
+
+    elif event["type"] == "payment.notification":
+        guest_id = message.get("guest_id")
+        if not guest_id:
+            raise PermanentError("guest_id missing in message")
+
+        guest = fetch_json(f"{GUEST_URL}/{guest_id}", f"Guest {guest_id}").get("guest")
+        chat_id = guest.get("chat_id")
+        otp = guest.get("otp")
+        email = guest.get("guest_email")
+        print(f"📧 Sending OTP {otp} to {email}")
+
+        if chat_id:
+            delivery.step("telegram", send_message, chat_id, f"🎫 Your OTP is {otp}! Thanks for purchasing a ticket.")
+
+        if email:
+            delivery.step("email", send_email, email, "Ticket Purchase Confirmation", f"Your OTP is {otp}!")
+
+    else:
+        raise PermanentError(f"Unknown event type: {event['type']}")
+
+# -------------------------------
+# Callback for Received Messages
+# -------------------------------
+
+def park(channel, method, reason):
+    """Reject a message without requeueing, which dead-letters it to the parking queue."""
+    print(f"🪦 Parking message: {reason}")
+    channel.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+
+
+def schedule_retry(channel, method, properties, body, queue_name, routing_key, delivery):
+    """
+    Hand a failed message to its next retry tier, or park it when it has run out of retries.
+
+    The copy keeps the original headers (including trace-context) and records the retry
+    count, the original routing key and the steps that already succeeded. The original is
+    only acknowledged once the broker has confirmed the copy.
+    """
+    headers = dict(properties.headers or {})
+    attempt = int(headers.get(RETRY_COUNT_HEADER, 0)) + 1
+    if attempt > len(RETRY_DELAYS_MS):
+        park(channel, method, f"gave up after {attempt - 1} retries (failed: {', '.join(delivery.failed)})")
+        return
+
+    headers.update({
+        RETRY_COUNT_HEADER: attempt,
+        ROUTING_KEY_HEADER: routing_key,
+        COMPLETED_STEPS_HEADER: sorted(delivery.completed),
+    })
+    retry_queue = retry_queue_name(queue_name, attempt)
+    try:
+        channel.basic_publish(
+            exchange="",
+            routing_key=retry_queue,
+            body=body,
+            properties=pika.BasicProperties(delivery_mode=2, content_type=properties.content_type,
+                                            headers=headers),
+            mandatory=True,
+        )
+    except pika.exceptions.AMQPError as e:
+        park(channel, method, f"could not schedule retry on {retry_queue}: {e!r}")
+        return
+
+    print(f"⏳ Retry {attempt}/{len(RETRY_DELAYS_MS)} scheduled in {RETRY_DELAYS_MS[attempt - 1] // 1000}s "
+          f"(failed: {', '.join(delivery.failed)})")
+    channel.basic_ack(delivery_tag=method.delivery_tag)
+
+
+def callback(channel, method, properties, body, queue_name):
+    """
+    Process incoming messages from RabbitMQ.
+
+    Decodes the event (msgpack or JSON, by content_type) and performs its side effects. Nothing is retried inline: the
+    message is acknowledged when every step succeeded, moved to a delayed retry queue when a
+    step failed, and parked when it can never succeed or has exhausted its retries.
 
     Args:
         channel: The RabbitMQ channel.
         method: Delivery method containing routing key details.
         properties: Message properties.
-        body (bytes): The raw message body (JSON encoded).
+        body (bytes): The raw message body.
+        queue_name (str): The queue the message was consumed from.
 
     Returns:
         None
@@ -172,106 +362,39 @@ def callback(channel, method, properties, body):
     Side Effects:
         May send Telegram messages, emails, and log data via API.
     """
+    headers = properties.headers or {}
+    routing_key = headers.get(ROUTING_KEY_HEADER, method.routing_key)
+    delivery = Delivery(headers.get(COMPLETED_STEPS_HEADER))
+
     try:
-        message = json.loads(body)
-        routing_key = method.routing_key
-        print(f"📨 Received from {routing_key}: {message}")
-
-        if routing_key.endswith(".error"):
-            log_url = ERROR_URL
-            log_type = "Error"
-
-        elif routing_key.endswith(".access"):
-            log_url = LOG_URL
-            log_type = "Access"
-            msg_type = message.get("type")
-            user_type = message.get("user_type")
-            if user_type == "staff" and msg_type == "Failed":
-                staff_id = message.get("user_id")
-                try:
-                    # Fetch staff name from staff 
-                    response = requests.get(f"{STAFF_URL}/{staff_id}")
-                    staff = response.json()
-                    if response.status_code != 200:
-                        print(f"⚠️ Staff not found for ID {staff_id}")
-                        return
-
-                    staff_name = staff.get("staff_name")
-
-                    response = requests.get(STAFF_URL)
-                    staff_members = response.json()
-                    if response.status_code != 200:
-                        print("⚠️ Failed to fetch staff members.")
-                        return
-                    # print(staff_members)
-                    for staff_member in staff_members:
-                        chat_id = staff_member.get("chat_id")
-                        if chat_id:
-                            send_message(chat_id, f"❌ {staff_name} has made multiple unsuccessful attempts to access Door 1.")
-                        else:
-                            print(f"⚠️ No chat_id found for staff member {staff_member}")
-        
-                except Exception as e:
-                    print(f"❌ Failed to fetch staff: {e}")
-
-        elif routing_key == "payment.notification":
-            guest_id = message.get("guest_id")
-
-            if not guest_id:
-                print("⚠️ guest_id missing in message")
-                return
-
-            try:
-                response = requests.get(f"{GUEST_URL}/{guest_id}")
-                guest = response.json()
-                guest = guest.get("guest")
-
-                if response.status_code != 200:
-                    print(f"⚠️ Guest not found for ID {guest_id}")
-                    return
-
-                chat_id = guest.get("chat_id")
-                otp = guest.get("otp")
-                email = guest.get("guest_email")
-                print(f"📧 Sending OTP {otp} to {email}")
+        event = decode(body, properties.content_type, routing_key)
+        print(f"📨 Received {event['type']} from {routing_key}: {event['data']}")
+        handle_message(event, delivery)
+    except (PermanentError, ValueError) as e:
+        print(f"⚠️ Raw message: {body}")
+        park(channel, method, e)
+        return
+    except Exception as e:
+        print(f"🔥 Error processing message: {e}")
+        delivery.failed.append(type(e).__name__)
 
-                if chat_id:
-                    send_message(chat_id, f"🎫 Your OTP is {otp}! Thanks for purchasing a ticket.")
-
-                if email:
-                    try:
-                        email_response = requests.post(EMAIL_URL, json={
-                            "to": email,
-                            "subject": "Ticket Purchase Confirmation",
-                            "message": f"Your OTP is {otp}!"
-                        })
-                        email_response.raise_for_status()
-                        print("📧 Email sent successfully.")
-                    except Exception as e:
-                        print(f"❌ Failed to send email: {e}")
-
-            except Exception as e:
-                print(f"❌ Failed to fetch guest: {e}")
-
-            return  # No further logging for notifications
-
-        else:
-            print(f"⚠️ Unknown routing key: {routing_key}")
-            return
+    if delivery.failed:
+        schedule_retry(channel, method, properties, body, queue_name, routing_key, delivery)
+    else:
+        channel.basic_ack(delivery_tag=method.delivery_tag)
 
-        # POST log to API
-        try:
-            api_response = requests.post(log_url, json=message)
-            if api_response.status_code == 201:
-                print(f"✅ {log_type} log saved.")
-            else:
-                print(f"❌ Failed to log {log_type}: {api_response.text}")
-        except Exception as e:
-            print(f"❌ Logging error to {log_url} failed: {e}")
+def traced_callback(channel, method, properties, body, queue_name):
+    """
+    Run ``callback`` inside a CONSUMER span.
 
-    except Exception as e:
-        print(f"🔥 Error processing message: {e}")
-        print(f"⚠️ Raw message: {body}")
+    The span continues the trace carried in the message's AMQP headers, so the
+    notification work is linked to the request that published the event.
+    """
+    with start_span(f"consume {method.routing_key}", kind=SpanKind.CONSUMER,
+                    parent_headers=properties.headers or {},
+                    attributes={"messaging.source": queue_name,
+                                "messaging.rabbitmq.routing_key": method.routing_key}):
+        callback(channel, method, properties, body, queue_name)
 
 # -------------------------------
 # Start RabbitMQ Consumer
@@ -295,8 +418,9 @@ def start_rabbitmq_consumer():
         channel, connection = setup_rabbitmq()
 
         for queue in QUEUES:
-            channel.basic_consume(queue=queue, on_message_callback=callback, auto_ack=True)
-            print(f"🔎 Listening on queue: {queue} ({QUEUES[queue]})")
+            channel.basic_consume(queue=queue["name"],
+                                  on_message_callback=functools.partial(traced_callback, queue_name=queue["name"]))
+            print(f"🔎 Listening on queue: {queue['name']} ({queue['routing_key']})")
 
         print("🚀 Waiting for messages. Press Ctrl+C to stop.")
         channel.start_consuming()
@@ -0,0 +1,222 @@
+"""
+Staff credential cache and login lockout.
+
+Staff logins are checked without touching the database on the hot path:
+    - the staff table is cached in memory (one query, refreshed every STAFF_CACHE_TTL seconds
+      or when this service changes a staff row)
+    - passwords are stored as salted PBKDF2-SHA256 hashes ("pbkdf2_sha256$<iterations>$<salt>$<hash>");
+      a legacy plaintext password still verifies, and is replaced by its hash after the first
+      successful login
+    - failed attempts are counted in the database by ``staff_login_failed`` (see staff_lockout.sql),
+      an atomic increment, so failures on every staff instance add up; a run of failures older than
+      STAFF_LOCKOUT_WINDOW seconds expires, and STAFF_MAX_FAILED_ATTEMPTS failures inside the window
+      lock the account until an admin resets it. Each counted failure is reported through
+      ``on_change`` (a staff.changed event), so other instances reload the count at once
+    - upgraded password hashes are written back by a background thread
+
+A locked account is rejected before the password is hashed, so a brute-force burst against it
+costs neither CPU nor database work. Only failed attempts, and a successful login after failed
+ones, call the database.
+
+Environment:
+    STAFF_CACHE_TTL            - seconds before the cached staff table is reloaded (default: 60)
+    STAFF_PBKDF2_ITERATIONS    - PBKDF2 iterations for new hashes (default: 100000)
+    STAFF_MAX_FAILED_ATTEMPTS  - failures that lock an account (default: 3)
+    STAFF_LOCKOUT_WINDOW       - seconds a run of failed attempts counts towards a lockout (default: 900)
+"""
+
+import base64
+import hashlib
+import hmac
+import logging
+import os
+import secrets
+import threading
+import time
+
+CACHE_TTL = float(os.getenv("STAFF_CACHE_TTL", "60"))
+PBKDF2_ITERATIONS = int(os.getenv("STAFF_PBKDF2_ITERATIONS", "100000"))
+MAX_FAILED_ATTEMPTS = int(os.getenv("STAFF_MAX_FAILED_ATTEMPTS", "3"))
+LOCKOUT_WINDOW = float(os.getenv("STAFF_LOCKOUT_WINDOW", "900"))
+
+HASH_SCHEME = "pbkdf2_sha256"
+
+
+def hash_password(password, iterations=PBKDF2_ITERATIONS):
+    """Return a salted PBKDF2-SHA256 hash of ``password`` in the stored format."""
+    salt = secrets.token_bytes(16)
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode(), salt, iterations)
+    return "$".join((HASH_SCHEME, str(iterations),
+                     base64.b64encode(salt).decode(), base64.b64encode(digest).decode()))
+
+
+def is_hashed(stored):
+    return isinstance(stored, str) and stored.startswith(HASH_SCHEME + "$")
+
+
+def verify_password(password, stored):
+    """
+    Check a password against a stored hash (or a legacy plaintext password).
+
+    Returns:
+        bool: True if the password matches.
+    """
+    if not isinstance(password, str) or not isinstance(stored, str):
+        return False
+    if not is_hashed(stored):
+        return hmac.compare_digest(password.encode(), stored.encode())
+    try:
+        _, iterations, salt, digest = stored.split("$")
+        expected = base64.b64decode(digest)
+        actual = hashlib.pbkdf2_hmac("sha256", password.encode(), base64.b64decode(salt), int(iterations))
+    except ValueError:
+        return False
+    return hmac.compare_digest(actual, expected)
+
+
+def public_row(staff):
+    """A staff row without its password, for responses."""
+    return {k: v for k, v in staff.items() if k != "password"}
+
+
+class _WriteBehind:
+    """Background writer of staff row changes, coalesced per staff_id."""
+
+    def __init__(self, supabase):
+        self.supabase = supabase
+        self._pending = {}
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="staff-write-behind", daemon=True)
+        self._thread.start()
+
+    def submit(self, staff_id, fields):
+        with self._cond:
+            self._pending.setdefault(staff_id, {}).update(fields)
+            self._cond.notify()
+
+    def pending(self):
+        """Changes not yet written, as {staff_id: fields}."""
+        with self._cond:
+            return {staff_id: dict(fields) for staff_id, fields in self._pending.items()}
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                batch, self._pending = self._pending, {}
+            for staff_id, fields in batch.items():
+                try:
+                    self.supabase.table("staff").update(fields).eq("staff_id", staff_id).execute()
+                except Exception:
+                    logging.exception("Failed to persist staff %s changes; retrying", staff_id)
+                    with self._cond:
+                        self._pending[staff_id] = dict(fields, **self._pending.get(staff_id, {}))
+                    time.sleep(1)
+
+
+class StaffCredentials:
+    """
+    Cached staff credentials with a lockout counted in the database.
+
+    Args:
+        supabase (supabase.Client): Client used to load the staff table and persist changes.
+        on_change (Callable[[int, list[str]], None], optional): Called with the staff_id and the
+            columns written after a failed attempt is counted.
+    """
+
+    def __init__(self, supabase, on_change=None):
+        self.supabase = supabase
+        self._on_change = on_change
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._by_name = {}
+        self._loaded_at = None
+        self._generation = 0   # bumped by invalidate(), so a reload racing it is not trusted
+        self._writer = _WriteBehind(supabase)
+
+    def _stale(self):
+        with self._lock:
+            return self._loaded_at is None or time.monotonic() - self._loaded_at > CACHE_TTL
+
+    def _refresh(self):
+        """Reload the staff table if it is stale; the query runs outside ``_lock``, by one thread at a time."""
+        if not self._stale():
+            return
+        with self._load_lock:
+            if not self._stale():
+                return
+            generation = self._generation
+            rows = self.supabase.table("staff").select("*").execute().data or []
+            pending = self._writer.pending()
+            with self._lock:
+                self._by_name = {row["staff_name"]: dict(row, **pending.get(row["staff_id"], {})) for row in rows}
+                if generation == self._generation:
+                    self._loaded_at = time.monotonic()
+
+    def invalidate(self):
+        """Reload the staff table on the next lookup (call after changing staff rows)."""
+        with self._lock:
+            self._generation += 1
+            self._loaded_at = None
+
+    def login(self, staff_name, password):
+        """
+        Check a login attempt.
+
+        Returns:
+            tuple[str, dict | None]: ("ok" | "invalid" | "locked" | "not_found", the cached staff row).
+        """
+        self._refresh()
+        with self._lock:
+            staff = self._by_name.get(staff_name)
+            if staff is None:
+                return "not_found", None
+            if (staff.get("failed_attempts") or 0) >= MAX_FAILED_ATTEMPTS:
+                return "locked", dict(staff)
+            stored = staff["password"]
+
+        # Hash outside the lock so concurrent logins are not serialised behind PBKDF2
+        valid = verify_password(password, stored)
+
+        staff_id = staff["staff_id"]
+        if not valid:
+            rows = self.supabase.rpc("staff_login_failed", {
+                "p_staff_id": staff_id, "p_window_seconds": LOCKOUT_WINDOW, "p_max_attempts": MAX_FAILED_ATTEMPTS,
+            }).execute().data
+            if not rows:
+                return "not_found", None
+            self._store_count(staff, rows[0])
+            if self._on_change is not None:
+                self._on_change(staff_id, ["failed_attempts", "failed_window_start"])
+            return "invalid", dict(staff)
+
+        if staff.get("failed_attempts"):
+            # Cleared only if no other instance has locked the account meanwhile
+            rows = self.supabase.rpc("staff_login_succeeded", {
+                "p_staff_id": staff_id, "p_max_attempts": MAX_FAILED_ATTEMPTS,
+            }).execute().data
+            if not rows:
+                self.invalidate()
+                return "locked", dict(staff)
+            self._store_count(staff, rows[0])
+        if not is_hashed(stored):
+            upgraded = hash_password(password)
+            with self._lock:
+                staff["password"] = upgraded
+            self._writer.submit(staff_id, {"password": upgraded})
+        with self._lock:
+            return "ok", dict(staff)
+
+    def _store_count(self, staff, row):
+        with self._lock:
+            staff["failed_attempts"] = row.get("failed_attempts")
+            staff["failed_window_start"] = row.get("failed_window_start")
+
+    def reset(self, staff_id):
+        """Forget the failed attempts of a staff member after an admin reset."""
+        with self._lock:
+            for staff in self._by_name.values():
+                if staff["staff_id"] == staff_id:
+                    staff["failed_attempts"] = 0
+                    staff["failed_window_start"] = None
@@ -3,8 +3,16 @@ from flask_cors import CORS
 from supabase import create_client, Client
 from dotenv import load_dotenv
 import os
+import sys
 from flasgger import Swagger, swag_from
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from fast_responses import enable_fast_responses
+from tracing import instrument_app
+from http_cache import conditional
+from cache_invalidation import CacheInvalidator, ChangePublisher
+from credentials import StaffCredentials, hash_password, public_row, verify_password
+
 # ------------------------------
 # Supabase Setup
 # ------------------------------
@@ -14,6 +22,26 @@ url = os.getenv("SUPABASE_URL")
 key = os.getenv("SUPABASE_KEY")
 supabase: Client = create_client(url, key)
 
+# staff.changed events: published for other services' caches, and consumed so that
+# every staff instance drops its credential cache when any of them writes (see cache_invalidation.py)
+changes = ChangePublisher("staff")
+# Failed logins are counted in the database (see credentials.py and staff_lockout.sql)
+credentials = StaffCredentials(supabase, on_change=lambda staff_id, fields: changes.publish("staff", staff_id,
+                                                                                            "update", fields))
+invalidator = CacheInvalidator()
+invalidator.watch("staff", on_change=lambda change: credentials.invalidate(), on_reset=credentials.invalidate)
+invalidator.start()
+
+# Columns POST /lookup may return; never the password
+STAFF_COLUMNS = ("staff_id", "staff_name", "staff_tele", "chat_id", "failed_attempts")
+MAX_LOOKUP_IDS = 1000
+
+
+def publish_changes(op, rows, fields):
+    """Publish a staff.changed event for every row a write returned."""
+    for row in rows:
+        changes.publish("staff", row.get("staff_id"), op, fields)
+
 # ------------------------------
 # Flask Setup
 # ------------------------------
@@ -21,6 +49,8 @@ supabase: Client = create_client(url, key)
 app = Flask(__name__)
 Swagger(app)
 CORS(app)
+instrument_app(app, "staff")
+enable_fast_responses(app)
 staff_blueprint = Blueprint("staff", __name__)
 
 # ------------------------------
@@ -92,13 +122,16 @@ def create_staff():
         if not data or not required.issubset(data):
             return jsonify({"error": "Missing required fields"}), 400
 
-        response = supabase.table("staff").insert({
+        new_staff = {
             "staff_name": data["staff_name"],
-            "password": data["password"],
+            "password": hash_password(data["password"]),
             "staff_tele": data["staff_tele"]
-        }).execute()
+        }
+        response = supabase.table("staff").insert(new_staff).execute()
 
         if response.data:
+            credentials.invalidate()
+            publish_changes("insert", response.data, new_staff)
             return jsonify({"message": "Staff member created successfully"}), 201
         return jsonify({"error": "Failed to create staff member"}), 400
     except Exception as e:
@@ -144,14 +177,90 @@ def create_staff():
         }
     }
 })
+@conditional()
 def read_all_staff():
     try:
-        response = supabase.table("staff").select("*").execute()
+        response = supabase.table("staff").select("*").order("staff_id").execute()
         return jsonify(response.data), 200 if response.data else 404
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
+@staff_blueprint.route("/lookup", methods=["POST"])
+@swag_from({
+    'tags': ['Staff'],
+    'summary': 'Retrieve several staff members by ID',
+    'description': 'This endpoint retrieves the staff members with the given IDs in a single query, optionally '
+                   'returning only some of their columns. Passwords are never returned.',
+    'parameters': [
+        {
+            'name': 'body',
+            'in': 'body',
+            'required': True,
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'ids': {'type': 'array', 'items': {'type': 'integer'}, 'example': [1, 2, 3]},
+                    'fields': {'type': 'array', 'items': {'type': 'string'}, 'example': ['staff_id', 'chat_id']}
+                },
+                'required': ['ids']
+            }
+        }
+    ],
+    'responses': {
+        200: {
+            'description': 'Staff members found, and the IDs that were not',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'staff': {'type': 'array', 'items': {'type': 'object'}},
+                    'not_found': {'type': 'array', 'items': {'type': 'integer'}}
+                }
+            }
+        },
+        400: {
+            'description': 'Invalid ids or fields',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'error': {'type': 'string', 'example': 'ids must be a list of integers'}
+                }
+            }
+        },
+        500: {
+            'description': 'Server error',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'error': {'type': 'string', 'example': 'Server error: <error message>'}
+                }
+            }
+        }
+    }
+})
+def lookup_staff():
+    try:
+        data = request.get_json(silent=True) or {}
+        ids = data.get("ids")
+        if not isinstance(ids, list) or not all(isinstance(i, int) and not isinstance(i, bool) for i in ids):
+            return jsonify({"error": "ids must be a list of integers"}), 400
+        if len(ids) > MAX_LOOKUP_IDS:
+            return jsonify({"error": f"At most {MAX_LOOKUP_IDS} ids per request"}), 400
+        fields = data.get("fields") or list(STAFF_COLUMNS)
+        if not isinstance(fields, list) or not set(fields) <= set(STAFF_COLUMNS):
+            return jsonify({"error": f"fields must be among {', '.join(STAFF_COLUMNS)}"}), 400
+
+        ids = list(dict.fromkeys(ids))
+        # staff_id is always selected, to report the ids that were not found
+        columns = list(dict.fromkeys(["staff_id", *fields]))
+        rows = supabase.table("staff").select(*columns).in_("staff_id", ids).execute().data if ids else []
+        found = {row["staff_id"] for row in rows}
+        staff = [{k: v for k, v in row.items() if k in fields} for row in rows]
+        return jsonify({"staff": staff, "not_found": [i for i in ids if i not in found]}), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
 @staff_blueprint.route("/<int:staff_id>", methods=["GET"])
 @swag_from({
     'tags': ['Staff'],
@@ -197,6 +306,7 @@ def read_all_staff():
         }
     }
 })
+@conditional()
 def read_staff(staff_id):
     try:
         response = supabase.table("staff").select("*").eq("staff_id", staff_id).execute()
@@ -279,9 +389,13 @@ def update_staff(staff_id):
 
         if not update_data:
             return jsonify({"error": "No valid fields provided for update"}), 400
+        if "password" in update_data:
+            update_data["password"] = hash_password(update_data["password"])
 
         response = supabase.table("staff").update(update_data).eq("staff_id", staff_id).execute()
         if response.data:
+            credentials.invalidate()
+            publish_changes("update", response.data, update_data)
             return jsonify({"message": "Staff member updated successfully"}), 200
         return jsonify({"error": "Failed to update staff member"}), 400
     except Exception as e:
@@ -336,6 +450,8 @@ def delete_staff(staff_id):
     try:
         response = supabase.table("staff").delete().eq("staff_id", staff_id).execute()
         if response.data:
+            credentials.invalidate()
+            publish_changes("delete", response.data, ())
             return jsonify({"message": "Staff member deleted successfully"}), 200
         return jsonify({"error": "Staff member not found"}), 404
     except Exception as e:
@@ -419,23 +535,14 @@ def validate():
         if not data or "staff_name" not in data or "password" not in data:
             return jsonify({"error": "Missing staff_name or password"}), 400
 
-        response = supabase.table("staff").select("*").eq("staff_name", data["staff_name"]).execute()
-        if not response.data:
+        result, staff = credentials.login(data["staff_name"], data["password"])
+        if result == "not_found":
             return jsonify({"message": "Staff not found"}), 404
-
-        staff = response.data[0]
-
-        if staff.get("failed_attempts", 0) >= 3:
-            return jsonify({"message": "Account locked", "Staff": staff}), 403
-
-        if staff["password"] == data["password"]:
-            supabase.table("staff").update({"failed_attempts": 0}).eq("staff_name", data["staff_name"]).execute()
-            return jsonify({"message": "Login successful", "Staff": staff}), 200
-        else:
-            supabase.table("staff").update({
-                "failed_attempts": staff["failed_attempts"] + 1
-            }).eq("staff_name", data["staff_name"]).execute()
-            return jsonify({"message": "Invalid password"}), 401
+        if result == "locked":
+            return jsonify({"message": "Account locked", "Staff": public_row(staff)}), 403
+        if result == "ok":
+            return jsonify({"message": "Login successful", "Staff": public_row(staff)}), 200
+        return jsonify({"message": "Invalid password"}), 401
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -513,14 +620,16 @@ def update_staff_chat_id_by_tele_password():
         if not all(k in data for k in ("staff_tele", "password", "chat_id")):
             return jsonify({"error": "Missing staff_tele, password, or chat_id"}), 400
 
-        response = supabase.table("staff").select("*").eq("staff_tele", data["staff_tele"]).eq("password", data["password"]).execute()
-        if not response.data:
+        response = supabase.table("staff").select("*").eq("staff_tele", data["staff_tele"]).execute()
+        matches = [staff for staff in response.data if verify_password(data["password"], staff["password"])]
+        if not matches:
             return jsonify({"error": "Staff not found with provided credentials"}), 404
 
-        staff_id = response.data[0]["staff_id"]
+        staff_id = matches[0]["staff_id"]
         update_response = supabase.table("staff").update({"chat_id": data["chat_id"]}).eq("staff_id", staff_id).execute()
 
         if update_response.data:
+            publish_changes("update", update_response.data, ["chat_id"])
             return jsonify({"message": "Chat ID updated successfully"}), 200
         return jsonify({"error": "Failed to update Chat ID"}), 400
     except Exception as e:
@@ -653,9 +762,12 @@ def reset_staff_attempt():
             return jsonify({"error": "Staff not found with provided credentials"}), 404
 
         # Attempt to update staff attempts
-        update_response = supabase.table("staff").update({"failed_attempts": 0}).eq("staff_id", staff_id).execute()
+        update_response = supabase.table("staff").update({"failed_attempts": 0, "failed_window_start": None}) \
+            .eq("staff_id", staff_id).execute()
 
         if update_response.data:
+            credentials.reset(int(staff_id))
+            publish_changes("update", update_response.data, ["failed_attempts", "failed_window_start"])
             return jsonify({"message": f"{staff_name}'s attempts reset to 0"}), 200
         return jsonify({"error": "Failed to update Chat ID"}), 400
 
@@ -0,0 +1,47 @@
+-- Failed-login counting for staff (see staff/credentials.py).
+--
+-- Apply once in the Supabase SQL editor (or with psql) before deploying the staff service.
+-- Re-running it is harmless.
+--
+--   staff.failed_window_start   when the current run of failed attempts started
+--   staff_login_failed()        counts one failed attempt, atomically
+--   staff_login_succeeded()     clears the count, unless the account is locked
+--
+-- Every staff instance counts through these functions, so concurrent failures on any number of
+-- instances add up instead of overwriting each other. A run of failures expires once it is older
+-- than the window; an account that reached the maximum stays locked until an admin resets
+-- failed_attempts to 0.
+
+alter table staff add column if not exists failed_window_start timestamptz;
+
+-- Returns the updated row (none if the staff member does not exist)
+create or replace function staff_login_failed(p_staff_id bigint, p_window_seconds double precision,
+                                              p_max_attempts integer)
+returns setof staff
+language sql as $$
+    update staff
+    set failed_attempts = case
+            when coalesce(failed_attempts, 0) >= p_max_attempts then failed_attempts
+            when coalesce(failed_attempts, 0) = 0 or failed_window_start is null
+                 or failed_window_start < now() - make_interval(secs => p_window_seconds) then 1
+            else failed_attempts + 1
+        end,
+        failed_window_start = case
+            when coalesce(failed_attempts, 0) >= p_max_attempts then failed_window_start
+            when coalesce(failed_attempts, 0) = 0 or failed_window_start is null
+                 or failed_window_start < now() - make_interval(secs => p_window_seconds) then now()
+            else failed_window_start
+        end
+    where staff_id = p_staff_id
+    returning *;
+$$;
+
+-- Returns the updated row, or none if the account is locked (or does not exist)
+create or replace function staff_login_succeeded(p_staff_id bigint, p_max_attempts integer)
+returns setof staff
+language sql as $$
+    update staff
+    set failed_attempts = 0, failed_window_start = null
+    where staff_id = p_staff_id and coalesce(failed_attempts, 0) < p_max_attempts
+    returning *;
+$$;
@@ -1,9 +1,20 @@
 from flask import Flask, Blueprint, request, jsonify
 from flask_cors import CORS
+import asyncio
+import httpx
+import requests
 import stripe
 import os
+import sys
+import threading
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
 from flasgger import Swagger, swag_from
+from waitress import serve
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from fast_responses import enable_fast_responses
+from tracing import instrument_app
 
 
 # Load environment variables
@@ -11,11 +22,76 @@ load_dotenv()
 
 # Configure Stripe
 stripe.api_key = os.getenv("STRIPE_SK")
+stripe.api_base = os.getenv("STRIPE_API_BASE", stripe.api_base)  # e.g. a local Stripe mock
+
+# Stripe HTTP client tuning
+STRIPE_CONNECT_TIMEOUT = float(os.getenv("STRIPE_CONNECT_TIMEOUT", "5"))   # seconds
+STRIPE_READ_TIMEOUT = float(os.getenv("STRIPE_READ_TIMEOUT", "30"))        # seconds
+STRIPE_POOL_SIZE = int(os.getenv("STRIPE_POOL_SIZE", "50"))                # keep-alive connections
+STRIPE_MAX_RETRIES = int(os.getenv("STRIPE_MAX_RETRIES", "2"))
+STRIPE_ASYNC = os.getenv("STRIPE_ASYNC", "false").lower() == "true"
+STRIPE_MAX_IN_FLIGHT = int(os.getenv("STRIPE_MAX_IN_FLIGHT", "200"))       # async mode only
+STRIPE_WORKER_THREADS = int(os.getenv("STRIPE_WORKER_THREADS", "64"))
+
+
+def build_http_client():
+    """
+    Build the HTTP client used for every Stripe API call.
+
+    Requests share one keep-alive connection pool instead of opening a new TLS
+    connection per charge. In async mode the pool is an httpx.AsyncClient driven by
+    the background event loop below.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=STRIPE_POOL_SIZE, pool_block=True)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+    async_client = None
+    if STRIPE_ASYNC:
+        async_client = stripe.HTTPXClient(
+            timeout=httpx.Timeout(STRIPE_READ_TIMEOUT, connect=STRIPE_CONNECT_TIMEOUT)
+        )
+
+    return stripe.RequestsClient(
+        timeout=(STRIPE_CONNECT_TIMEOUT, STRIPE_READ_TIMEOUT),
+        session=session,
+        async_fallback_client=async_client,
+    )
+
+
+class AsyncChargeRunner:
+    """
+    Runs Stripe charges on a single background event loop.
+
+    Worker threads hand their charge to the loop and wait for the result, so all
+    in-flight charges in the process share one event loop and one connection pool.
+    STRIPE_MAX_IN_FLIGHT caps how many are outstanding against Stripe at once.
+    """
+
+    def __init__(self, max_in_flight):
+        self.loop = asyncio.new_event_loop()
+        self.semaphore = asyncio.Semaphore(max_in_flight)
+        threading.Thread(target=self.loop.run_forever, name="stripe-async", daemon=True).start()
+
+    async def _create(self, params):
+        async with self.semaphore:
+            return await stripe.Charge.create_async(**params)
+
+    def create(self, **params):
+        return asyncio.run_coroutine_threadsafe(self._create(params), self.loop).result()
+
+
+stripe.default_http_client = build_http_client()
+stripe.max_network_retries = STRIPE_MAX_RETRIES
+create_charge = AsyncChargeRunner(STRIPE_MAX_IN_FLIGHT).create if STRIPE_ASYNC else stripe.Charge.create
 
 # Flask app setup
 app = Flask(__name__)
 Swagger(app)
 CORS(app)
+instrument_app(app, "stripeservice")
+enable_fast_responses(app)
 
 # Blueprint for Stripe service routes
 payment_blueprint = Blueprint("stripeservice", __name__)
@@ -26,6 +102,13 @@ payment_blueprint = Blueprint("stripeservice", __name__)
     'summary': 'Create a charge',
     'description': 'This endpoint processes a payment by creating a charge using Stripe API.',
     'parameters': [
+        {
+            'name': 'Idempotency-Key',
+            'in': 'header',
+            'type': 'string',
+            'required': False,
+            'description': 'Forwarded to Stripe so that retries of the same charge are only applied once',
+        },
         {
             'name': 'amount',
             'in': 'body',
@@ -140,11 +223,12 @@ def charge():
             return jsonify({"error": "Missing required fields"}), 400
 
         # Create the charge using Stripe API
-        charge = stripe.Charge.create(
+        charge = create_charge(
             amount=data["amount"],
             currency=data["currency"],
             description=data["description"],
-            source=data["source"]
+            source=data["source"],
+            idempotency_key=request.headers.get("Idempotency-Key")
         )
 
         print("✅ Charge created:", charge["id"])
@@ -176,4 +260,6 @@ app.register_blueprint(payment_blueprint, url_prefix="/stripeservice")
 
 # Run the Flask app
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=8086)
+    print(f"🚀 Starting stripeservice ({'async' if STRIPE_ASYNC else 'sync'} Stripe client, "
+          f"{STRIPE_WORKER_THREADS} worker threads)")
+    serve(app, host="0.0.0.0", port=8086, threads=STRIPE_WORKER_THREADS)
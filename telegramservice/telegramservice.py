@@ -33,13 +33,13 @@ from telegram.ext import (
 )
 from google.oauth2 import service_account
 from google.auth.transport.requests import Request
-import pika
-import json
 
 # Local imports
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 from invokes import invoke_http
 from RabbitMQClient import RabbitMQClient
+from events import make_event
+from tracing import init_tracing
 
 # ------------------------------
 # Setup
@@ -53,6 +53,8 @@ GOOGLE_APPLICATION_CREDENTIALS = os.path.join(os.path.dirname(__file__), "esdloc
 staff_URL = os.getenv("STAFF_URL")
 guest_URL = os.getenv("GUEST_URL")
 
+init_tracing("telegramservice")
+
 bot = Bot(token=TOKEN)
 application = Application.builder().token(TOKEN).build()
 
@@ -255,14 +257,10 @@ async def broadcast_msg_received(update: Update, context: CallbackContext):
                     "user_type": "staff",
                     "action": "Broadcast",
                     "type": "Success",
-                    "message": f"Staff member {staff_info['staff_name']} broadcasted {msg}!"
+                    "name": staff_info["staff_name"],
+                    "detail": msg
                 }
-                rabbit_client.channel.basic_publish(
-                    exchange=exchange_name,
-                    routing_key="enterpark.access",
-                    body=json.dumps(data),
-                    properties=pika.BasicProperties(delivery_mode=2),
-                )
+                rabbit_client.publish("enterpark.access", make_event("access", data, "telegramservice"))
                 for cid in guest_response["chat_ids"]:
                     try:
                         await bot.send_message(chat_id=cid, text=msg)
@@ -1,20 +1,47 @@
 import logging
-from flask import Blueprint, Flask, jsonify
+import os
+import sys
+import time
+from flask import Blueprint, Flask, jsonify, request
 from flask_cors import CORS
 from flasgger import Swagger, swag_from
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from door import DEFAULT_HOLD_MS, DoorController, start_command_listener
+from tracing import instrument_app
+
 # --------------------------
 # Flask App Setup
 # --------------------------
 app = Flask(__name__)
 CORS(app)
 Swagger(app)  # Initialize Flasgger for Swagger documentation
+instrument_app(app, "testlock")
 
 # --------------------------
 # Blueprint Setup
 # --------------------------
 testlock_blueprint = Blueprint("testlock", __name__)
 
+# --------------------------
+# Simulated Relay
+# --------------------------
+RELAY_DELAY_MS = int(os.getenv("TESTLOCK_RELAY_DELAY_MS", "0"))  # Simulated relay switching time
+
+def engage_relay():
+    time.sleep(RELAY_DELAY_MS / 1000)
+    print("🔓 Lock Opened")
+
+def release_relay():
+    time.sleep(RELAY_DELAY_MS / 1000)
+    print("🔒 Lock Closed")
+
+door = DoorController(engage=engage_relay, release=release_relay)
+
+# Also take door commands over AMQP (door.<DOOR_ID>.command)
+if os.getenv("DOOR_COMMANDS_ENABLED", "false").lower() == "true":
+    start_command_listener(door, source="testlock")
+
 # --------------------------
 # Routes
 # --------------------------
@@ -52,7 +79,7 @@ testlock_blueprint = Blueprint("testlock", __name__)
 })
 def open_lock():
     try:
-        print("🔓 Lock Opened")
+        door.open()
         return jsonify({"message": "Lock opened"}), 200
     except Exception as e:
         logging.exception("Error opening lock")
@@ -92,12 +119,73 @@ def open_lock():
 })
 def close_lock():
     try:
-        print("🔒 Lock Closed")
+        door.close()
         return jsonify({"message": "Lock closed"}), 200
     except Exception as e:
         logging.exception("Error closing lock")
         return jsonify({"error": str(e)}), 500
 
+@testlock_blueprint.route("/pulse", methods=["GET"])
+@swag_from({
+    'tags': ['Test Lock'],
+    'summary': 'Pulse the test lock',
+    'description': 'Simulates opening the lock for hold_ms milliseconds and closing it on a timer. A pulse while the lock is open extends the window.',
+    'parameters': [
+        {
+            'name': 'hold_ms',
+            'in': 'query',
+            'type': 'integer',
+            'required': False,
+            'description': 'Milliseconds to hold the lock open (default 3000)'
+        }
+    ],
+    'responses': {
+        200: {
+            'description': 'Lock opened (or window extended)',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'lock_state': {'type': 'boolean', 'example': True},
+                    'opened_at': {'type': 'string', 'example': '2024-04-04T12:30:41.120'},
+                    'closes_at': {'type': 'string', 'example': '2024-04-04T12:30:44.120'},
+                    'closed_at': {'type': 'string', 'example': '2024-04-04T12:29:02.415'},
+                    'hold_ms': {'type': 'integer', 'example': 3000},
+                    'extended': {'type': 'boolean', 'example': False}
+                }
+            }
+        },
+        400: {
+            'description': 'Invalid hold_ms',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'error': {'type': 'string', 'example': 'hold_ms must be between 1 and 30000'}
+                }
+            }
+        }
+    }
+})
+def pulse_lock():
+    try:
+        return jsonify(door.pulse(int(request.args.get("hold_ms", DEFAULT_HOLD_MS)))), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logging.exception("Error pulsing lock")
+        return jsonify({"error": str(e)}), 500
+
+@testlock_blueprint.route("/get_state", methods=["GET"])
+@swag_from({
+    'tags': ['Test Lock'],
+    'summary': 'Get the test lock state',
+    'description': 'Returns whether the simulated lock is open and its last actuation timestamps.',
+    'responses': {
+        200: {'description': 'Current lock state'}
+    }
+})
+def get_lock_state():
+    return jsonify(door.state()), 200
+
 # --------------------------
 # Register Blueprint
 # --------------------------
@@ -0,0 +1,174 @@
+"""
+Distributed tracing helpers for ESD Lockdown Parker.
+
+Propagates W3C trace-context (``traceparent`` / ``tracestate``) across the HTTP
+calls made through ``invoke_http`` and the AMQP messages published through
+``RabbitMQClient``, so a single ticket purchase shows up as one trace from
+makepayment all the way to the Telegram/email notification.
+
+Exporter selection (first match wins):
+    OTEL_EXPORTER_OTLP_ENDPOINT - export over OTLP/HTTP to a local collector (e.g. http://jaeger:4318)
+    TRACE_FILE                  - append finished spans as JSON lines to this file
+    (neither)                   - spans are still created and propagated, but not exported
+"""
+
+import os
+import threading
+from contextlib import contextmanager
+
+from opentelemetry import context, propagate, trace
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import BatchSpanProcessor, SpanExporter, SpanExportResult
+from opentelemetry.trace import SpanKind, Status, StatusCode
+
+OTLP_ENDPOINT = os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT")
+TRACE_FILE = os.getenv("TRACE_FILE")
+
+_init_lock = threading.Lock()
+_initialised = False
+
+
+class JsonFileSpanExporter(SpanExporter):
+    """Append finished spans to a file, one JSON document per line."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def export(self, spans):
+        try:
+            with self._lock, open(self.path, "a") as f:
+                for span in spans:
+                    f.write(span.to_json(indent=None) + "\n")
+            return SpanExportResult.SUCCESS
+        except OSError as e:
+            print(f"⚠️ Failed to export spans to {self.path}: {e}")
+            return SpanExportResult.FAILURE
+
+    def shutdown(self):
+        pass
+
+
+def init_tracing(service_name):
+    """
+    Configure the global tracer provider for this process (only the first call has an effect).
+
+    Args:
+        service_name (str): Name reported as ``service.name`` on every span.
+
+    Returns:
+        opentelemetry.trace.Tracer: A tracer for the calling service.
+    """
+    global _initialised
+    with _init_lock:
+        if not _initialised:
+            service_name = os.getenv("OTEL_SERVICE_NAME", service_name)
+            provider = TracerProvider(resource=Resource.create({"service.name": service_name}))
+
+            if OTLP_ENDPOINT:
+                from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+                provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+                print(f"🛰️ Exporting traces for {service_name} to {OTLP_ENDPOINT}")
+            elif TRACE_FILE:
+                provider.add_span_processor(BatchSpanProcessor(JsonFileSpanExporter(TRACE_FILE)))
+                print(f"🛰️ Writing traces for {service_name} to {TRACE_FILE}")
+
+            trace.set_tracer_provider(provider)
+            _initialised = True
+    return trace.get_tracer(service_name)
+
+
+def get_tracer():
+    """Return the tracer for the current process."""
+    return trace.get_tracer("parker")
+
+
+def inject_headers(headers=None):
+    """
+    Return a copy of ``headers`` with the current trace-context added.
+
+    Args:
+        headers (dict, optional): Existing headers (HTTP or AMQP).
+
+    Returns:
+        dict: Headers carrying ``traceparent`` (and ``tracestate`` if present).
+    """
+    carrier = dict(headers or {})
+    propagate.inject(carrier)
+    return carrier
+
+
+def extract_context(headers):
+    """Build a parent context from incoming HTTP or AMQP headers."""
+    return propagate.extract(headers or {})
+
+
+@contextmanager
+def start_span(name, kind=SpanKind.INTERNAL, parent_headers=None, attributes=None):
+    """
+    Start a span as the current span for the duration of the ``with`` block.
+
+    Args:
+        name (str): Span name.
+        kind (SpanKind): Span kind (SERVER, CLIENT, PRODUCER, CONSUMER, INTERNAL).
+        parent_headers (dict, optional): Incoming headers to continue a remote trace from.
+        attributes (dict, optional): Initial span attributes.
+    """
+    parent = extract_context(parent_headers) if parent_headers is not None else None
+    with get_tracer().start_as_current_span(
+        name, context=parent, kind=kind, attributes=attributes
+    ) as span:
+        yield span
+
+
+def instrument_app(app, service_name):
+    """
+    Create a SERVER span for every request handled by a Flask app.
+
+    The span continues the caller's trace when a ``traceparent`` header is present,
+    and is made current so that outgoing ``invoke_http`` calls and AMQP publishes
+    inside the view become its children.
+
+    Args:
+        app (flask.Flask): The Flask application to instrument.
+        service_name (str): Name reported as ``service.name``.
+    """
+    from flask import g, request
+
+    tracer = init_tracing(service_name)
+
+    @app.before_request
+    def _start_server_span():
+        route = request.url_rule.rule if request.url_rule else request.path
+        span = tracer.start_span(
+            f"{request.method} {route}",
+            context=extract_context(request.headers),
+            kind=SpanKind.SERVER,
+            attributes={"http.method": request.method, "http.target": request.path},
+        )
+        g._trace_span = span
+        g._trace_token = context.attach(trace.set_span_in_context(span))
+
+    @app.after_request
+    def _record_status(response):
+        span = g.get("_trace_span")
+        if span is not None:
+            span.set_attribute("http.status_code", response.status_code)
+            if response.status_code >= 500:
+                span.set_status(Status(StatusCode.ERROR))
+        return response
+
+    @app.teardown_request
+    def _end_server_span(exc):
+        span = g.pop("_trace_span", None)
+        if span is None:
+            return
+        if exc is not None:
+            span.record_exception(exc)
+            span.set_status(Status(StatusCode.ERROR, str(exc)))
+        span.end()
+        context.detach(g.pop("_trace_token"))